@@ -0,0 +1,85 @@
+"""Measures how long a fresh process takes to import the app, create it and serve its first request.
+
+Every step is timed in a new Python process, so nothing is cached between runs. The
+import of google.cloud.storage is measured on its own too, it is the part of a cold
+start that the app now defers until the first storage call. The first request runs on
+the local storage driver, so no credentials or network are needed.
+
+Usage:
+python -m benchmarks.bench_import --runs 10 --output import_results.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from .run import percentile
+
+# Each snippet prints the seconds its measured part took
+SNIPPETS = {
+    "import google.cloud.storage": """
+import time
+start = time.perf_counter()
+from google.cloud import storage
+print(time.perf_counter() - start)
+""",
+    "import flaskr": """
+import time
+start = time.perf_counter()
+import flaskr
+print(time.perf_counter() - start)
+""",
+    "import flaskr + create_app": """
+import time
+start = time.perf_counter()
+from flaskr import create_app
+app = create_app({"TESTING": True})
+print(time.perf_counter() - start)
+""",
+    "cold start to first response": """
+import sys, time
+start = time.perf_counter()
+from flaskr import create_app
+app = create_app({"TESTING": True, "STORAGE_DRIVER": "local", "STORAGE_ROOT": sys.argv[1]})
+response = app.test_client().get("/about")
+assert response.status_code == 200, response.status_code
+print(time.perf_counter() - start)
+""",
+}
+
+
+def time_snippet(code, root):
+    '''Runs code in a new interpreter and returns the seconds it reported.'''
+    output = subprocess.run([sys.executable, "-c", code, root], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        for name, code in SNIPPETS.items():
+            samples = [time_snippet(code, root) for _ in range(args.runs)]
+            result = {"name": name, "runs": args.runs,
+                      "p50_ms": percentile(samples, 50) * 1000,
+                      "p95_ms": percentile(samples, 95) * 1000,
+                      "min_ms": min(samples) * 1000}
+            print(f"{name:<32} p50={result['p50_ms']:8.1f}ms p95={result['p95_ms']:8.1f}ms min={result['min_ms']:8.1f}ms")
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results}, f, indent=2)
+        print(f"results saved to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
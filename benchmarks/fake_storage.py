@@ -0,0 +1,148 @@
+"""In-memory stand-in for google.cloud.storage.Client used by the benchmarks.
+
+Every storage call sleeps for a configurable latency, like a round-trip to the cloud
+would, and is counted so a benchmark can report how many calls each operation made.
+
+Typical Usage:
+client = FakeClient(latency=0.005)
+client.get_bucket('wiki-content-techx').blob('pages/abra').upload_from_string('{}')
+client.calls  # Counter({'get_bucket': 1, 'upload': 1})
+"""
+
+from collections import Counter
+import io
+import itertools
+import threading
+import time
+
+
+class FakeClient:
+
+    def __init__(self, latency=0.0):
+        """
+        Args:
+            latency: Seconds every storage call takes.
+        """
+        self.latency = latency
+        self.buckets = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.generations = itertools.count(1)
+
+    def call(self, kind):
+        '''Counts a storage call and waits for its latency.'''
+        with self.lock:
+            self.calls[kind] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = Counter()
+
+    def get_bucket(self, name):
+        self.call("get_bucket")
+        return self.bucket(name)
+
+    def bucket(self, name):
+        with self.lock:
+            if name not in self.buckets:
+                self.buckets[name] = FakeBucket(self, name)
+            return self.buckets[name]
+
+
+class FakeBucket:
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        # blob name -> (data, content_type, generation)
+        self.objects = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        self.client.call("get_blob")
+        if name not in self.objects:
+            return None
+        blob = FakeBlob(self, name)
+        blob.load_metadata()
+        return blob
+
+    def list_blobs(self, prefix="", start_offset=None, max_results=None):
+        self.client.call("list_blobs")
+        blobs = []
+        for name in sorted(self.objects):
+            if max_results is not None and len(blobs) >= max_results:
+                break
+            if name.startswith(prefix) and (start_offset is None or name >= start_offset):
+                blob = FakeBlob(self, name)
+                blob.load_metadata()
+                blobs.append(blob)
+        return iter(blobs)
+
+    def put(self, name, data, content_type="application/octet-stream"):
+        '''Stores a blob without counting a call, used to seed the bucket.'''
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.objects[name] = (data, content_type, next(self.client.generations))
+
+
+class FakeBlob:
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+        self.content_type = None
+        self.size = None
+
+    def load_metadata(self):
+        data, self.content_type, self.generation = self.bucket.objects[self.name]
+        self.size = len(data)
+
+    def read_bytes(self):
+        self.bucket.client.call("read")
+        return self.bucket.objects[self.name][0]
+
+    def download_as_bytes(self, if_generation_match=None):
+        return self.read_bytes()
+
+    def download_as_string(self, if_generation_match=None):
+        return self.read_bytes()
+
+    def download_as_text(self):
+        return self.read_bytes().decode("utf-8")
+
+    def open(self, mode="r"):
+        if mode == "rb":
+            return io.BytesIO(self.read_bytes())
+        if mode in ("r", "rt"):
+            return io.StringIO(self.read_bytes().decode("utf-8"))
+        return _FakeWriter(self)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        self.bucket.client.call("write")
+        if if_generation_match is not None:
+            current = self.bucket.objects.get(self.name, (None, None, 0))[2]
+            if current != if_generation_match:
+                from google.api_core.exceptions import PreconditionFailed
+                raise PreconditionFailed(f"{self.name} does not have generation {if_generation_match}")
+        self.bucket.put(self.name, data, content_type or "application/octet-stream")
+        self.load_metadata()
+
+    def upload_from_file(self, file, content_type=None, if_generation_match=None):
+        self.upload_from_string(file.read(), content_type, if_generation_match)
+
+
+class _FakeWriter(io.StringIO):
+
+    def __init__(self, blob):
+        super().__init__()
+        self.blob = blob
+
+    def close(self):
+        if not self.closed:
+            self.blob.upload_from_string(self.getvalue())
+        super().close()
@@ -0,0 +1,235 @@
+"""Benchmarks the backend and the main routes against a fake bucket with injected latency.
+
+The fake bucket is seeded with N wiki pages, M leaderboard users and the full pokedex.
+Every benchmark is run several times and reports the p50/p95/p99 latency and the number
+of storage calls per run, the first (cold) run is reported separately. Results are saved
+as JSON so runs from two commits can be compared.
+
+Usage:
+python -m benchmarks.run --pages 100 1000 10000 --users 1000 --latency-ms 2 --output before.json
+python -m benchmarks.run --compare before.json after.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from .fake_storage import FakeClient
+
+CONTENT_BUCKET = "wiki-content-techx"
+USERS_BUCKET = "users-passwords-techx"
+
+TYPES = ["Normal", "Fire", "Water", "Grass", "Electric", "Ice", "Fighting", "Poison", "Ground",
+         "Flying", "Psychic", "Bug", "Rock", "Ghost", "Dragon", "Dark", "Steel", "Fairy"]
+REGIONS = ["Kanto", "Johto", "Hoenn", "Sinnoh", "Unova", "Kalos", "Alola", "Galar"]
+NATURES = ["Hardy", "Lonely", "Brave", "Adamant", "Naughty", "Bold", "Docile", "Relaxed", "Impish",
+           "Lax", "Timid", "Hasty", "Serious", "Jolly", "Naive", "Modest", "Mild", "Quiet",
+           "Bashful", "Rash", "Calm", "Gentle", "Sassy", "Careful", "Quirky"]
+MAX_ID = 386
+# Small stand-in for a sprite, the benchmarks measure calls and latency rather than bandwidth
+SPRITE = b"\x89PNG\r\n\x1a\n" + bytes(1024)
+
+
+def seed_bucket(client, pages, users, rng):
+    '''Fills the fake buckets with pages, users, the pokedex and the static images.'''
+    content = client.bucket(CONTENT_BUCKET)
+    passwords = client.bucket(USERS_BUCKET)
+
+    content.put("pages/", b"")
+    for i in range(pages):
+        name = f"pokemon{i:05d}"
+        page = {"name": name.capitalize(), "type": rng.choice(TYPES), "region": rng.choice(REGIONS),
+                "nature": rng.choice(NATURES), "level": str(rng.randint(1, 100)), "desc": "A pokemon.",
+                "owner": "Benchmark", "image-name": f"{name}.png", "image-type": "image/png"}
+        content.put(f"pages/{name}", json.dumps(page), "application/json")
+        content.put(f"images/{name}.png", SPRITE, "image/png")
+
+    ranks_list = []
+    for i in range(users):
+        name = f"user{i:05d}"
+        points = rng.randrange(0, 100000, 50)
+        ranks_list.append({"name": name, "points": points})
+        passwords.put(name, "hashed password", "text/plain")
+        content.put(f"user_game_ranking/game_users/{name}", json.dumps({"name": name, "points": points}),
+                    "application/json")
+        content.put(f"user_game_ranking/seen/{name}", json.dumps({}), "application/json")
+    ranks_list.sort(key=lambda user: (-user["points"], user["name"]))
+    content.put("user_game_ranking/ranks_list.json", json.dumps({"ranks_list": ranks_list}), "application/json")
+
+    pokedex = [{"id": id, "name": {"english": f"Pokemon{id}"}, "type": [rng.choice(TYPES)]}
+               for id in range(1, MAX_ID + 1)]
+    content.put("master_pokedex/pokedex.json", json.dumps(pokedex), "application/json")
+    for id in range(1, MAX_ID + 1):
+        content.put("master_pokedex/images/{:03d}.png".format(id), SPRITE, "image/png")
+    content.put("master_pokedex/images/pokeball.png", SPRITE, "image/png")
+
+    for image in ["logo.jpg", "javier.png", "edgar.png", "mark.png", "trophy.png"]:
+        content.put(f"authors/{image}", SPRITE, "image/png")
+    categories = {"types": TYPES, "regions": REGIONS, "natures": NATURES}
+    content.put("filtering/categories.json", json.dumps(categories), "application/json")
+
+
+def percentile(samples, percent):
+    '''Nearest-rank percentile of the samples.'''
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def measure(name, client, func, iterations, **labels):
+    '''Runs func once cold and then iterations times, returning its latency and storage call stats.'''
+    client.reset_calls()
+    start = time.perf_counter()
+    func()
+    cold = time.perf_counter() - start
+    cold_calls = dict(client.calls)
+
+    client.reset_calls()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    calls = {kind: count / iterations for kind, count in sorted(client.calls.items())}
+
+    result = dict(labels, name=name, iterations=iterations,
+                  cold_ms=cold * 1000,
+                  p50_ms=percentile(samples, 50) * 1000,
+                  p95_ms=percentile(samples, 95) * 1000,
+                  p99_ms=percentile(samples, 99) * 1000,
+                  mean_ms=sum(samples) / len(samples) * 1000,
+                  cold_storage_calls=cold_calls,
+                  storage_calls_per_run=calls)
+    print(f"{name:<40} pages={labels['pages']:<6} p50={result['p50_ms']:8.2f}ms p95={result['p95_ms']:8.2f}ms "
+          f"p99={result['p99_ms']:8.2f}ms cold={result['cold_ms']:9.2f}ms calls/run={sum(calls.values()):.1f}")
+    return result
+
+
+def make_app(client):
+    '''Creates the Flask app running on the given storage client.'''
+    from flaskr import create_app, pages
+    from flaskr.backend import Backend
+
+    app = create_app({"TESTING": True, "WTF_CSRF_ENABLED": False})
+    pages.backend = Backend(client)
+    return app, pages.backend
+
+
+def run_benchmarks(page_counts, users, latency, iterations, seed):
+    results = []
+    for page_count in page_counts:
+        rng = random.Random(seed)
+        client = FakeClient(latency=latency)
+        seed_bucket(client, page_count, users, rng)
+        app, backend = make_app(client)
+        labels = {"pages": page_count, "users": users}
+
+        results.append(measure("backend.get_pages_using_filter_and_search", client,
+                               lambda: backend.get_pages_using_filter_and_search("pokemon1", "Fire", None, None, "LowestToHighest"),
+                               iterations, **labels))
+        results.append(measure("backend.get_pages_using_search", client,
+                               lambda: backend.get_pages_using_search("mon00"), iterations, **labels))
+
+        scores = iter(range(10 ** 6))
+        results.append(measure("backend.update_points", client,
+                               lambda: backend.update_points(f"user{rng.randrange(users):05d}", next(scores) * 10),
+                               iterations, **labels))
+
+        http = app.test_client()
+        with http.session_transaction() as session:
+            session["_user_id"] = "user00000"
+            session["_fresh"] = True
+
+        def get(path):
+            response = http.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+
+        def post_filter():
+            response = http.post("/pages", data={"search": "", "sorting": "HighestToLowest", "type": "Water"})
+            assert response.status_code == 200, response.status_code
+
+        def new_round():
+            # reloading /game shows the same round, so the round is forgotten to time picking a new one
+            with http.session_transaction() as session:
+                session.pop("round_id", None)
+            get("/game")
+
+        def guess_and_next_round():
+            get("/game")
+            response = http.post("/game", data={"user_guess": "Missingno"})
+            assert response.status_code == 302, response.status_code
+            get("/game")
+
+        results.append(measure("GET /game", client, new_round, iterations, **labels))
+        results.append(measure("POST /game + GET /game", client, guess_and_next_round, iterations, **labels))
+        results.append(measure("GET /pages", client, lambda: get("/pages"), iterations, **labels))
+        results.append(measure("POST /pages (filter)", client, post_filter, iterations, **labels))
+        results.append(measure("GET /leaderboard", client, lambda: get("/leaderboard"), iterations, **labels))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path, after_path):
+    '''Prints the p50 and p95 change of every benchmark between two result files.'''
+    with open(before_path) as f:
+        before = {(result["name"], result["pages"]): result for result in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = json.load(f)["results"]
+
+    for result in after:
+        old = before.get((result["name"], result["pages"]))
+        if old is None:
+            continue
+        p50 = result["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float("inf")
+        p95 = result["p95_ms"] / old["p95_ms"] if old["p95_ms"] else float("inf")
+        calls = sum(result["storage_calls_per_run"].values()) - sum(old["storage_calls_per_run"].values())
+        print(f"{result['name']:<40} pages={result['pages']:<6} p50 x{p50:6.2f}  p95 x{p95:6.2f}  calls/run {calls:+.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="latency of every storage call")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=386)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run_benchmarks(args.pages, args.users, args.latency_ms / 1000, args.iterations, args.seed)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "latency_ms": args.latency_ms,
+            "iterations": args.iterations,
+            "users": args.users,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results saved to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ from flask import Flask
 from .pages import login_manager
 
 import logging
+import os
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -21,7 +22,14 @@ def create_app(test_config=None):
     login_manager.login_view = 'login'
     # This is the default secret key used for login sessions
     # By default the dev environment uses the key 'dev'
-    app.config.from_mapping(SECRET_KEY='dev',)
+    app.config.from_mapping(
+        SECRET_KEY='dev',
+        # WIKI_STORAGE_DRIVER=local runs the wiki on the folder WIKI_STORAGE_ROOT instead of the cloud
+        STORAGE_DRIVER=os.environ.get("WIKI_STORAGE_DRIVER", "gcs"),
+        STORAGE_ROOT=os.environ.get("WIKI_STORAGE_ROOT"),
+        # WIKI_PRELOAD=1 loads the hot data while the app is created instead of on first use
+        PRELOAD=os.environ.get("WIKI_PRELOAD") == "1",
+    )
 
     if test_config is None:
         # Load the instance config, if it exists, when not testing.
@@ -34,5 +42,9 @@ def create_app(test_config=None):
     # TODO(Project 1): Make additional modifications here for logging in, backends
     # and additional endpoints.
 
+    # the backend doesn't touch the cloud until the first request needs it
+    pages.backend = pages.create_backend(app.config)
     pages.make_endpoints(app)
+    if app.config["PRELOAD"]:
+        pages.backend.preload()
     return app
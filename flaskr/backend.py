@@ -12,33 +12,341 @@ login = backend.sign_in('javier', 'pokemon123')
 image = get_image('pokemon/charmander')
 """
 
-from google.cloud import storage
 import base64
 import hashlib
 from flask import json, render_template, flash, redirect, url_for
 from .user import User
-from secrets import randbelow
+from .page_index import PageIndex
+from .manifest import PageManifest
+from .versions import VersionStore
+from .pokedex import PokedexStore
+from .blob_store import BlobStore
+from .cache import ByteLRUCache
+from .leaderboard import Leaderboard
+from .seen import SeenPokemon
+from .game_round import GameRound, new_round_id, round_key, ROUND_BYTES
+from .prefetch import RoundPrefetcher
+from .sprite_archive import SpriteArchive, pack_sprites
+from .storage_drivers import make_client
+import threading
+import os
+import re
+import shutil
+import tempfile
+import mimetypes
+import logging
+import time
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import namedtuple
 
 MAX_ID = 386
 
+# Bucket names can be overridden per deployment with environment variables
+CONTENT_BUCKET = os.environ.get("WIKI_CONTENT_BUCKET", "wiki-content-techx")
+USERS_BUCKET = os.environ.get("WIKI_USERS_BUCKET", "users-passwords-techx")
+
+# Raw bytes of an image blob with what is needed to serve it over HTTP
+ImageFile = namedtuple("ImageFile", ["data", "content_type", "generation"])
+
+POKEBALL_PATH = "master_pokedex/images/pokeball.png"
+
+# Every pokemon sprite packed in one blob, see sprite_archive.py, and where instances keep their copy
+SPRITE_ARCHIVE_PATH = "master_pokedex/sprites.pack"
+SPRITE_CACHE_DIR = os.environ.get("WIKI_SPRITE_CACHE_DIR", tempfile.gettempdir())
+SPRITE_PATTERN = re.compile(r"master_pokedex/images/(\d+)\.png")
+
+# Images shown on the home, about, leaderboard and game pages, read into the image cache by preload
+PRELOAD_IMAGES = ("authors/logo.jpg", "authors/javier.png", "authors/edgar.png", "authors/mark.png",
+                  "authors/trophy.png", POKEBALL_PATH)
+
+# Image cache budget, uploaded images can be replaced so they expire after an hour
+IMAGE_CACHE_BYTES = 32 * 1024 * 1024
+IMAGE_CACHE_TTLS = {"images/": 3600}
+
+# Logged in users are loaded on every request, their password hash is cached for five minutes
+USER_CACHE_BYTES = 1024 * 1024
+USER_CACHE_TTL = 300
+
+# WIKI_PAGE_MANIFEST=1 keeps page metadata in manifest shards so the page index is built from a few reads
+USE_MANIFEST = os.environ.get("WIKI_PAGE_MANIFEST") == "1"
+
+# WIKI_CATEGORIES_FROM_INDEX=1 lists the categories used by the pages instead of reading categories.json
+CATEGORIES_FROM_INDEX = os.environ.get("WIKI_CATEGORIES_FROM_INDEX") == "1"
+
+# Number of page names shown per page of the /pages listing
+PAGE_SIZE = 50
+
+# Active game rounds and how long a round can stay unanswered
+ROUND_CACHE_BYTES = 4 * 1024 * 1024
+ROUND_TTL = 3600
+
+# WIKI_PREFETCH_ROUNDS=0 stops preparing the next round of each player while they guess
+PREFETCH_ROUNDS = os.environ.get("WIKI_PREFETCH_ROUNDS", "1") == "1"
+
+# How many times saving the leaderboard is retried when another instance saved it first
+LEADERBOARD_RETRIES = 5
+
+# Number of threads used to run independent storage calls of a request together
+MAX_WORKERS = 8
+
+
+logger = logging.getLogger(__name__)
+
+
+def pokemon_image_path(id):
+    """Returns the name of the image blob of the pokemon with the given id."""
+    return "master_pokedex/images/" + "{:03d}".format(id) + ".png"
+
+
 class Backend:
 
     def __init__(self,
-                 client=storage.Client(),
+                 client=None,
                  hashfunc=hashlib,
                  base64func=base64,
-                 json=json):
+                 json=json,
+                 content_bucket=CONTENT_BUCKET,
+                 users_bucket=USERS_BUCKET,
+                 image_cache=None,
+                 user_cache=None,
+                 max_workers=MAX_WORKERS,
+                 use_manifest=USE_MANIFEST,
+                 client_factory=make_client,
+                 categories_from_index=CATEGORIES_FROM_INDEX,
+                 prefetch_rounds=PREFETCH_ROUNDS,
+                 sprite_dir=SPRITE_CACHE_DIR):
         """
         Args:
-            client: Dependency injection for mocking the cloud storage client.
+            client: Dependency injection for mocking the cloud storage client, created
+                    with client_factory on first use when None.
             hashfunc: Dependency injection for mocking the hashlib module.
             base64func: Dependency injection for mocking the base64 module.
             json: Dependency injection for mocking the json module.
+            content_bucket: Name of the bucket with pages, images and game data.
+            users_bucket: Name of the bucket with the user passwords.
+            image_cache: Cache shared by every image read, a ByteLRUCache by default.
+            user_cache: Cache of the User objects returned by get_user, a ByteLRUCache by default.
+            max_workers: Size of the thread pool used by submit and gather.
+            use_manifest: Whether uploads append to the page manifest and the page index is read from it.
+            client_factory: Function that creates the storage client, a GCS client by default.
+            categories_from_index: Whether categories are the values used by the pages in the page index
+                                   instead of the ones in filtering/categories.json.
+            prefetch_rounds: Whether the next round of each player is prepared in the background.
+            sprite_dir: Local folder where the downloaded sprite archive is kept and mapped.
         """
+        # the client is only created when storage is first used, so creating a backend is cheap
         self.client = client
+        self.client_factory = client_factory
+        self.client_lock = threading.Lock()
         self.hashfunc = hashfunc
         self.base64func = base64func
         self.json = json
+        self.content_bucket = content_bucket
+        self.users_bucket = users_bucket
+
+        # bucket handles are resolved once and reused for the lifetime of the backend
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.bucket_lookups = 0
+
+        # thread pool for independent storage calls, created on first use
+        self.max_workers = max_workers
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        # marks the threads of the pool, see submit
+        self.pool_thread = threading.local()
+
+        # image bytes are shared by get_image, get_pokemon_image, get_pokeball and /images
+        if image_cache is None:
+            image_cache = ByteLRUCache(IMAGE_CACHE_BYTES, IMAGE_CACHE_TTLS)
+        self.image_cache = image_cache
+
+        # users are loaded by Flask-Login on every authenticated request
+        if user_cache is None:
+            user_cache = ByteLRUCache(USER_CACHE_BYTES, {"": USER_CACHE_TTL})
+        self.user_cache = user_cache
+
+        # in-memory index of page metadata, built from the bucket on first use
+        self.page_index = None
+        self.page_index_lock = threading.Lock()
+        # page name -> generation of its blob, used to revalidate rendered pages
+        self.page_generations = {}
+        # the index is refreshed in the background, one refresh at a time, see schedule_page_index_refresh
+        self.page_index_refresh = None
+        self.page_index_refreshing = False
+        self.page_index_refresh_again = False
+
+        # compact copy of the page metadata, see manifest.py
+        self.use_manifest = use_manifest
+        self.manifest = PageManifest(self.get_content_bucket, json=self.json, gather=self.gather)
+
+        # leaderboard is loaded from ranks_list.json on first use and kept sorted in memory
+        self.leaderboard = None
+        # generation of ranks_list.json the leaderboard was loaded from, writes are made over it
+        self.leaderboard_generation = None
+        self.leaderboard_lock = threading.RLock()
+        self.leaderboard_write_lock = threading.Lock()
+
+        # pokedex is downloaded once and only reloaded when its blob changes
+        self.pokedex = PokedexStore(self.get_pokedex_blob, json=self.json)
+
+        # categories.json almost never changes, it is kept like the pokedex
+        self.categories_from_index = categories_from_index
+        self.categories = BlobStore(self.get_categories_blob, self.json.loads)
+
+        # rounds of the game that are waiting for a guess, see game_round.py
+        self.rounds = ByteLRUCache(ROUND_CACHE_BYTES, {"rounds/": ROUND_TTL})
+        self.rounds_lock = threading.Lock()
+        # next round of each player, prepared while they guess the current one, see prefetch.py
+        self.prefetch_rounds = prefetch_rounds
+        self.prefetcher = RoundPrefetcher(self.submit_background, self.warm_pokemon, self.is_prepared_round_current)
+
+        # sprites are served from the memory-mapped archive when it exists, see sprite_archive.py
+        self.sprites = None
+        self.sprites_loaded = False
+        self.sprites_lock = threading.Lock()
+        self.sprite_dir = sprite_dir
+
+        # caches are dropped when another instance changes their data, see versions.py
+        self.versions = VersionStore(self.get_content_bucket)
+        self.versions.watch("pages", self.schedule_page_index_refresh)
+        self.versions.watch("leaderboard", self.drop_leaderboard)
+        self.versions.watch("pokedex", self.pokedex.expire)
+        self.versions.watch("categories", self.categories.expire)
+        self.versions.watch("sprites", self.drop_sprite_archive)
+
+    def get_client(self):
+        """Returns the storage client, creating it the first time."""
+        if self.client is None:
+            with self.client_lock:
+                if self.client is None:
+                    self.client = self.client_factory()
+        return self.client
+
+    def get_bucket(self, name):
+        """ Returns the handle of a bucket, only asking the cloud for it the first time.
+        Args:
+            name: Name of the bucket.
+        Returns:
+            bucket: The bucket handle.
+        """
+        bucket = self.buckets.get(name)
+        if bucket is not None:
+            return bucket
+
+        with self.buckets_lock:
+            # another thread may have resolved the bucket while we were waiting
+            if name not in self.buckets:
+                self.buckets[name] = self.get_client().get_bucket(name)
+                self.bucket_lookups += 1
+        return self.buckets[name]
+
+    def get_content_bucket(self):
+        """Returns the bucket with pages, images and game data."""
+        return self.get_bucket(self.content_bucket)
+
+    def get_users_bucket(self):
+        """Returns the bucket with the user passwords."""
+        return self.get_bucket(self.users_bucket)
+
+    def submit(self, func, *args):
+        """ Runs func(*args) on the backend's thread pool.
+        The call sees the same context as the caller, e.g. the current Flask request.
+        Calls made from a thread of the pool run right away on that thread instead.
+        Args:
+            func: Function to call.
+            args: Arguments for the function.
+        Returns:
+            future: concurrent.futures.Future with the result of the call.
+        """
+        if getattr(self.pool_thread, "active", False):
+            # a call on the pool waiting for another call on the pool waits forever once every
+            # thread is busy doing the same, e.g. a preloaded page index gathering its shards
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as error:
+                future.set_exception(error)
+            return future
+        context = contextvars.copy_context()
+        return self.get_executor().submit(context.run, func, *args)
+
+    def submit_background(self, func, *args):
+        """ Runs func(*args) on the backend's thread pool outside of the current request.
+        Meant for work nobody waits for, so its storage calls aren't counted against the request.
+        Args:
+            func: Function to call.
+            args: Arguments for the function.
+        Returns:
+            future: concurrent.futures.Future with the result of the call.
+        """
+        return self.get_executor().submit(contextvars.Context().run, func, *args)
+
+    def get_executor(self):
+        '''Returns the thread pool, creating it on first use.'''
+        if self.executor is None:
+            with self.executor_lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                       thread_name_prefix="backend",
+                                                       initializer=self.mark_pool_thread)
+        return self.executor
+
+    def mark_pool_thread(self):
+        self.pool_thread.active = True
+
+    def gather(self, *calls):
+        """ Runs independent calls together and waits for all of them.
+        Args:
+            calls: Tuples of a function followed by its arguments.
+        Returns:
+            results: List with the result of every call, in the same order as the calls.
+        Raises:
+            The first exception raised by a call, after every call finished.
+        """
+        futures = [self.submit(call[0], *call[1:]) for call in calls]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        return [future.result() for future in futures]
+
+    def preload(self):
+        """ Loads the data every instance needs into memory, all parts at the same time.
+            Meant to run before an instance takes traffic, e.g. from the App Engine warmup request.
+        Returns:
+            timings: Dictionary mapping each part to the seconds it took, or to the error it raised.
+        """
+        parts = {
+            "versions": (self.versions.check,),
+            "categories": (self.get_categories,),
+            "pokedex": (self.pokedex.load,),
+            "leaderboard": (self.get_leaderboard_engine,),
+            "page_index": (self.get_page_index,),
+            "sprites": (self.get_sprite_archive,),
+        }
+        for blob_name in PRELOAD_IMAGES:
+            parts[blob_name] = (self.get_image_file, blob_name)
+
+        futures = {name: self.submit(self.timed, *call) for name, call in parts.items()}
+        timings = {}
+        for name, future in futures.items():
+            try:
+                timings[name] = future.result()
+            except Exception as error:
+                # a missing part is loaded again by the first request that needs it
+                logger.warning("preloading %s failed: %s", name, error)
+                timings[name] = repr(error)
+        logger.info("preloaded %s", timings)
+        return timings
+
+    @staticmethod
+    def timed(func, *args):
+        """Calls func(*args) and returns the seconds it took."""
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
 
     def get_wiki_page(self, name):
         """ Retrieves user generated page from cloud storage and returns it.
@@ -47,37 +355,80 @@ class Backend:
         Returns:
             content: The user generated page data.
         """
-        bucket = self.client.get_bucket('wiki-content-techx')
+        bucket = self.get_content_bucket()
         blob = bucket.get_blob(f'pages/{name}')
+        self.page_generations[name] = blob.generation
 
         # reading json object blob and returning its contents
         with blob.open('r') as f:
             content = f.read()
         return content
 
+    def get_wiki_page_generation(self, name):
+        """ Returns the generation of a user generated page, only asking the cloud the first time.
+            Pages can't be overwritten once uploaded, so the generation only changes if another
+            instance deletes and uploads the page again, which the page index refresh notices.
+        Args:
+            name: The name of the user generated page.
+        Returns:
+            generation: Generation of the page blob, None if the page doesn't exist.
+        """
+        generation = self.page_generations.get(name)
+        if generation is None:
+            blob = self.get_content_bucket().get_blob(f'pages/{name}')
+            if blob is None:
+                return None
+            generation = self.page_generations[name] = blob.generation
+        return generation
+
     def get_all_page_names(self):
         """ Retrieves the names of all user generated pages and returns a list containing them.
         Returns:
             page_names: List that contains all user generated page names as strings.
         """
-        bucket = self.client.get_bucket('wiki-content-techx')
+        bucket = self.get_content_bucket()
         blobs = bucket.list_blobs(prefix='pages/')
         page_names = []
 
-        # adding every blob to page_names except the first blob since it's just the folder name
-        for index, blob in enumerate(blobs):
-            if index == 0:
+        # adding every blob to page_names except the folder placeholder
+        for blob in blobs:
+            if blob.name.endswith('/'):
                 continue
             page_names.append(blob.name)
         return page_names
 
+    def get_page_names(self, page_token=None, page_size=PAGE_SIZE):
+        """ Retrieves one page of user generated page names.
+        Args:
+            page_token: Token returned with the previous page, None for the first page.
+            page_size: Maximum number of page names to return.
+        Returns:
+            Tuple with the page names and the token of the next page, None on the last page.
+        """
+        page_index = self.page_index
+        if page_index is not None:
+            with self.page_index_lock:
+                return page_index.page(page_token, page_size)
+
+        # without the index only the requested names are listed, so the first page costs
+        # one small listing however many pages the wiki has
+        bucket = self.get_content_bucket()
+        # the listing starts at the token itself, plus the folder placeholder and one more name
+        # to know if there is a next page
+        blobs = bucket.list_blobs(prefix='pages/', start_offset=page_token, max_results=page_size + 3)
+        page_names = [blob.name for blob in blobs
+                      if not blob.name.endswith('/') and blob.name != page_token]
+        if len(page_names) > page_size:
+            return page_names[:page_size], page_names[page_size - 1]
+        return page_names, None
+
     def upload(self, file, pokemon_data):
         """ Uploads image data and user generated page data to the cloud storage.
         Args:
             file: The image file uploaded by the user.
             pokemon_data: A dictionary with all data associated with user generated page.
         """
-        bucket = self.client.get_bucket('wiki-content-techx')
+        bucket = self.get_content_bucket()
 
         path = 'pages/' + pokemon_data["name"].lower()
         blob = bucket.get_blob(path)
@@ -86,6 +437,7 @@ class Backend:
             # uploading user image of pokemon to the images blob
             images = bucket.blob(f'images/{file.filename}')
             images.upload_from_file(file)
+            self.image_cache.invalidate(f'images/{file.filename}')
 
             # adding image name to pokemon dictionary
             pokemon_data["image-name"] = file.filename
@@ -101,6 +453,15 @@ class Backend:
             blob.upload_from_string(data=json_obj,
                                     content_type="application/json")
 
+            if self.use_manifest:
+                self.manifest.append(path, pokemon_data)
+
+            # keeping the page index in sync without rebuilding it
+            with self.page_index_lock:
+                if self.page_index is not None:
+                    self.page_index.insert(path, pokemon_data)
+            self.versions.bump("pages")
+
             return True
 
         return False
@@ -108,45 +469,75 @@ class Backend:
     def sign_up(self, username, password):
         """ Uploads user account information to the cloud storage if account doesn't already exist.
             Creates a hashed password from user password and uploads new password to cloud storage.
+            The password, game and seen blobs are written together, each one only if it doesn't
+            exist yet, so a taken username is detected by the write itself and two signups racing
+            for the same name can't both succeed. If any write fails the created blobs are deleted.
         Args:
             username: The username that the user inputs.
             password: The password that the user inputs.
+        Returns:
+            True if the account was created, False if the username is taken.
         """
-        bucket = self.client.get_bucket('users-passwords-techx')
-
-        game_users_bucket = self.client.get_bucket('wiki-content-techx')
-        path = f'user_game_ranking/game_users/{username}'
+        bucket = self.get_users_bucket()
+        game_users_bucket = self.get_content_bucket()
+
+        # salting the password with username and a secret word
+        salt = f"{username}jmepokemon{password}"
+        # generating hashed password after the salting
+        hashed_password = self.hashfunc.blake2b(salt.encode()).hexdigest()
+
+        # new user in the ranking blob
+        game_str = self.json.dumps({"name": username, "points": 0})
+        # empty because a new user has not encountered any yet
+        seen_str = self.json.dumps(SeenPokemon().to_json())
+
+        # the game blobs of an existing user already exist, so they are never overwritten
+        blobs = [(bucket, username, hashed_password, "text/plain"),
+                 (game_users_bucket, f'user_game_ranking/game_users/{username}', game_str, "application/json"),
+                 (game_users_bucket, f'user_game_ranking/seen/{username}', seen_str, "application/json")]
+        futures = [self.submit(self.create_blob, *blob) for blob in blobs]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            # an account without its game blobs can't play, so the blobs this signup created are
+            # removed and signing up again starts over
+            for (target, path, _, _), future in zip(blobs, futures):
+                if future.exception() is None and future.result():
+                    self.delete_blob(target, path)
+            raise errors[0]
 
         # if an account with that username already exists we shouldn't be creating a new one
-        if bucket.get_blob(username):
+        if not futures[0].result():
             return False
-        else:
-            blob = bucket.blob(username)
 
-            # salting the password with username and a secret word
-            salt = f"{username}jmepokemon{password}"
-            # generating hashed password after the salting
-            hashed_password = self.hashfunc.blake2b(salt.encode()).hexdigest()
+        self.invalidate_user(username)
+        return True
 
-            # writing hashed password to the new user blob we created
-            with blob.open('w') as f:
-                f.write(hashed_password)
-
-            # Adds new user to the ranking blob
-            game_blob = game_users_bucket.blob(path)
-            json_obj = {"name": username, "points": 0, "rank": None}
-            json_str = self.json.dumps(json_obj)
-            game_blob.upload_from_string(data=json_str,
-                                         content_type="application/json")
+    def create_blob(self, bucket, path, data, content_type):
+        """ Writes a blob only if it doesn't exist yet.
+        Args:
+            bucket: Bucket of the blob.
+            path: Name of the blob.
+            data: Contents of the blob.
+            content_type: Content type of the blob.
+        Returns:
+            True if the blob was created, False if it already existed.
+        """
+        from google.api_core.exceptions import PreconditionFailed
 
-            # Adds new user to the seen blob
-            seen_path = f'user_game_ranking/seen/{username}'
-            seen_blob = game_users_bucket.blob(seen_path)
-            seen_json = {} # empty because a new user has not encountered any yet
-            seen_str = self.json.dumps(seen_json)
-            seen_blob.upload_from_string(data=seen_str,content_type="application/json")
+        blob = bucket.blob(path)
+        try:
+            # generation 0 only matches a blob that doesn't exist
+            blob.upload_from_string(data=data, content_type=content_type, if_generation_match=0)
+        except PreconditionFailed:
+            return False
+        return True
 
-            return True
+    def delete_blob(self, bucket, path):
+        '''Deletes a blob, logging instead of raising if it can't be deleted.'''
+        try:
+            bucket.blob(path).delete()
+        except Exception as error:
+            logger.warning("could not delete %s: %s", path, error)
 
     def sign_in(self, username, password):
         """ Checks whether specific account information exists in the cloud storage.
@@ -156,7 +547,7 @@ class Backend:
             username: The username that the user inputs.
             password: The password that the user inputs.
         """
-        bucket = self.client.get_bucket('users-passwords-techx')
+        bucket = self.get_users_bucket()
         blob = bucket.get_blob(username)
 
         if blob:
@@ -168,6 +559,8 @@ class Backend:
             # reading hashed password from the username
             with blob.open('r') as f:
                 content = f.read()
+            # the stored hash is fresh, so the cached user is refreshed in case the password changed
+            self.cache_user(User(username, content))
             # checking whether the hashed password matches the password given
             if content == hashed_password:
                 return True
@@ -181,12 +574,143 @@ class Backend:
         Returns:
             image: Image data converted to base64 for front-end use.
         """
-        bucket = self.client.get_bucket('wiki-content-techx')
+        content = self.get_image_file(blob_name).data
+        image = self.base64func.b64encode(content).decode("utf-8")
+        return image
+
+    def get_image_file(self, blob_name):
+        """ Retrieves the raw bytes of an image blob together with its content type and generation.
+        Args:
+            blob_name: Name of the image blob.
+        Returns:
+            image: ImageFile with the image bytes, or None if the blob doesn't exist.
+        """
+        sprite = self.get_sprite(blob_name)
+        if sprite is not None:
+            return sprite
+
+        image = self.image_cache.get(blob_name)
+        if image is not None:
+            return image
+
+        image = self.read_image_blob(blob_name)
+        if image is not None:
+            self.image_cache.put(blob_name, image, size=len(image.data))
+        return image
+
+    def read_image_blob(self, blob_name):
+        '''Reads an image blob from storage, without the caches, None if it doesn't exist.'''
+        bucket = self.get_content_bucket()
         blob = bucket.get_blob(blob_name)
+        if not blob:
+            return None
         with blob.open('rb') as f:
             content = f.read()
-        image = self.base64func.b64encode(content).decode("utf-8")
-        return image
+
+        content_type = blob.content_type
+        if not isinstance(content_type, str) or not content_type.startswith("image/"):
+            content_type = mimetypes.guess_type(blob_name)[0] or "application/octet-stream"
+        return ImageFile(content, content_type, blob.generation)
+
+    def get_sprite(self, blob_name):
+        """ Returns a pokemon sprite from the sprite archive.
+        Args:
+            blob_name: Name of the image blob, e.g. master_pokedex/images/025.png
+        Returns:
+            ImageFile whose data is a memoryview of the archive, None if blob_name isn't a packed sprite.
+        """
+        match = SPRITE_PATTERN.fullmatch(blob_name)
+        if match is None:
+            return None
+        archive = self.get_sprite_archive()
+        if archive is None:
+            return None
+        data = archive.get(int(match.group(1)))
+        if data is None:
+            # sprites added after the archive was built are read one by one
+            return None
+        return ImageFile(data, "image/png", archive.generation)
+
+    def get_sprite_archive(self):
+        '''Returns the memory-mapped sprite archive, downloading it the first time, None if there is none.'''
+        if self.sprites_loaded:
+            return self.sprites
+        with self.sprites_lock:
+            if not self.sprites_loaded:
+                try:
+                    self.sprites = self.load_sprite_archive()
+                except Exception as error:
+                    # every sprite is read from its own blob until a later read loads the archive
+                    logger.warning("could not load the sprite archive: %s", error)
+                    return None
+                self.sprites_loaded = True
+        return self.sprites
+
+    def load_sprite_archive(self):
+        """ Downloads the sprite archive to a local file named after its generation and maps it.
+        Processes on the same machine share the file, so it is downloaded once and its pages
+        are shared by every worker. Files of older generations are deleted once it is mapped.
+        Returns:
+            SpriteArchive, None if the archive blob doesn't exist or is invalid.
+        Raises:
+            The error of the download, e.g. when the storage or the disk failed.
+        """
+        blob = self.get_content_bucket().get_blob(SPRITE_ARCHIVE_PATH)
+        if blob is None:
+            return None
+
+        path = os.path.join(self.sprite_dir, f"sprites-{blob.generation}.pack")
+        # written next to the final file and renamed, so no process maps a partial download
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            if not os.path.exists(path):
+                with blob.open("rb") as source, open(partial, "wb") as target:
+                    shutil.copyfileobj(source, target)
+                os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        try:
+            archive = SpriteArchive.open(path, blob.generation)
+        except ValueError as error:
+            # the blob stays invalid until the archive is built again, which bumps its version
+            logger.warning("invalid sprite archive: %s", error)
+            return None
+        self.remove_old_sprite_archives(blob.generation)
+        return archive
+
+    def remove_old_sprite_archives(self, generation):
+        '''Deletes the local files of archive generations older than generation, maps of them stay valid.'''
+        for name in os.listdir(self.sprite_dir):
+            match = re.fullmatch(r"sprites-(\d+)\.pack", name)
+            if match is None or int(match.group(1)) >= generation:
+                continue
+            try:
+                os.remove(os.path.join(self.sprite_dir, name))
+            except FileNotFoundError:
+                # another process removed it first
+                pass
+
+    def drop_sprite_archive(self):
+        '''Makes the next sprite read load the archive again, sprites already served stay valid.'''
+        with self.sprites_lock:
+            self.sprites = None
+            self.sprites_loaded = False
+
+    def build_sprite_archive(self):
+        """ Packs every pokemon sprite into the sprite archive blob, run it after changing the sprites.
+        Returns:
+            Number of sprites in the archive.
+        """
+        blob_names = [pokemon_image_path(id) for id in range(1, MAX_ID + 1)]
+        images = self.gather(*[(self.read_image_blob, blob_name) for blob_name in blob_names])
+        sprites = {id: image.data for id, image in enumerate(images, start=1) if image is not None}
+
+        blob = self.get_content_bucket().blob(SPRITE_ARCHIVE_PATH)
+        blob.upload_from_string(data=pack_sprites(sprites, MAX_ID), content_type="application/octet-stream")
+        self.versions.bump("sprites")
+        self.drop_sprite_archive()
+        return len(sprites)
 
     def get_user(self, username):
         """ Creates User object containing username and hashed password retreived from cloud storage.
@@ -195,16 +719,34 @@ class Backend:
         Returns:
             User(username, password): User object for account related use.
         """
-        bucket = self.client.get_bucket('users-passwords-techx')
+        user = self.user_cache.get(username)
+        if user is not None:
+            return user
+
+        bucket = self.get_users_bucket()
         blob = bucket.get_blob(username)
 
         if blob:
             with blob.open('r') as f:
                 password = f.read()
-            return User(username, password)
+            user = User(username, password)
+            self.cache_user(user)
+            return user
         else:
+            # unknown users aren't cached so they can sign up right away
             return None
 
+    def cache_user(self, user):
+        """Caches a user loaded from the password bucket."""
+        self.user_cache.put(user.username, user, size=len(user.username) + len(user.password))
+
+    def invalidate_user(self, username):
+        """ Drops a user from the cache, must be called whenever their password blob changes.
+        Args:
+            username: The username of the user.
+        """
+        self.user_cache.invalidate(username)
+
 #------------------------------------ Search Filter ------------------------------------#
     def get_pages_using_filter_and_search(self, name, type, region, nature, sorting):
         """ Retrieves all pages that match filter options selected by the user.
@@ -217,28 +759,149 @@ class Backend:
         Returns:
             page_names: The names of all pages that match filter criteria selected by user.
         """
-        bucket = self.client.get_bucket('wiki-content-techx')
+        page_index = self.get_page_index()
+        with self.page_index_lock:
+            return page_index.query(name, type, region, nature, sorting)
+
+    def get_page_index(self):
+        """ Returns the page metadata index, building it from the bucket the first time.
+        Returns:
+            page_index: PageIndex with the metadata of every user generated page.
+        """
+        page_index = self.page_index
+        if page_index is not None:
+            return page_index
+
+        with self.page_index_lock:
+            # another thread may have built the index while we were waiting
+            if self.page_index is None:
+                self.page_index = self.build_page_index()
+            return self.page_index
+
+    def schedule_page_index_refresh(self):
+        """ Refreshes the page index in the background, requests keep using the current index meanwhile.
+            A refresh asked for while one is running makes it run once more when it finishes.
+        Returns:
+            future: concurrent.futures.Future of the refresh.
+        """
+        with self.page_index_lock:
+            if self.page_index_refreshing:
+                self.page_index_refresh_again = True
+                return self.page_index_refresh
+            self.page_index_refreshing = True
+        try:
+            self.page_index_refresh = self.submit_background(self.run_page_index_refresh)
+        except Exception:
+            with self.page_index_lock:
+                self.page_index_refreshing = False
+            raise
+        return self.page_index_refresh
+
+    def run_page_index_refresh(self):
+        while True:
+            try:
+                self.refresh_page_index()
+            except Exception as error:
+                # the next pages version refreshes the index again
+                logger.warning("refreshing the page index failed: %s", error)
+            with self.page_index_lock:
+                if not self.page_index_refresh_again:
+                    self.page_index_refreshing = False
+                    return
+                self.page_index_refresh_again = False
+
+    def refresh_page_index(self):
+        """ Adds the pages uploaded by other instances to the page index, only reading their blobs.
+            The index is built again if a page was deleted or replaced, the old one is used until then.
+        """
+        page_index = self.page_index
+        if page_index is None and not self.page_generations:
+            return
+
+        bucket = self.get_content_bucket()
+        listed = {blob.name: blob.generation for blob in bucket.list_blobs(prefix='pages/')
+                  if not blob.name.endswith('/')}
+
+        with self.page_index_lock:
+            replaced = [name for name, generation in self.page_generations.items()
+                        if listed.get('pages/' + name) != generation]
+            for name in replaced:
+                del self.page_generations[name]
+            if page_index is None:
+                return
+            size = len(page_index)
+            rebuild = replaced or any(name not in listed for name in page_index.page_names)
+            new_pages = [name for name in listed if name not in page_index]
+
+        if rebuild:
+            new_index = self.build_page_index()
+            with self.page_index_lock:
+                if self.page_index is page_index and len(page_index) == size:
+                    self.page_index = new_index
+                elif self.page_index is page_index:
+                    # a page was uploaded here while the index was built, it may have missed it
+                    self.page_index_refresh_again = True
+            return
+
+        pages = self.gather(*[(self.read_page, name) for name in new_pages])
+        with self.page_index_lock:
+            # the index may have been dropped while the new pages were read
+            if self.page_index is page_index:
+                for page_name, pokemon_data in zip(new_pages, pages):
+                    page_index.insert(page_name, pokemon_data)
+
+    def read_page(self, page_name):
+        '''Downloads and parses one page blob, e.g. 'pages/charmander'.'''
+        blob = self.get_content_bucket().blob(page_name)
+        return self.json.loads(blob.download_as_string())
+
+    def drop_page_index(self):
+        """Forgets the page index so it is built again with pages uploaded by other instances."""
+        with self.page_index_lock:
+            self.page_index = None
+            self.page_generations = {}
+
+    def build_page_index(self):
+        """ Reads every user generated page once and indexes its metadata.
+        With the manifest enabled the metadata is read from its shards instead of the page blobs.
+        Returns:
+            page_index: PageIndex with the metadata of every user generated page.
+        """
+        pages = self.manifest.read() if self.use_manifest else None
+        if pages is None:
+            # the manifest is empty until it is compacted for the first time
+            pages = self.scan_pages()
+
+        page_index = PageIndex()
+        for page_name, pokemon_data in pages:
+            page_index.add(page_name, pokemon_data)
+        return page_index
+
+    def scan_pages(self):
+        """ Downloads every user generated page blob.
+        Returns:
+            pages: List of (page name, page data) tuples in listing order.
+        """
+        bucket = self.get_content_bucket()
         blobs = bucket.list_blobs(prefix='pages/')
-        page_content = []
-        page_names = []
+        pages = []
 
-        for index, blob in enumerate(blobs):
-            if index == 0:
+        for blob in blobs:
+            # skipping the folder placeholder
+            if blob.name.endswith('/'):
                 continue
             with blob.open('r') as f:
                 content = f.read()
-            pokemon_data = self.json.loads(content)
-            if (name == None or name.lower() in pokemon_data["name"].lower()) and (type == None or pokemon_data["type"] == type) and (region == None or pokemon_data["region"] == region) and (nature == None or pokemon_data["nature"] == nature):
-                page_names.append(blob.name)
-                if sorting:
-                    level = int(pokemon_data["level"])
-                    page_content.append([level, blob.name])
-                                        
-        if sorting:
-            return self.get_pages_using_sorting(page_content, sorting)
+            pages.append((blob.name, self.json.loads(content)))
 
-        return page_names
+        return pages
 
+    def compact_manifest(self):
+        """ Rewrites the page manifest from the page blobs, also used to create it the first time.
+        Returns:
+            Number of pages in the manifest.
+        """
+        return self.manifest.compact(self.scan_pages)
 
     def get_pages_using_sorting(self, pages_content, sorting):
         """ This function sorts the page names that meet the filter criteria by level.
@@ -248,8 +911,6 @@ class Backend:
         Returns:
             page_names: The names of the pages in the order determined by the sorting metric.
         """
-        bucket = self.client.get_bucket('wiki-content-techx')
-        
         if sorting == "LowestToHighest":
             pages_content.sort()
         if sorting == "HighestToLowest":
@@ -270,63 +931,170 @@ class Backend:
         Rturns:
             page_names: The name of the pages that match the given name.
         '''
-        bucket = self.client.get_bucket('wiki-content-techx')
-        blobs = bucket.list_blobs(prefix='pages/')
-        page_names = []
+        page_index = self.get_page_index()
+        with self.page_index_lock:
+            return page_index.search(name)
 
-        for index, blob in enumerate(blobs):
-            if index == 0:
-                continue
-            with blob.open('r') as f:
-                content = f.read()
-            content = self.json.loads(content)
-            if name in content["name"].lower():
-                page_names.append(blob.name)
-
-        return page_names
+    def autocomplete_page_names(self, prefix, limit=10):
+        '''Gets the pages whose pokemon name starts with the given prefix.
+        Args:
+            prefix: What the user typed so far in the search box.
+            limit: Maximum number of suggestions.
+        Returns:
+            List of (page name, pokemon name) tuples in alphabetical order.
+        '''
+        page_index = self.get_page_index()
+        with self.page_index_lock:
+            return page_index.autocomplete(prefix, limit)
 
 #------------------------------------ Game ------------------------------------#
+    def start_round(self, username):
+        """ Picks the next pokemon the user hasn't seen and keeps the round on the server.
+        Args:
+            username: Username of the current user playing.
+        Returns:
+            Tuple with the id of the round, to be kept in the user's session, and the GameRound.
+        """
+        # the round prepared after the player's last guess needs no storage calls
+        game_round = self.prefetcher.take(username)
+        if game_round is None:
+            # the pokedex is loaded at the same time in case it isn't in memory yet
+            seen, user, _ = self.gather((self.get_seen_pokemon, username),
+                                        (self.get_game_user, username),
+                                        (self.pokedex.load,))
+            game_round = GameRound(seen.next_id(), seen, user)
+        round_id = new_round_id()
+        self.rounds.put(round_key(username, round_id), game_round, size=ROUND_BYTES)
+        if self.prefetch_rounds:
+            self.prefetcher.schedule(username, game_round)
+        return round_id, game_round
+
+    def get_round(self, username, round_id):
+        """ Returns the round the user is playing, None if it expired or was started by another instance."""
+        if round_id is None:
+            return None
+        return self.rounds.get(round_key(username, round_id))
+
+    def finish_round(self, username, round_id, pokemon_id, guess):
+        """ Scores the user's guess and saves their seen pokemon and points.
+        Args:
+            username: Username of the current user playing.
+            round_id: Id of the round from the user's session.
+            pokemon_id: Id of the pokemon of the round from the user's session.
+            guess: Name of the pokemon the user guessed.
+        Returns:
+            Updated game user, None if the round was already finished or its pokemon was already seen.
+        """
+        with self.rounds_lock:
+            game_round = self.get_round(username, round_id)
+            if game_round is not None and (game_round.saving or game_round.finished):
+                # the guess was submitted twice
+                return None
+            if game_round is not None:
+                game_round.saving = True
+        started = game_round
+
+        try:
+            if game_round is None or game_round.pokemon_id != pokemon_id:
+                # the round expired or was started by another instance, the pokemon comes from the signed session
+                seen, user = self.gather((self.get_seen_pokemon, username),
+                                         (self.get_game_user, username))
+                if pokemon_id in seen:
+                    # the guess was already scored, e.g. an old session cookie was sent again
+                    return None
+                game_round = GameRound(pokemon_id, seen, user)
+
+            answer = self.get_pokemon_data(pokemon_id)["name"]["english"]
+            # the points at the start of the round may be stale, the user can play on other instances or tabs
+            points = game_round.score(guess, answer, self.get_current_points(username, game_round.user))
+            seen = SeenPokemon(game_round.seen.bitmap, game_round.seen.seed, game_round.seen.cursor)
+            seen.add(pokemon_id)
+
+            # the seen pokemon are saved first, once they are a replayed guess can't score again
+            seen_generation = self.update_seen_pokemon(username, seen)
+            user = self.update_points(username, points)
+            if started is not None:
+                started.finished = True
+        finally:
+            # a guess that failed to save can be sent again
+            if started is not None:
+                started.saving = False
+
+        if self.prefetch_rounds:
+            # the saved seen pokemon and user are current, the next round is built from them
+            state = (self.versions.current("leaderboard"), seen_generation)
+            self.prefetcher.put(username, GameRound(seen.next_id(), seen, user), state)
+        return user
+
+    def is_prepared_round_current(self, username, game_round, state):
+        """ Checks that the player didn't play on another instance since their next round was prepared.
+        Args:
+            username: Username of the player.
+            game_round: GameRound prepared after their last guess.
+            state: Tuple with the leaderboard version and the generation of the seen pokemon blob
+                right after the guess was saved.
+        Returns:
+            Whether the prepared seen pokemon and points are still the saved ones.
+        """
+        leaderboard_version, seen_generation = state
+        if self.versions.current("leaderboard") == leaderboard_version:
+            # nobody saved points since, here or on an instance this one heard from
+            return True
+        if self.get_current_points(username, game_round.user) != game_round.user["points"]:
+            return False
+        # the points can stay the same, e.g. a wrong guess at 0 points, the seen pokemon can't
+        blob = self.get_content_bucket().get_blob(f"user_game_ranking/seen/{username}")
+        return blob is not None and blob.generation == seen_generation
+
+    def get_current_points(self, username, user):
+        '''Returns the points of the user from the leaderboard, or from user if they aren't on it yet.'''
+        leaderboard = self.get_leaderboard_engine()
+        with self.leaderboard_lock:
+            if username in leaderboard:
+                return leaderboard.points[username]
+        return user["points"]
+
+    def warm_pokemon(self, pokemon_id):
+        '''Reads the pokedex and the image of a pokemon into memory, so showing it needs no storage calls.'''
+        self.pokedex.load()
+        self.get_image_file(pokemon_image_path(pokemon_id))
+
     def get_seen_pokemon(self, username): 
         """
-        Gets a json object that stores the pokemon that the user has seen so far
+        Gets the pokemon that the user has seen so far, blobs in the old
+        {"<id>": true} format are converted to the bitmap format
         """
-        game_users_bucket = self.client.get_bucket('wiki-content-techx')
+        game_users_bucket = self.get_content_bucket()
         path = f'user_game_ranking/seen/{username}'
         blob = game_users_bucket.get_blob(path)
         # turn data into json
         json_str = blob.download_as_string()
         json_obj = self.json.loads(json_str)
 
-        return json_obj
+        return SeenPokemon.from_json(json_obj)
     
-    def update_seen_pokemon(self,username,new_list):
+    def update_seen_pokemon(self,username,seen):
         """
-        takes a json object to overwrite the old blob
+        takes the SeenPokemon of the user to overwrite the old blob,
+        returns the generation of the saved blob
         """
-        bucket = self.client.get_bucket("wiki-content-techx")
+        bucket = self.get_content_bucket()
         seen_path = f"user_game_ranking/seen/{username}"
         blob = bucket.blob(seen_path)
-        new_seen = self.json.dumps(new_list)
 
-        # if the lenght of the json object is greater than the number of pokemon,
-        # then we set the json object to an empty state
-        if len(new_seen) > MAX_ID:
-            new_seen = json.dumps({})
+        # once the user has seen every pokemon they start over with a new deck
+        if seen.is_complete():
+            seen.reset()
+        new_seen = self.json.dumps(seen.to_json())
         # upload blob
         blob.upload_from_string(data=new_seen, content_type="application/json")
+        return blob.generation
 
     def get_pokemon_image(self,id):
         """
         Gets a pokemon image using the pokemon's unique id
         """
-        image_id = "{:03d}".format(id)
-        bucket = self.client.get_bucket("wiki-content-techx")
-        image_path = "master_pokedex/images/" + image_id + ".png"
-        # Get from bucket
-        pokemon_image_blob = bucket.get_blob(image_path)
-        # Read contents into base64
-        with pokemon_image_blob.open('rb') as f:
-            content = f.read()
+        content = self.get_image_file(pokemon_image_path(id)).data
         pokemon_image = self.base64func.b64encode(content).decode("utf-8")
         return pokemon_image
 
@@ -334,12 +1102,7 @@ class Backend:
         """
         Returns the pokeball image
         """
-        bucket = self.client.get_bucket("wiki-content-techx")
-        image_path = "master_pokedex/images/pokeball.png"
-        pokeball_blob = bucket.get_blob(image_path)
-        # Read contents into base64
-        with pokeball_blob.open('rb') as f:
-            content = f.read()
+        content = self.get_image_file(POKEBALL_PATH).data
         pokeball_image = self.base64func.b64encode(content).decode("utf-8")
         return pokeball_image
 
@@ -347,211 +1110,144 @@ class Backend:
         """
         Returns a json obj with the pokemon data for that particular id
         """
-        bucket = self.client.get_bucket("wiki-content-techx")
-        data_path = "master_pokedex/pokedex.json"
-        pokedex_blob = bucket.get_blob(data_path)
-        poke_str = pokedex_blob.download_as_string()
-        pokedex_json = self.json.loads(poke_str)
-        pokemon_json = pokedex_json[id-1]
-        return pokemon_json
+        return self.pokedex.get(id).as_dict()
+
+    def get_pokedex_blob(self):
+        """
+        Returns the pokedex blob, used by the pokedex store to check its generation
+        """
+        bucket = self.get_content_bucket()
+        return bucket.get_blob("master_pokedex/pokedex.json")
 
 #------------------------------------ Leaderboard ------------------------------------#
     def get_categories(self):
-        bucket = self.client.get_bucket("wiki-content-techx")
-        blob = bucket.get_blob("filtering/categories.json")
-        with blob.open() as f:
-            content = f.read()
-        categories = json.loads(content)
-        return categories
+        '''Gets the types, regions and natures the pages can be filtered by.
+        Returns:
+            Dictionary with the "types", "regions" and "natures" lists.
+        '''
+        if self.categories_from_index:
+            page_index = self.get_page_index()
+            with self.page_index_lock:
+                return page_index.categories()
+        return self.categories.load()
+
+    def get_categories_blob(self):
+        '''Returns the categories blob, used by the categories store to check its generation.'''
+        bucket = self.get_content_bucket()
+        return bucket.get_blob("filtering/categories.json")
     
     def get_game_user(self, username):
         '''Gets game data for a specific user.
+        The rank is not stored with the user, it is read from the leaderboard.
         Args:
             username: Username of the current user.
         Returns:
-            JSON object containing user username, points and rank.
+            JSON object containing user username, points and rank (None if the user hasn't played yet).
         '''
-        game_users_bucket = self.client.get_bucket('wiki-content-techx')
+        game_users_bucket = self.get_content_bucket()
         path = f'user_game_ranking/game_users/{username}'
 
         blob = game_users_bucket.get_blob(path)
         json_str = blob.download_as_string()
         json_obj = self.json.loads(json_str)
 
+        leaderboard = self.get_leaderboard_engine()
+        with self.leaderboard_lock:
+            # points of users on the leaderboard are only saved in the leaderboard
+            if username in leaderboard:
+                json_obj["points"] = leaderboard.points[username]
+            json_obj["rank"] = leaderboard.rank(username)
+
         return json_obj
     
     def update_points(self, username, new_score):
         """Updates the game stats of the user.
-        Update the current user's points and rank, leaderboard is updated as well.
+        The user's points are saved in the leaderboard, which costs one write no matter
+        how many users they passed. The leaderboard is the only copy of the points of users
+        who played, so it is saved with a generation precondition, see update_leaderboard.
         Args:
             username: Username of the current user playing.
             new_score: New amount of points gained or lost by playing the game.
+        Returns:
+            Updated user with new rank assigned.
         """
-        user = self.get_game_user(username)
-        user["points"] = new_score
-        new_user = self.update_leaderboard(user)
-
-        bucket = self.client.get_bucket("wiki-content-techx")
-        path = "user_game_ranking/game_users/" + username
-        blob = bucket.blob(path)
-        json_data = self.json.dumps(new_user)
-        # upload new data
-        blob.upload_from_string(data=json_data,content_type="application/json")
+        return self.update_leaderboard({"name": username, "points": new_score})
     
-    def get_leaderboard(self):
+    def get_leaderboard(self, limit=None):
         '''Gets the leaderboard list containing all users that have played the game.
+        Args:
+            limit: Only return the top limit users, None for all of them.
         Returns:
-            List of JSON objects with each user's game information.
+            List of JSON objects with each user's game information ordered by rank.
         '''
-        bucket = self.client.get_bucket("wiki-content-techx")
-        blob = bucket.get_blob("user_game_ranking/ranks_list.json")
-        json_str = blob.download_as_string()
-        json_obj = self.json.loads(json_str)
-        return json_obj["ranks_list"]
+        leaderboard = self.get_leaderboard_engine()
+        with self.leaderboard_lock:
+            return leaderboard.top(limit)
+
+    def get_leaderboard_engine(self):
+        '''Returns the in-memory leaderboard, loading it from ranks_list.json the first time.'''
+        with self.leaderboard_lock:
+            if self.leaderboard is None:
+                bucket = self.get_content_bucket()
+                blob = bucket.get_blob("user_game_ranking/ranks_list.json")
+                json_str = blob.download_as_string()
+                json_obj = self.json.loads(json_str)
+                self.leaderboard = Leaderboard.from_list(json_obj["ranks_list"])
+                self.leaderboard_generation = blob.generation
+            return self.leaderboard
+
+    def drop_leaderboard(self):
+        '''Forgets the leaderboard so it is loaded again with the points saved by other instances.'''
+        with self.leaderboard_lock:
+            self.leaderboard = None
 
     def update_leaderboard(self, updated_user):
-        '''Updates the leaderboard by sorting the users by points and ranks.
+        '''Moves the user to their new position in the leaderboard and saves it.
+        The leaderboard is only saved over the generation it was loaded from, when another
+        instance saved it first it is loaded again and the update is applied to it.
         Args:
             updated_user: Current user with new points gained or lost from playing the game.
         Returns:
             Updated user with new rank assigned.
         '''
-        leaderboard = self.get_leaderboard()
-
-        # If user is not on the leaderboard
-        if not updated_user["rank"]: 
-            updated_user["rank"] = len(leaderboard) + 1
-            leaderboard.append(updated_user)
-            new_info = self.sort_leaderboard(leaderboard, updated_user, True)
-            leaderboard = new_info[0]
-            updated_user = new_info[1]
+        from google.api_core.exceptions import PreconditionFailed
 
-        # Only user in the leaderboard, update leaderboard with new points
-        elif (len(leaderboard) == 1 and updated_user["name"] == leaderboard[0].get("name")):
-            leaderboard[0] = updated_user
+        bucket = self.get_content_bucket()
+        blob = bucket.blob("user_game_ranking/ranks_list.json")
 
-        # User is in the leaderboard
-        else:
-            new_info = self.sort_leaderboard(leaderboard, updated_user, False)
-            leaderboard = new_info[0]
-            updated_user = new_info[1]
+        # writers take turns so this instance saves its updates in order, while readers keep
+        # using the cached leaderboard until the new one is saved
+        with self.leaderboard_write_lock:
+            for _ in range(LEADERBOARD_RETRIES):
+                with self.leaderboard_lock:
+                    current = self.get_leaderboard_engine()
+                    generation = self.leaderboard_generation
+                    leaderboard = current.copy()
+                new_rank = leaderboard.update(updated_user["name"], updated_user["points"])[1]
+                new_data = self.json.dumps({"ranks_list": leaderboard.to_list()})
+                try:
+                    blob.upload_from_string(data=new_data, content_type="application/json",
+                                            if_generation_match=generation)
+                except PreconditionFailed:
+                    # another instance saved its points first, they are loaded before updating again
+                    self.drop_leaderboard()
+                    continue
+                except Exception:
+                    # the upload may or may not have happened, the leaderboard is read again from storage
+                    self.drop_leaderboard()
+                    raise
+                with self.leaderboard_lock:
+                    if self.leaderboard is current:
+                        self.leaderboard = leaderboard
+                        self.leaderboard_generation = blob.generation
+                    else:
+                        # the cache was dropped or reloaded during the upload, it may not have this update
+                        self.leaderboard = None
+                break
+            else:
+                raise RuntimeError("could not save the leaderboard")
+        self.versions.bump("leaderboard")
 
-        bucket = self.client.get_bucket("wiki-content-techx")
-        blob = bucket.blob("user_game_ranking/ranks_list.json")
-        json_obj = {"ranks_list": leaderboard}
-        new_data = self.json.dumps(json_obj)
-        
-        blob.upload_from_string(data=new_data, content_type="application/json")
-        
         # Updated user
+        updated_user["rank"] = new_rank
         return updated_user
-
-    def sort_leaderboard(self, leaderboard, user, is_new_user):
-        '''Sorts the leaderboard by points and ranks.
-        If the user lost points it would move down the user to the right position in the leaderboard if necessary.
-        If the user gained points it would move up the user to the right position in the leaderboard if necessary.
-        Args:
-            leaderboard: Leaderboard list with all user game stats.
-            user: Current user being moved up or down on rank.
-        Returns:
-            Tuple with the updated leaderboard and current user with updated rank.
-        '''
-        user_index = user["rank"] - 1
-        old_user = leaderboard[user_index]
-        user_points = user["points"]
-
-        def sort_up(user_index, user_points):
-            # User to compare
-            other_user_index = user_index - 1
-            other_user = leaderboard[other_user_index]
-            other_user_points = other_user.get("points")
-
-            # User did not rank up
-            if user_points <= other_user_points or user_index == 0:
-                leaderboard[user_index] = user
-                return leaderboard, user
-
-            # User ranked up        
-            while other_user_index >= 0 and user_points > other_user_points:
-
-                # Update ranks and leaderboard with new ranks
-                user["rank"] = user['rank'] - 1
-                other_user["rank"] = other_user["rank"] + 1 
-                
-                # Update other user rank to game_users bucket
-                self.update_user_rank(other_user)
-
-                leaderboard[other_user_index] = other_user
-                leaderboard[user_index] = user
-
-                # Update leaderboard list
-                leaderboard[other_user_index], leaderboard[user_index] = leaderboard[user_index], leaderboard[other_user_index]
-
-                # Updates index
-                user_index -= 1
-                other_user_index -= 1
-
-                if other_user_index >= 0:
-                    # Get new other user
-                    other_user = leaderboard[other_user_index]
-                    other_user_points = other_user["points"]
-            
-            return leaderboard, user
-            
-        def sort_down(user_index, user_points):
-            
-            # Checks if the current user is on the last index of the list, if not it assigns another user to be compared
-            other_user_index = user_index + 1 if user_index < len(leaderboard) - 1 else None
-            other_user = leaderboard[other_user_index] if other_user_index else None
-            other_user_points = other_user.get("points") if other_user_index else None
-
-            # Current user is in the last spot or did not rank down
-            if other_user_index is None or user_points >= other_user_points:
-                leaderboard[user_index] = user
-                return leaderboard, user
-            
-            while (other_user_index <= len(leaderboard) - 1) and user_points <= other_user_points:
-            
-                # Update ranks and leaderboard with new ranks
-                user["rank"] = user['rank'] + 1
-                other_user["rank"] = other_user["rank"] - 1 
-
-                # Update other user rank to game_users bucket
-                self.update_user_rank(other_user)
-                
-                leaderboard[other_user_index] = other_user
-                leaderboard[user_index] = user
-
-                # Update leaderboard list
-                leaderboard[other_user_index], leaderboard[user_index] = leaderboard[user_index], leaderboard[other_user_index]
-
-                # Updates index
-                user_index += 1
-                other_user_index += 1
-
-                if other_user_index <= len(leaderboard) - 1:
-                    # Get new other user
-                    other_user = leaderboard[other_user_index]
-                    other_user_points = other_user["points"]
-            
-            return leaderboard, user
-
-        if is_new_user:
-            return sort_up(user_index, user_points)
-
-        if old_user["points"] < user_points:
-            return sort_up(user_index, user_points)
-        
-        return sort_down(user_index, user_points)
-
-    def update_user_rank(self, updated_user):
-        '''Updates game_users/user bucket with new rank.
-        Args:
-            updated_user: User with new rank assigned
-        '''
-        bucket = self.client.get_bucket("wiki-content-techx")
-        path = "user_game_ranking/game_users/" + updated_user["name"]
-        blob = bucket.blob(path)
-        json_data = self.json.dumps(updated_user)
-
-        blob.upload_from_string(data=json_data,content_type="application/json")
\ No newline at end of file
@@ -1,5 +1,14 @@
-from flaskr.backend import Backend
+from flaskr.backend import Backend, CONTENT_BUCKET, pokemon_image_path
+from flaskr.leaderboard import Leaderboard
+from flaskr.seen import SeenPokemon
+from flaskr.cache import ByteLRUCache
+from flaskr.user import User
+from flaskr.page_index import PageIndex
+from google.api_core.exceptions import PreconditionFailed
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
 import pytest
+import threading
 from unittest.mock import MagicMock, patch
 
 
@@ -43,6 +52,20 @@ def mockjson():
     return MagicMock()
 
 
+@pytest.fixture
+def ranks(local_client):
+    '''Empty leaderboard blob in the local storage.'''
+    blob = local_client.get_bucket(CONTENT_BUCKET).blob("user_game_ranking/ranks_list.json")
+    blob.upload_from_string(dumps({"ranks_list": []}))
+    return blob
+
+
+def save_player(bucket, name, points=0, seed=1):
+    '''Saves the game blobs of a new player, like sign_up does.'''
+    bucket.blob(f"user_game_ranking/game_users/{name}").upload_from_string(dumps({"name": name, "points": points}))
+    bucket.blob(f"user_game_ranking/seen/{name}").upload_from_string(dumps(SeenPokemon(seed=seed).to_json()))
+
+
 def test_get_wiki_page(client, bucket, blob, file):
     client.get_bucket.return_value = bucket
     bucket.get_blob.return_value = blob
@@ -54,6 +77,19 @@ def test_get_wiki_page(client, bucket, blob, file):
     ]
 
 
+def test_get_wiki_page_generation(client, bucket, blob):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = blob
+    blob.generation = 7
+    backend = Backend(client)
+    assert backend.get_wiki_page_generation('charmander') == 7
+    assert backend.get_wiki_page_generation('charmander') == 7
+    bucket.get_blob.assert_called_once_with('pages/charmander')
+
+    bucket.get_blob.return_value = None
+    assert backend.get_wiki_page_generation('missingno') is None
+
+
 def test_get_all_page_names(client, bucket):
     blob1 = MagicMock()
     blob2 = MagicMock()
@@ -69,6 +105,92 @@ def test_get_all_page_names(client, bucket):
     ]
 
 
+def test_get_page_names(local_backends):
+    backend = local_backends()
+    bucket = backend.get_content_bucket()
+    for name in ["abra", "charmander", "squirtle"]:
+        bucket.blob(f"pages/{name}").upload_from_string(dumps({"name": name}))
+
+    with patch.object(backend, "read_page") as read_page:
+        assert backend.get_page_names(page_size=2) == (['pages/abra', 'pages/charmander'], 'pages/charmander')
+        assert backend.get_page_names('pages/charmander', 2) == (['pages/squirtle'], None)
+        assert backend.get_page_names(page_size=3) == (['pages/abra', 'pages/charmander', 'pages/squirtle'], None)
+        # listing names doesn't read any page or build the index
+        read_page.assert_not_called()
+    assert backend.page_index is None
+
+    # once the index is built the listing is served from it
+    backend.get_page_index()
+    with patch.object(bucket, "list_blobs") as list_blobs:
+        assert backend.get_page_names('pages/abra', 1) == (['pages/charmander'], 'pages/charmander')
+        list_blobs.assert_not_called()
+
+
+def test_pages_uploaded_elsewhere_are_added_to_the_index(local_backends):
+    first = local_backends()
+    second = local_backends()
+    bucket = first.get_content_bucket()
+    for name in ["abra", "charmander"]:
+        bucket.blob(f"pages/{name}").upload_from_string(dumps({"name": name.capitalize(), "type": "Fire"}))
+    page_index = first.get_page_index()
+    first.versions.check()
+
+    second.upload(MagicMock(filename="squirtle.png", content_type="image/png", read=lambda: b"png"), {"name": "Squirtle", "type": "Water"})
+    with patch.object(first, "read_page", wraps=first.read_page) as read_page:
+        first.versions.check({"pages": second.versions.current("pages")})
+        first.page_index_refresh.result(timeout=5)
+        read_page.assert_called_once_with("pages/squirtle")
+    # the index is updated in place, not rebuilt
+    assert first.page_index is page_index
+    assert first.get_pages_using_search("squirtle") == ["pages/squirtle"]
+
+
+def test_page_index_is_refreshed_in_the_background(local_backends):
+    first = local_backends()
+    second = local_backends()
+    bucket = first.get_content_bucket()
+    bucket.blob("pages/abra").upload_from_string(dumps({"name": "Abra", "type": "Psychic"}))
+    page_index = first.get_page_index()
+    first.versions.check()
+    second.upload(MagicMock(filename="squirtle.png", content_type="image/png", read=lambda: b"png"), {"name": "Squirtle", "type": "Water"})
+
+    listing = threading.Event()
+    release = threading.Event()
+    list_blobs = bucket.list_blobs
+
+    def slow_list_blobs(*args, prefix=None, **kwargs):
+        if prefix == "pages/":
+            listing.set()
+            release.wait(5)
+        return list_blobs(*args, prefix=prefix, **kwargs)
+
+    with patch.object(bucket, "list_blobs", slow_list_blobs):
+        # the request that finds the new version doesn't wait for the refresh
+        first.versions.check({"pages": second.versions.current("pages")})
+        assert listing.wait(5)
+        assert first.get_page_index() is page_index
+        assert first.get_pages_using_search("squirtle") == []
+        # versions seen while the refresh runs make it run once more
+        assert first.schedule_page_index_refresh() is first.page_index_refresh
+        release.set()
+        first.page_index_refresh.result(timeout=5)
+    assert first.get_pages_using_search("squirtle") == ["pages/squirtle"]
+
+
+def test_page_index_is_rebuilt_when_a_page_is_replaced(local_backends):
+    backend = local_backends()
+    bucket = backend.get_content_bucket()
+    bucket.blob("pages/abra").upload_from_string(dumps({"name": "Abra", "type": "Psychic"}))
+    page_index = backend.get_page_index()
+    assert backend.get_wiki_page_generation("abra") is not None
+
+    bucket.blob("pages/abra").upload_from_string(dumps({"name": "Abra", "type": "Fairy"}))
+    backend.schedule_page_index_refresh().result(timeout=5)
+    assert backend.page_index is not page_index
+    assert backend.get_pages_using_filter_and_search(None, "Fairy", None, None, None) == ["pages/abra"]
+    assert "abra" not in backend.page_generations
+
+
 def test_upload_successful(client, bucket, blob, base64func, imagefile,
                            mockjson):
     client.get_bucket.return_value = bucket
@@ -93,19 +215,53 @@ def test_upload_page_already_exists(client, bucket, blob, imagefile):
 
 def test_sign_up_account_already_exists(client, bucket, blob):
     client.get_bucket.return_value = bucket
-    bucket.get_blob.return_value = blob
+    bucket.blob.return_value = blob
+    blob.upload_from_string.side_effect = PreconditionFailed("blob exists")
     backend = Backend(client)
     assert backend.sign_up('javier', 'pokemon123') == False
 
 
 def test_sign_up_successful(client, bucket, blob, file, hashfunc):
     client.get_bucket.return_value = bucket
-    bucket.get_blob.return_value = None
     bucket.blob.return_value = blob
     hashfunc.blake2b.return_value.hexdigest.return_value = "pokemon123"
-    blob.open.return_value.__enter__.return_value = file
     backend = Backend(client, hashfunc)
     assert backend.sign_up('newUser', 'pokemon123') == True
+    bucket.get_blob.assert_not_called()
+    blob.upload_from_string.assert_any_call(data="pokemon123", content_type="text/plain", if_generation_match=0)
+    assert blob.upload_from_string.call_count == 3
+    for call in blob.upload_from_string.call_args_list:
+        assert call.kwargs["if_generation_match"] == 0
+
+
+def test_sign_up_keeps_existing_game_blobs(client, bucket, hashfunc):
+    client.get_bucket.return_value = bucket
+    password_blob = MagicMock()
+    game_blob = MagicMock()
+    game_blob.upload_from_string.side_effect = PreconditionFailed("blob exists")
+    bucket.blob.side_effect = lambda path: password_blob if path == 'newUser' else game_blob
+    hashfunc.blake2b.return_value.hexdigest.return_value = "pokemon123"
+    backend = Backend(client, hashfunc)
+    assert backend.sign_up('newUser', 'pokemon123') == True
+
+
+def test_failed_sign_up_removes_the_blobs_it_created(client, bucket, hashfunc):
+    client.get_bucket.return_value = bucket
+    password_blob = MagicMock()
+    game_blob = MagicMock()
+    game_blob.upload_from_string.side_effect = PreconditionFailed("blob exists")
+    seen_blob = MagicMock()
+    seen_blob.upload_from_string.side_effect = OSError("storage error")
+    blobs = {'newUser': password_blob, 'user_game_ranking/game_users/newUser': game_blob,
+             'user_game_ranking/seen/newUser': seen_blob}
+    bucket.blob.side_effect = blobs.get
+    hashfunc.blake2b.return_value.hexdigest.return_value = "pokemon123"
+    backend = Backend(client, hashfunc)
+    with pytest.raises(OSError):
+        backend.sign_up('newUser', 'pokemon123')
+    # the password was written by this signup, the game blob already existed
+    password_blob.delete.assert_called_once()
+    game_blob.delete.assert_not_called()
 
 
 def test_sign_in_account_does_not_exist(client, bucket):
@@ -155,10 +311,12 @@ def test_get_leaderboard(client, bucket, blob, mockjson):
     client.get_bucket.return_value = bucket
     bucket.get_blob.return_value = blob
     blob.download_as_string.return_value = ""
-    data = ["name1", "name2", "name3"]
+    data = [{"name": "name2", "points": 50, "rank": 2}, {"name": "name1", "points": 100, "rank": 1}]
     mockjson.loads.return_value = {"ranks_list": data}
     backend = Backend(client, json=mockjson)
-    assert backend.get_leaderboard() == data 
+    assert backend.get_leaderboard() == [{"name": "name1", "points": 100, "rank": 1}, {"name": "name2", "points": 50, "rank": 2}]
+    assert backend.get_leaderboard(1) == [{"name": "name1", "points": 100, "rank": 1}]
+    blob.download_as_string.assert_called_once()
 
 def test_get_pokemon_image(client,bucket,blob,base64func,imagefile):
     client.get_bucket.return_value = bucket
@@ -181,27 +339,32 @@ def test_get_pokeball(client,bucket,blob,base64func,imagefile):
     assert backend.get_pokeball() == "xpMlfYxxbIZKvEPCNVZx"
 
 
-@patch("flaskr.backend.Backend.get_game_user",
-       return_value={"User": 1})
-@patch("flaskr.backend.Backend.update_leaderboard",
-       return_value=b"new leaderboard")
-def test_update_points(game_user,leaderboard,client,bucket,blob,mockjson):
+@patch("flaskr.backend.VersionStore.bump")
+@patch("flaskr.backend.Backend.get_leaderboard_engine",
+       return_value=Leaderboard.from_list([{"name": "edgar", "points": 100}, {"name": "name", "points": 50}]))
+def test_update_points(engine,bump,client,bucket,blob,mockjson):
     client.get_bucket.return_value = bucket
     bucket.blob.return_value = blob
-    mockjson.dumps.return_value = {"edgar":1}
+    mockjson.dumps.return_value = "new leaderboard"
     backend = Backend(client,json=mockjson)
-    backend.update_points("username",{"edgar":1})
-    game_user.assert_called_once()
-    leaderboard.assert_called_once()
-    blob.upload_from_string.assert_called_once_with(data={"edgar":1},content_type="application/json")
+    backend.leaderboard_generation = 7
+    assert backend.update_points("name", 200) == {"name": "name", "points": 200, "rank": 1}
+    # one write for the leaderboard, no user blob is rewritten
+    bucket.blob.assert_called_once_with("user_game_ranking/ranks_list.json")
+    blob.upload_from_string.assert_called_once_with(data="new leaderboard",content_type="application/json",
+                                                    if_generation_match=7)
+    bump.assert_called_once_with("leaderboard")
 
 def test_get_pokemon_data(client,bucket,blob,mockjson):
     client.get_bucket.return_value = bucket
     bucket.get_blob.return_value = blob
     blob.download_as_string.return_value = "downloaded string"
-    mockjson.loads.return_value = {1:"abra"}
+    mockjson.loads.return_value = [{"id": 1, "name": {"english": "Bulbasaur"}},
+                                   {"id": 2, "name": {"english": "Ivysaur"}, "type": ["Grass", "Poison"]}]
     backend = Backend(client,json=mockjson)
-    assert backend.get_pokemon_data(2) == "abra"
+    assert backend.get_pokemon_data(2) == {"id": 2, "name": {"english": "Ivysaur"}, "type": ["Grass", "Poison"]}
+    assert backend.get_pokemon_data(1) == {"id": 1, "name": {"english": "Bulbasaur"}}
+    blob.download_as_string.assert_called_once()
 
 def test_get_seen_pokemon(client,bucket,blob,mockjson):
     client.get_bucket.return_value = bucket
@@ -209,29 +372,54 @@ def test_get_seen_pokemon(client,bucket,blob,mockjson):
     blob.download_as_string.return_value = "A string"
     mockjson.loads.return_value = {"100":"true","200":"true"}
     backend = Backend(client,json=mockjson)
-    assert backend.get_seen_pokemon("username") == {"100":"true","200":"true"}
+    seen = backend.get_seen_pokemon("username")
+    assert 100 in seen and 200 in seen
+    assert len(seen) == 2
 
 
 def test_update_seen_pokemon(client,bucket,blob,mockjson):
     client.get_bucket.return_value = bucket
-    bucket.get_blob.return_value = blob
-    mockjson.dumps.return_value = {"new":"pokemon"}
+    bucket.blob.return_value = blob
+    mockjson.dumps.return_value = "new seen"
     backend = Backend(client,json=mockjson)
-    backend.update_seen_pokemon("username",{"new":"list"})
-    blob.upload_from_string.assert_called_once
+    seen = SeenPokemon(seed=1)
+    seen.add(25)
+    backend.update_seen_pokemon("username",seen)
+    mockjson.dumps.assert_called_once_with(seen.to_json())
+    blob.upload_from_string.assert_called_once_with(data="new seen", content_type="application/json")
 
 
-def test_get_game_user(client, bucket, blob, mockjson):
+def test_update_seen_pokemon_resets_once_all_seen(client,bucket,blob):
+    client.get_bucket.return_value = bucket
+    bucket.blob.return_value = blob
+    backend = Backend(client)
+    seen = SeenPokemon(bitmap=(1 << 386) - 1)
+    backend.update_seen_pokemon("username",seen)
+    assert len(seen) == 0
+
+
+@patch("flaskr.backend.Backend.get_leaderboard_engine", return_value=Leaderboard())
+def test_get_game_user(engine, client, bucket, blob, mockjson):
     client.get_bucket.return_value = bucket
     bucket.get_blob.return_value = blob
     blob.download_as_string.return_value = ""
-    data = {"name": "name", "points": 0, "rank": None}
+    data = {"name": "name", "points": 0}
     mockjson.loads.return_value = data
     backend = Backend(client, json=mockjson)
-    assert backend.get_game_user("name") == data
+    assert backend.get_game_user("name") == {"name": "name", "points": 0, "rank": None}
 
-@patch("flaskr.backend.Backend.get_leaderboard", return_value=[])
-def test_update_leaderboard_unranked_user(client, bucket, blob, mockjson):
+@patch("flaskr.backend.Backend.get_leaderboard_engine",
+       return_value=Leaderboard.from_list([{"name": "edgar", "points": 300}, {"name": "name", "points": 200}]))
+def test_get_game_user_rank_from_leaderboard(engine, client, bucket, blob, mockjson):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = blob
+    blob.download_as_string.return_value = ""
+    mockjson.loads.return_value = {"name": "name", "points": 0, "rank": 5}
+    backend = Backend(client, json=mockjson)
+    assert backend.get_game_user("name") == {"name": "name", "points": 200, "rank": 2}
+
+@patch("flaskr.backend.Backend.get_leaderboard_engine", return_value=Leaderboard())
+def test_update_leaderboard_unranked_user(engine, client, bucket, blob, mockjson):
     client.get_bucket.return_value = bucket
     bucket.blob.return_value = blob
     mockjson.dumps.return_value = ""
@@ -239,57 +427,39 @@ def test_update_leaderboard_unranked_user(client, bucket, blob, mockjson):
     backend = Backend(client, json=mockjson)
     assert backend.update_leaderboard(data) == {"name": "name", "points": 0, "rank": 1}
 
-@patch("flaskr.backend.Backend.get_leaderboard", return_value=[{"name": "name", "points": 0, "rank": 1}])
-def test_update_leaderboard_only_user(client, bucket, blob, mockjson):
+@patch("flaskr.backend.Backend.get_leaderboard_engine",
+    return_value=Leaderboard.from_list([{"name": "name", "points": 0, "rank": 1}]))
+def test_update_leaderboard_only_user(engine, client, bucket, blob, mockjson):
     client.get_bucket.return_value = bucket
     bucket.blob.return_value = blob
     mockjson.dumps.return_value = ""
     data = {"name": "name", "points": 100, "rank": 1}
     backend = Backend(client, json=mockjson)
     assert backend.update_leaderboard(data) == {"name": "name", "points": 100, "rank": 1}
+    mockjson.dumps.assert_called_once_with({"ranks_list": [{"name": "name", "points": 100, "rank": 1}]})
 
-@patch("flaskr.backend.Backend.get_leaderboard", 
-    return_value=[{"name": "name", "points": 100, "rank": 1}, {"name": "name2", "points": 0, "rank": 2}])
-@patch("flaskr.backend.Backend.sort_leaderboard",
-    return_value=([{"name": "name2", "points": 200, "rank": 1}, {"name": "name", "points": 100, "rank": 2}], {"name": "name2", "points": 200, "rank": 1}))
-def test_update_leaderboard(client, bucket, blob, mockjson):
+@patch("flaskr.backend.Backend.get_leaderboard_engine",
+    return_value=Leaderboard.from_list([{"name": "name", "points": 100, "rank": 1}, {"name": "name2", "points": 0, "rank": 2}]))
+def test_update_leaderboard_rank_up(engine, client, bucket, blob, mockjson):
     client.get_bucket.return_value = bucket
     bucket.blob.return_value = blob
     mockjson.dumps.return_value = ""
     data = {"name": "name2", "points": 200, "rank": 2}
     backend = Backend(client, json=mockjson)
     assert backend.update_leaderboard(data) == {"name": "name2", "points": 200, "rank": 1}
+    mockjson.dumps.assert_called_once_with({"ranks_list": [{"name": "name2", "points": 200, "rank": 1}, {"name": "name", "points": 100, "rank": 2}]})
 
-def test_sort_up_leaderboard(client):
-    backend = Backend(client)
-    data = [{"name": "name", "points": 100, "rank": 1}, {"name": "name2", "points": 0, "rank": 2}]
-    user_data = {"name": "name2", "points": 200, "rank": 2}
-    assert backend.sort_leaderboard(data, user_data, False) == ([{"name": "name2", "points": 200, "rank": 1}, {"name": "name", "points": 100, "rank": 2}], 
-                                                        {"name": "name2", "points": 200, "rank": 1})
-
-def test_sort_down_leaderboard(client):
-    backend = Backend(client)
-    data = [{"name": "name", "points": 100, "rank": 1}, {"name": "name2", "points": 100, "rank": 2}]
-    user_data = {"name": "name", "points": 50, "rank": 1}
-    assert backend.sort_leaderboard(data, user_data, False) == ([{"name": "name2", "points": 100, "rank": 1}, {"name": "name", "points": 50, "rank": 2}], 
-                                                        {"name": "name", "points": 50, "rank": 2})
-
-def test_sort_leaderboard_equal_points(client):
-    backend = Backend(client)
-    data = [{"name": "name", "points": 100, "rank": 1}, {"name": "name2", "points": 0, "rank": 2}]
-    user_data = {"name": "name2", "points": 100, "rank": 2}
-    assert backend.sort_leaderboard(data, user_data, False) == ([{"name": "name", "points": 100, "rank": 1}, {"name": "name2", "points": 100, "rank": 2}],
-                                                        {"name": "name2", "points": 100, "rank": 2})
-
-def test_update_user_rank(client, bucket, blob, mockjson):
+@patch("flaskr.backend.VersionStore.bump")
+@patch("flaskr.backend.Backend.get_leaderboard_engine",
+    return_value=Leaderboard.from_list([{"name": "name", "points": 100, "rank": 1}, {"name": "name2", "points": 100, "rank": 2}]))
+def test_update_leaderboard_rank_down(engine, bump, client, bucket, blob, mockjson):
     client.get_bucket.return_value = bucket
     bucket.blob.return_value = blob
-    data = {"name": "name", "points": 100, "rank": 10}
-    mockjson.dumps.return_value = data
-    backend = Backend(client, mockjson)
-    backend.update_user_rank(data)
-    blob.upload_from_string.assert_called_once_with(data='{"name": "name", "points": 100, "rank": 10}',content_type="application/json")
-
+    mockjson.dumps.return_value = ""
+    data = {"name": "name", "points": 50, "rank": 1}
+    backend = Backend(client, json=mockjson)
+    assert backend.update_leaderboard(data) == {"name": "name", "points": 50, "rank": 2}
+    blob.upload_from_string.assert_called_once()
 
 """
 Filter Feature Testing
@@ -386,4 +556,563 @@ def test_get_pages_using_filter_type_and_nature(client, bucket, json, page_blobs
     bucket.list_blobs.return_value = iter(page_blobs)
 
     backend = Backend(client, json=json)
-    assert backend.get_pages_using_filter_and_search(None, "Fire", None, "Bashful", None) == ["pages/blaziken"]
\ No newline at end of file
+    assert backend.get_pages_using_filter_and_search(None, "Fire", None, "Bashful", None) == ["pages/blaziken"]
+
+def test_get_pages_using_filter_reads_blobs_once(client, bucket, json, page_blobs):
+    client.get_bucket.return_value = bucket
+    bucket.list_blobs.return_value = iter(page_blobs)
+
+    backend = Backend(client, json=json)
+    backend.get_pages_using_filter_and_search(None, "Fire", None, None, None)
+    assert backend.get_pages_using_filter_and_search(None, None, "Hoenn", None, "LowestToHighest") == ["pages/mudkip", "pages/blaziken"]
+    bucket.list_blobs.assert_called_once()
+    page_blobs[1].open.assert_called_once()
+
+
+def test_upload_adds_page_to_index(client, bucket, json, page_blobs, imagefile):
+    client.get_bucket.return_value = bucket
+    bucket.list_blobs.return_value = iter(page_blobs)
+    bucket.get_blob.return_value = None
+    imagefile.filename = "treecko.png"
+    imagefile.content_type = "image/png"
+
+    backend = Backend(client, json=MagicMock())
+    backend.json.loads = json.loads
+    backend.get_pages_using_filter_and_search(None, None, None, None, None)
+    pokemon_data = {"name": "Treecko", "type": "Grass", "region": "Hoenn", "nature": "Calm", "level": "5"}
+    backend.upload(imagefile, pokemon_data)
+    assert backend.get_pages_using_filter_and_search(None, "Grass", None, None, "LowestToHighest") == ["pages/treecko", "pages/chikorita"]
+
+
+def test_bucket_handles_are_reused(client, bucket, blob, file):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = blob
+    blob.open.return_value.__enter__.return_value = file
+    backend = Backend(client)
+    backend.get_wiki_page('charmander')
+    backend.get_wiki_page('squirtle')
+    backend.get_user('javier')
+    assert backend.bucket_lookups == 2
+    assert client.get_bucket.call_count == 2
+
+
+def test_bucket_names_are_configurable(client):
+    backend = Backend(client, content_bucket="content", users_bucket="users")
+    backend.get_content_bucket()
+    backend.get_users_bucket()
+    client.get_bucket.assert_any_call("content")
+    client.get_bucket.assert_any_call("users")
+
+
+def test_get_image_file(client, bucket, blob, file):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = blob
+    blob.open.return_value.__enter__.return_value = file
+    blob.content_type = None
+    blob.generation = 7
+    file.read.return_value = b"\x89PNG"
+    backend = Backend(client)
+    assert backend.get_image_file('authors/trophy.png') == (b"\x89PNG", "image/png", 7)
+
+
+def test_get_image_file_missing(client, bucket):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = None
+    backend = Backend(client)
+    assert backend.get_image_file('images/missing.png') is None
+
+
+def test_images_are_cached(client, bucket, blob, file, base64func):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = blob
+    blob.open.return_value.__enter__.return_value = file
+    file.read.return_value = b"\x89PNG"
+    backend = Backend(client, base64func=base64func)
+    backend.get_pokeball()
+    backend.get_pokeball()
+    backend.get_image_file('master_pokedex/images/pokeball.png')
+    bucket.get_blob.assert_called_once_with('master_pokedex/images/pokeball.png')
+    assert backend.image_cache.get_stats()["hits"] == 2
+
+
+def test_gather_runs_calls_together(client):
+    backend = Backend(client, max_workers=3)
+    barrier = threading.Barrier(3, timeout=5)
+
+    def call(value):
+        # only returns once all three calls are running
+        barrier.wait()
+        return value * 2
+
+    assert backend.gather((call, 1), (call, 2), (call, 3)) == [2, 4, 6]
+
+
+def test_gather_raises_errors(client):
+    backend = Backend(client)
+
+    def fail():
+        raise ValueError("storage error")
+
+    with pytest.raises(ValueError):
+        backend.gather((fail,), (len, "abc"))
+
+
+def test_gather_on_the_pool_runs_inline(local_backends):
+    backend = local_backends(max_workers=1, use_manifest=True)
+    bucket = backend.get_content_bucket()
+    bucket.blob("pages/abra").upload_from_string(dumps({"name": "Abra", "type": "Psychic"}))
+    backend.compact_manifest()
+    # the only thread of the pool gathers the manifest shards
+    assert backend.submit(backend.get_page_index).result(timeout=5) is backend.page_index
+    assert backend.submit(backend.gather, (len, "ab"), (len, "abc")).result(timeout=5) == [2, 3]
+
+
+def test_get_user_is_cached(client, bucket, blob, file):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = blob
+    blob.open.return_value.__enter__.return_value = file
+    file.read.return_value = "hashed"
+    backend = Backend(client)
+
+    assert backend.get_user('javier').password == "hashed"
+    assert backend.get_user('javier').password == "hashed"
+    assert bucket.get_blob.call_count == 1
+
+
+def test_get_user_missing_is_not_cached(client, bucket):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = None
+    backend = Backend(client)
+
+    assert backend.get_user('javier') is None
+    assert backend.get_user('javier') is None
+    assert bucket.get_blob.call_count == 2
+
+
+def test_get_user_cache_expires(client, bucket, blob, file):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = blob
+    blob.open.return_value.__enter__.return_value = file
+    file.read.return_value = "hashed"
+    now = [0]
+    backend = Backend(client, user_cache=ByteLRUCache(1024, {"": 300}, clock=lambda: now[0]))
+
+    backend.get_user('javier')
+    now[0] = 301
+    backend.get_user('javier')
+    assert bucket.get_blob.call_count == 2
+
+
+def test_sign_up_invalidates_cached_user(client, bucket, blob, file, hashfunc):
+    client.get_bucket.return_value = bucket
+    backend = Backend(client, hashfunc)
+    backend.user_cache.put('newUser', User('newUser', 'old'), size=10)
+    bucket.get_blob.return_value = None
+
+    assert backend.sign_up('newUser', 'pokemon123') == True
+    assert backend.user_cache.get('newUser') is None
+
+
+def test_sign_in_refreshes_cached_user(client, bucket, blob, file, hashfunc):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = blob
+    hashfunc.blake2b.return_value.hexdigest.return_value = "new"
+    blob.open.return_value.__enter__.return_value = file
+    file.read.return_value = "new"
+    backend = Backend(client, hashfunc)
+    backend.user_cache.put('javier', User('javier', 'old'), size=10)
+
+    assert backend.sign_in('javier', 'pokemon123') == True
+    assert backend.get_user('javier').password == "new"
+
+
+@patch("flaskr.backend.Backend.get_image_file")
+@patch("flaskr.backend.Backend.get_page_index")
+@patch("flaskr.backend.Backend.get_leaderboard_engine")
+@patch("flaskr.backend.Backend.get_categories", side_effect=ValueError("no categories"))
+def test_preload(categories, engine, page_index, image_file, client):
+    backend = Backend(client)
+    backend.pokedex.load = MagicMock()
+    timings = backend.preload()
+
+    engine.assert_called_once()
+    page_index.assert_called_once()
+    backend.pokedex.load.assert_called_once()
+    image_file.assert_any_call("authors/logo.jpg")
+    image_file.assert_any_call("master_pokedex/images/pokeball.png")
+    assert isinstance(timings["leaderboard"], float)
+    assert isinstance(timings["master_pokedex/images/pokeball.png"], float)
+    # a failing part doesn't stop the others
+    assert "no categories" in timings["categories"]
+
+
+def test_get_categories_is_cached(client, bucket, blob):
+    client.get_bucket.return_value = bucket
+    bucket.get_blob.return_value = blob
+    blob.generation = 1
+    blob.download_as_string.return_value = '{"types": ["Fire"], "regions": [], "natures": []}'
+    backend = Backend(client)
+    assert backend.get_categories() == {"types": ["Fire"], "regions": [], "natures": []}
+    assert backend.get_categories() == {"types": ["Fire"], "regions": [], "natures": []}
+    blob.download_as_string.assert_called_once()
+
+
+@patch("flaskr.backend.Backend.build_page_index")
+def test_get_categories_from_index(build_page_index, client):
+    page_index = PageIndex()
+    page_index.add("pages/charmander", {"name": "Charmander", "type": "Fire", "region": "Kanto", "nature": "Brave"})
+    build_page_index.return_value = page_index
+    backend = Backend(client, categories_from_index=True)
+    assert backend.get_categories() == {"types": ["Fire"], "regions": ["Kanto"], "natures": ["Brave"]}
+    client.get_bucket.assert_not_called()
+
+
+@patch("flaskr.backend.Backend.get_leaderboard_engine", return_value=Leaderboard())
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+@patch("flaskr.backend.Backend.update_points", return_value={"name": "ash", "points": 200, "rank": 1})
+@patch("flaskr.backend.Backend.update_seen_pokemon")
+@patch("flaskr.backend.Backend.get_game_user", return_value={"name": "ash", "points": 100, "rank": 2})
+@patch("flaskr.backend.Backend.get_seen_pokemon", return_value=SeenPokemon(seed=1))
+def test_round_is_scored_on_the_server(get_seen, get_user, update_seen, update_points, get_data, engine, client):
+    backend = Backend(client)
+    backend.pokedex = MagicMock()
+    round_id, game_round = backend.start_round("ash")
+    assert backend.get_round("ash", round_id) is game_round
+    assert backend.get_round("misty", round_id) is None
+
+    pokemon_id = game_round.pokemon_id
+    assert backend.finish_round("ash", round_id, pokemon_id, "PIKACHU") == {"name": "ash", "points": 200, "rank": 1}
+    update_points.assert_called_once_with("ash", 200)
+    assert pokemon_id in update_seen.call_args[0][1]
+    get_seen.assert_called_once()
+
+    # the same guess can't be submitted twice
+    assert backend.finish_round("ash", round_id, pokemon_id, "PIKACHU") is None
+    update_points.assert_called_once()
+
+
+@patch("flaskr.backend.Backend.get_leaderboard_engine", return_value=Leaderboard())
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+@patch("flaskr.backend.Backend.update_points")
+@patch("flaskr.backend.Backend.update_seen_pokemon")
+@patch("flaskr.backend.Backend.get_game_user", return_value={"name": "ash", "points": 100, "rank": 2})
+@patch("flaskr.backend.Backend.get_seen_pokemon", return_value=SeenPokemon(seed=1))
+def test_guess_that_failed_to_save_can_be_sent_again(get_seen, get_user, update_seen, update_points, get_data, engine,
+                                                      client):
+    backend = Backend(client, prefetch_rounds=False)
+    backend.pokedex = MagicMock()
+    round_id, game_round = backend.start_round("ash")
+    calls = MagicMock()
+    calls.attach_mock(update_seen, "update_seen")
+    calls.attach_mock(update_points, "update_points")
+
+    update_points.side_effect = OSError("storage error")
+    with pytest.raises(OSError):
+        backend.finish_round("ash", round_id, game_round.pokemon_id, "Pikachu")
+    # the points are only saved once the seen pokemon are
+    assert [call[0] for call in calls.mock_calls] == ["update_seen", "update_points"]
+    assert game_round.pokemon_id not in game_round.seen
+    assert backend.get_round("ash", round_id).finished is False
+
+    update_points.side_effect = None
+    update_points.return_value = {"name": "ash", "points": 200, "rank": 1}
+    assert backend.finish_round("ash", round_id, game_round.pokemon_id, "Pikachu")["points"] == 200
+    assert backend.get_round("ash", round_id).finished is True
+
+
+@patch("flaskr.backend.Backend.get_leaderboard_engine", return_value=Leaderboard())
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+@patch("flaskr.backend.Backend.update_points")
+@patch("flaskr.backend.Backend.update_seen_pokemon", side_effect=OSError("storage error"))
+@patch("flaskr.backend.Backend.get_game_user", return_value={"name": "ash", "points": 100, "rank": 2})
+@patch("flaskr.backend.Backend.get_seen_pokemon", return_value=SeenPokemon(seed=1))
+def test_points_are_not_saved_when_seen_pokemon_are_not(get_seen, get_user, update_seen, update_points, get_data,
+                                                        engine, client):
+    backend = Backend(client)
+    with pytest.raises(OSError):
+        backend.finish_round("ash", "expired", 25, "Pikachu")
+    update_points.assert_not_called()
+
+
+@patch("flaskr.backend.Backend.get_leaderboard_engine", return_value=Leaderboard())
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+@patch("flaskr.backend.Backend.update_points")
+@patch("flaskr.backend.Backend.update_seen_pokemon")
+@patch("flaskr.backend.Backend.get_game_user", return_value={"name": "ash", "points": 100, "rank": 2})
+@patch("flaskr.backend.Backend.get_seen_pokemon", return_value=SeenPokemon(seed=1))
+def test_expired_round_is_scored_from_storage(get_seen, get_user, update_seen, update_points, get_data, engine, client):
+    backend = Backend(client)
+    backend.finish_round("ash", "expired", 25, "Raichu")
+    update_points.assert_called_once_with("ash", 50)
+    get_data.assert_called_once_with(25)
+    assert 25 in update_seen.call_args[0][1]
+
+
+@patch("flaskr.backend.Backend.get_leaderboard_engine", return_value=Leaderboard())
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+@patch("flaskr.backend.Backend.update_points", return_value={"name": "ash", "points": 200, "rank": 1})
+@patch("flaskr.backend.Backend.update_seen_pokemon")
+@patch("flaskr.backend.Backend.get_game_user", return_value={"name": "ash", "points": 100, "rank": 2})
+@patch("flaskr.backend.Backend.get_seen_pokemon", return_value=SeenPokemon(seed=1))
+@patch("flaskr.backend.Backend.warm_pokemon")
+def test_next_round_is_prepared_while_guessing(warm, get_seen, get_user, update_seen, update_points, get_data, engine, client):
+    backend = Backend(client)
+    backend.pokedex = MagicMock()
+    round_id, game_round = backend.start_round("ash")
+    backend.executor.shutdown(wait=True)
+    backend.executor = None
+    next_id = warm.call_args[0][0]
+
+    backend.finish_round("ash", round_id, game_round.pokemon_id, "Pikachu")
+    _, next_round = backend.start_round("ash")
+    assert next_round.pokemon_id == next_id
+    assert next_round.user == {"name": "ash", "points": 200, "rank": 1}
+    get_seen.assert_called_once()
+    get_user.assert_called_once()
+
+
+@patch("flaskr.backend.Backend.get_game_user", return_value={"name": "ash", "points": 100, "rank": 2})
+@patch("flaskr.backend.Backend.get_seen_pokemon", return_value=SeenPokemon(seed=1))
+@patch("flaskr.backend.Backend.warm_pokemon")
+def test_prefetch_can_be_turned_off(warm, get_seen, get_user, client):
+    backend = Backend(client, prefetch_rounds=False)
+    backend.pokedex = MagicMock()
+    backend.start_round("ash")
+    warm.assert_not_called()
+
+
+def test_sprites_are_served_from_the_archive(local_backends):
+    backend = local_backends()
+    bucket = backend.get_content_bucket()
+    bucket.blob(pokemon_image_path(1)).upload_from_string(b"bulbasaur", content_type="image/png")
+    bucket.blob(pokemon_image_path(25)).upload_from_string(b"pikachu", content_type="image/png")
+    assert backend.get_sprite_archive() is None
+    assert backend.build_sprite_archive() == 2
+
+    sprite = backend.get_image_file(pokemon_image_path(25))
+    assert isinstance(sprite.data, memoryview)
+    assert bytes(sprite.data) == b"pikachu"
+    assert sprite.generation == bucket.get_blob("master_pokedex/sprites.pack").generation
+
+    # sprites added after the archive was built are read from their own blob
+    bucket.blob(pokemon_image_path(4)).upload_from_string(b"charmander", content_type="image/png")
+    assert backend.get_image_file(pokemon_image_path(4)).data == b"charmander"
+
+    # other instances load the new archive once it is rebuilt
+    other = local_backends()
+    other.versions.check()
+    assert other.get_sprite_archive() is not None
+    backend.build_sprite_archive()
+    other.versions.check({"sprites": backend.versions.current("sprites")})
+    assert bytes(other.get_image_file(pokemon_image_path(4)).data) == b"charmander"
+
+
+def test_invalid_sprite_archive_falls_back_to_blobs(local_backends):
+    backend = local_backends()
+    bucket = backend.get_content_bucket()
+    bucket.blob("master_pokedex/sprites.pack").upload_from_string(b"garbage")
+    bucket.blob(pokemon_image_path(1)).upload_from_string(b"bulbasaur", content_type="image/png")
+    assert backend.get_image_file(pokemon_image_path(1)).data == b"bulbasaur"
+    assert backend.get_sprite_archive() is None
+
+
+def test_sprite_archive_is_loaded_again_after_a_failed_download(local_backends):
+    backend = local_backends()
+    backend.get_content_bucket().blob(pokemon_image_path(25)).upload_from_string(b"pikachu", content_type="image/png")
+    backend.build_sprite_archive()
+    with patch("flaskr.storage_drivers.LocalBlob.open", side_effect=OSError("connection reset")):
+        assert backend.get_sprite_archive() is None
+    assert bytes(backend.get_sprite_archive().get(25)) == b"pikachu"
+
+
+def test_old_sprite_archives_are_deleted(local_backends, tmp_path):
+    first = local_backends()
+    bucket = first.get_content_bucket()
+    bucket.blob(pokemon_image_path(25)).upload_from_string(b"pikachu", content_type="image/png")
+    first.build_sprite_archive()
+    old = first.get_sprite_archive()
+    old_file = tmp_path / f"sprites-{old.generation}.pack"
+    assert old_file.exists()
+
+    second = local_backends()
+    second.build_sprite_archive()
+    new = second.get_sprite_archive()
+    assert not old_file.exists()
+    assert (tmp_path / f"sprites-{new.generation}.pack").exists()
+    # sprites already mapped from the deleted file can still be served
+    assert bytes(old.get(25)) == b"pikachu"
+
+
+def test_leaderboard_saved_by_another_instance_is_not_overwritten(local_backends, ranks):
+    first = local_backends()
+    second = local_backends()
+    first.get_leaderboard_engine()
+    second.get_leaderboard_engine()
+
+    first.update_points("alice", 100)
+    # the second instance hasn't seen alice's points yet
+    assert second.update_points("bob", 200)["rank"] == 1
+    saved = loads(ranks.download_as_string())["ranks_list"]
+    assert [(user["name"], user["points"]) for user in saved] == [("bob", 200), ("alice", 100)]
+
+
+def test_concurrent_leaderboard_updates_are_all_saved(local_backends, ranks):
+    backend = local_backends()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: backend.update_points(f"user{i}", i), range(20)))
+    saved = loads(ranks.download_as_string())["ranks_list"]
+    assert len(saved) == 20
+
+
+def test_failed_leaderboard_upload_is_not_kept(local_backends, ranks):
+    backend = local_backends()
+    backend.update_points("alice", 100)
+    with patch("flaskr.storage_drivers.LocalBlob.upload_from_string", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            backend.update_points("bob", 200)
+    assert backend.get_leaderboard_engine().to_list() == [{"name": "alice", "points": 100, "rank": 1}]
+
+
+def test_leaderboard_is_readable_during_an_upload(local_backends, ranks):
+    backend = local_backends()
+    backend.update_points("alice", 100)
+    uploading = threading.Event()
+    release = threading.Event()
+    upload = ranks.__class__.upload_from_string
+
+    def slow_upload(blob, *args, **kwargs):
+        uploading.set()
+        release.wait(5)
+        return upload(blob, *args, **kwargs)
+
+    with patch.object(ranks.__class__, "upload_from_string", slow_upload):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            saving = executor.submit(backend.update_points, "bob", 200)
+            assert uploading.wait(5)
+            # readers get the saved leaderboard while the new one is uploaded
+            assert [user["name"] for user in backend.get_leaderboard()] == ["alice"]
+            release.set()
+            assert saving.result(5)["rank"] == 1
+    assert [user["name"] for user in backend.get_leaderboard()] == ["bob", "alice"]
+
+
+def test_points_saved_on_other_instances_are_read_back(local_backends, ranks):
+    first = local_backends()
+    second = local_backends()
+    for name in ["alice", "bob"]:
+        save_player(ranks.bucket, name)
+    first.get_leaderboard_engine()
+    second.get_leaderboard_engine()
+
+    first.update_points("alice", 100)
+    second.update_points("bob", 200)
+
+    # the game_users blobs are never rewritten, the points come from the leaderboard
+    cold = local_backends()
+    assert cold.get_game_user("alice") == {"name": "alice", "points": 100, "rank": 2}
+    assert cold.get_game_user("bob") == {"name": "bob", "points": 200, "rank": 1}
+
+
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+@patch("flaskr.backend.Backend.update_points")
+@patch("flaskr.backend.Backend.update_seen_pokemon")
+@patch("flaskr.backend.Backend.get_game_user", return_value={"name": "ash", "points": 100, "rank": 2})
+@patch("flaskr.backend.Backend.get_seen_pokemon")
+def test_replayed_guess_is_not_scored_again(get_seen, get_user, update_seen, update_points, get_data, client):
+    seen = SeenPokemon(seed=1)
+    seen.add(25)
+    get_seen.return_value = seen
+    backend = Backend(client)
+    # the round isn't cached, e.g. an old session cookie was sent again
+    assert backend.finish_round("ash", "old round", 25, "Pikachu") is None
+    update_points.assert_not_called()
+    update_seen.assert_not_called()
+
+
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+@patch("flaskr.backend.Backend.update_points")
+@patch("flaskr.backend.Backend.update_seen_pokemon")
+@patch("flaskr.backend.Backend.get_game_user", return_value={"name": "ash", "points": 100, "rank": 2})
+@patch("flaskr.backend.Backend.get_seen_pokemon", return_value=SeenPokemon(seed=1))
+@patch("flaskr.backend.Backend.get_leaderboard_engine")
+def test_guess_is_scored_from_the_current_points(engine, get_seen, get_user, update_seen, update_points, get_data,
+                                                 client):
+    engine.return_value = Leaderboard.from_list([{"name": "ash", "points": 100}])
+    backend = Backend(client, prefetch_rounds=False)
+    backend.pokedex = MagicMock()
+    round_id, game_round = backend.start_round("ash")
+
+    # the user won points elsewhere while guessing
+    engine.return_value = Leaderboard.from_list([{"name": "ash", "points": 600}])
+    backend.finish_round("ash", round_id, game_round.pokemon_id, "Pikachu")
+    update_points.assert_called_once_with("ash", 700)
+
+
+@patch("flaskr.backend.Backend.warm_pokemon")
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+def test_prepared_round_is_dropped_after_playing_elsewhere(get_data, warm, local_backends, ranks):
+    first = local_backends(prefetch_rounds=True)
+    second = local_backends(prefetch_rounds=True)
+    save_player(ranks.bucket, "ash")
+    for backend in [first, second]:
+        backend.pokedex = MagicMock()
+        backend.versions.check()
+
+    round_id, game_round = first.start_round("ash")
+    first.finish_round("ash", round_id, game_round.pokemon_id, "Pikachu")
+
+    # the player guesses on the other instance, then comes back with its version in their session
+    round_id, game_round = second.start_round("ash")
+    second.finish_round("ash", round_id, game_round.pokemon_id, "Pikachu")
+    first.versions.check({"leaderboard": second.versions.current("leaderboard")})
+
+    _, next_round = first.start_round("ash")
+    assert next_round.user["points"] == 200
+    assert game_round.pokemon_id in next_round.seen
+
+
+@patch("flaskr.backend.Backend.warm_pokemon")
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+def test_prepared_round_is_kept_when_others_play_elsewhere(get_data, warm, local_backends, ranks):
+    first = local_backends(prefetch_rounds=True)
+    second = local_backends(prefetch_rounds=True)
+    for name in ["ash", "misty"]:
+        save_player(ranks.bucket, name)
+    for backend in [first, second]:
+        backend.pokedex = MagicMock()
+        backend.versions.check()
+
+    round_id, game_round = first.start_round("ash")
+    first.finish_round("ash", round_id, game_round.pokemon_id, "Pikachu")
+    prepared = first.prefetcher.rounds.get("ash")[0]
+
+    round_id, game_round = second.start_round("misty")
+    second.finish_round("misty", round_id, game_round.pokemon_id, "Pikachu")
+    first.versions.check({"leaderboard": second.versions.current("leaderboard")})
+
+    with patch.object(first, "get_seen_pokemon") as get_seen:
+        assert first.start_round("ash")[1] is prepared
+        get_seen.assert_not_called()
+
+
+@patch("flaskr.backend.Backend.warm_pokemon")
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+def test_prepared_round_is_dropped_after_a_guess_elsewhere_without_points(get_data, warm, local_backends, ranks):
+    first = local_backends(prefetch_rounds=True)
+    second = local_backends(prefetch_rounds=True)
+    save_player(ranks.bucket, "ash")
+    for backend in [first, second]:
+        backend.pokedex = MagicMock()
+        backend.versions.check()
+
+    round_id, game_round = first.start_round("ash")
+    first.finish_round("ash", round_id, game_round.pokemon_id, "Raichu")
+
+    # a wrong guess at 0 points leaves the points as they were, only the seen pokemon change
+    round_id, game_round = second.start_round("ash")
+    second.finish_round("ash", round_id, game_round.pokemon_id, "Raichu")
+    first.versions.check({"leaderboard": second.versions.current("leaderboard")})
+
+    _, next_round = first.start_round("ash")
+    assert next_round.user["points"] == 0
+    assert game_round.pokemon_id in next_round.seen
@@ -0,0 +1,59 @@
+"""This module keeps the parsed contents of a rarely changing blob in memory.
+
+BlobStore downloads and parses a blob once, then only asks the cloud for the blob's
+generation, at most once every refresh interval, and downloads it again only when
+the generation changed.
+
+Typical Usage:
+store = BlobStore(lambda: bucket.get_blob('filtering/categories.json'), json.loads)
+categories = store.load()
+"""
+
+import threading
+import time
+
+# How often (in seconds) the blob's generation is checked
+REFRESH_INTERVAL = 300
+
+
+class BlobStore:
+
+    def __init__(self, get_blob, parse, refresh_interval=REFRESH_INTERVAL, clock=time.monotonic):
+        """
+        Args:
+            get_blob: Function that returns the blob with its generation.
+            parse: Function that turns the downloaded bytes into the value that is kept.
+            refresh_interval: Minimum number of seconds between generation checks.
+            clock: Dependency injection for mocking the time.
+        """
+        self.get_blob = get_blob
+        self.parse = parse
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.value = None
+        self.generation = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        '''Returns the parsed blob, downloading it again only if its generation changed.'''
+        now = self.clock()
+        if self.value is not None and not self.is_due(now):
+            return self.value
+
+        with self.lock:
+            # another thread may have refreshed the blob while we were waiting
+            if self.value is None or self.is_due(now):
+                blob = self.get_blob()
+                if self.value is None or blob.generation != self.generation:
+                    self.value = self.parse(blob.download_as_string())
+                    self.generation = blob.generation
+                self.checked_at = now
+        return self.value
+
+    def is_due(self, now):
+        return self.checked_at is None or now - self.checked_at >= self.refresh_interval
+
+    def expire(self):
+        '''Makes the next load check the blob's generation, e.g. when the blob is known to have changed.'''
+        self.checked_at = None
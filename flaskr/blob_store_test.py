@@ -0,0 +1,47 @@
+from flaskr.blob_store import BlobStore
+import json
+import pytest
+from unittest.mock import MagicMock
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def blob():
+    blob = MagicMock()
+    blob.generation = 1
+    blob.download_as_string.return_value = json.dumps({"types": ["Fire"]})
+    return blob
+
+
+def test_load_checks_generation_once_per_interval(blob):
+    clock = Clock()
+    get_blob = MagicMock(return_value=blob)
+    store = BlobStore(get_blob, json.loads, refresh_interval=60, clock=clock)
+
+    assert store.load() == {"types": ["Fire"]}
+    clock.now = 59
+    store.load()
+    get_blob.assert_called_once()
+
+    clock.now = 60
+    store.load()
+    assert get_blob.call_count == 2
+    blob.download_as_string.assert_called_once()
+
+
+def test_load_downloads_new_generation(blob):
+    clock = Clock()
+    store = BlobStore(lambda: blob, json.loads, refresh_interval=60, clock=clock)
+    store.load()
+
+    blob.generation = 2
+    blob.download_as_string.return_value = json.dumps({"types": ["Water"]})
+    store.expire()
+    assert store.load() == {"types": ["Water"]}
@@ -0,0 +1,110 @@
+"""This module contains the in-process caches used by the backend.
+
+ByteLRUCache is bounded by the total size of its values instead of the number of
+entries, evicts the least recently used entries first and can expire entries after
+a time to live that depends on the prefix of their key.
+
+Typical Usage:
+cache = ByteLRUCache(max_bytes=1024 * 1024, ttls={"images/": 3600})
+cache.put('authors/logo.jpg', image, size=len(image.data))
+image = cache.get('authors/logo.jpg')
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class ByteLRUCache:
+
+    def __init__(self, max_bytes, ttls=None, clock=time.monotonic):
+        """
+        Args:
+            max_bytes: Maximum total size of the cached values.
+            ttls: Dictionary mapping key prefixes to the seconds entries live, keys
+                  without a matching prefix never expire.
+            clock: Dependency injection for mocking the time.
+        """
+        self.max_bytes = max_bytes
+        self.ttls = ttls or {}
+        self.clock = clock
+        # key -> (value, size, expires_at), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        '''Returns the cached value for key, or None if it isn't cached or expired.'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+
+            value, size, expires_at = entry
+            if expires_at is not None and self.clock() >= expires_at:
+                self.remove(key)
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, key, value, size):
+        '''Caches value under key, evicting least recently used entries to stay under max_bytes.
+        Args:
+            key: Key of the entry, its prefix decides the time to live.
+            value: Value to cache.
+            size: Number of bytes the value takes.
+        '''
+        if size > self.max_bytes:
+            # caching it would evict everything else
+            return
+
+        ttl = self.get_ttl(key)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            expires_at = self.clock() + ttl if ttl is not None else None
+            self.entries[key] = (value, size, expires_at)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, key):
+        '''Drops key from the cache if it is cached.'''
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+    def clear(self):
+        '''Drops every entry.'''
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self):
+        '''Returns the hit, miss, eviction and expiration counters with the current size.'''
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.size)
+
+    def get_ttl(self, key):
+        '''Returns the time to live of the longest prefix matching key, None if there is none.'''
+        matches = [prefix for prefix in self.ttls if key.startswith(prefix)]
+        if not matches:
+            return None
+        return self.ttls[max(matches, key=len)]
+
+    def remove(self, key):
+        '''Removes an entry, the lock must be held.'''
+        value, size, expires_at = self.entries.pop(key)
+        self.size -= size
@@ -0,0 +1,75 @@
+from flaskr.cache import ByteLRUCache
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_get_and_put():
+    cache = ByteLRUCache(100)
+    assert cache.get("a") is None
+    cache.put("a", b"aaaa", size=4)
+    assert cache.get("a") == b"aaaa"
+    assert cache.get_stats() == {"hits": 1, "misses": 1, "evictions": 0, "expirations": 0, "entries": 1, "bytes": 4}
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ByteLRUCache(10)
+    cache.put("a", "a", size=4)
+    cache.put("b", "b", size=4)
+    cache.get("a")
+    cache.put("c", "c", size=4)
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
+    assert cache.get("c") == "c"
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.size == 8
+
+
+def test_value_bigger_than_budget_is_not_cached():
+    cache = ByteLRUCache(10)
+    cache.put("a", "a", size=4)
+    cache.put("big", "big", size=11)
+    assert cache.get("big") is None
+    assert cache.get("a") == "a"
+
+
+def test_replacing_entry_updates_size():
+    cache = ByteLRUCache(10)
+    cache.put("a", "a", size=4)
+    cache.put("a", "aa", size=6)
+    assert cache.size == 6
+    assert len(cache) == 1
+
+
+def test_prefix_ttl(clock):
+    cache = ByteLRUCache(100, ttls={"images/": 10, "images/tmp/": 1}, clock=clock)
+    cache.put("images/abra.png", "abra", size=1)
+    cache.put("images/tmp/mew.png", "mew", size=1)
+    cache.put("authors/logo.jpg", "logo", size=1)
+    clock.now = 5
+    assert cache.get("images/abra.png") == "abra"
+    assert cache.get("images/tmp/mew.png") is None
+    clock.now = 1000
+    assert cache.get("images/abra.png") is None
+    assert cache.get("authors/logo.jpg") == "logo"
+    assert cache.get_stats()["expirations"] == 2
+
+
+def test_invalidate():
+    cache = ByteLRUCache(100)
+    cache.put("a", "a", size=4)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.get("a") is None
+    assert cache.size == 0
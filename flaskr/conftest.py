@@ -0,0 +1,20 @@
+from flaskr.backend import Backend
+from flaskr.storage_drivers import LocalClient
+import pytest
+
+
+@pytest.fixture
+def local_client(tmp_path):
+    '''Storage client backed by a temporary directory.'''
+    return LocalClient(str(tmp_path / "storage"))
+
+
+@pytest.fixture
+def local_backends(local_client, tmp_path):
+    '''Makes backends that share the same local storage, like instances of the app sharing a bucket.'''
+
+    def make(**kwargs):
+        kwargs.setdefault("sprite_dir", str(tmp_path))
+        return Backend(local_client, **kwargs)
+
+    return make
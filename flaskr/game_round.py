@@ -0,0 +1,54 @@
+"""This module contains the state of a round of the "Who's that pokemon?" game.
+
+A round is started when the game page is shown and finished when the player guesses.
+Rounds are kept on the server, keyed by the player and a random round id that is
+stored in their session, so the guess is the only thing the player sends and they
+can't submit their own points or pokemon.
+
+Typical Usage:
+game_round = GameRound(seen.next_id(), seen, game_user)
+points = game_round.score('Pikachu', 'PIKACHU', current_points)
+"""
+
+import secrets
+
+# Points won by a right guess and lost by a wrong one
+RIGHT_GUESS_POINTS = 100
+WRONG_GUESS_POINTS = 50
+
+# Rough memory taken by a round with its seen pokemon and game user, used by the round caches
+ROUND_BYTES = 512
+
+
+def new_round_id():
+    return secrets.token_urlsafe(16)
+
+
+def round_key(username, round_id):
+    '''Returns the cache key of a round, rounds can only be found by the player who started them.'''
+    return f"rounds/{username}/{round_id}"
+
+
+class GameRound:
+
+    __slots__ = ("pokemon_id", "seen", "user", "saving", "finished")
+
+    def __init__(self, pokemon_id, seen, user):
+        """
+        Args:
+            pokemon_id: Id of the pokemon the player has to guess.
+            seen: SeenPokemon of the player when the round started.
+            user: Game user of the player with their "points" and "rank".
+        """
+        self.pokemon_id = pokemon_id
+        self.seen = seen
+        self.user = user
+        # the guess is being saved, and has been saved
+        self.saving = False
+        self.finished = False
+
+    def score(self, guess, answer, points):
+        '''Returns the player's points after guessing, starting from their current points, never below zero.'''
+        if guess.upper() == answer.upper():
+            return points + RIGHT_GUESS_POINTS
+        return max(0, points - WRONG_GUESS_POINTS)
@@ -0,0 +1,19 @@
+from flaskr.game_round import GameRound, round_key, new_round_id
+from flaskr.seen import SeenPokemon
+
+
+def test_right_guess_wins_points():
+    game_round = GameRound(25, SeenPokemon(seed=1), {"points": 0})
+    assert game_round.score("pikachu", "Pikachu", 100) == 200
+
+
+def test_wrong_guess_never_goes_below_zero():
+    game_round = GameRound(25, SeenPokemon(seed=1), {"points": 0})
+    assert game_round.score("Raichu", "Pikachu", 100) == 50
+    assert game_round.score("Raichu", "Pikachu", 20) == 0
+
+
+def test_round_keys_are_per_user():
+    round_id = new_round_id()
+    assert round_id != new_round_id()
+    assert round_key("ash", round_id) != round_key("misty", round_id)
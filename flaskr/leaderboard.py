@@ -0,0 +1,193 @@
+"""This module contains the order-statistic tree that keeps the game leaderboard sorted.
+
+Players are kept in a treap ordered by (-points, name), where every node knows the
+size of its subtree. Adding a player, changing their points, finding the rank of a
+player and reading the players at a range of ranks all take O(log n) time (plus the
+number of players read), instead of moving a player one position at a time.
+
+Typical Usage:
+leaderboard = Leaderboard()
+leaderboard.update('javier', 300)
+leaderboard.rank('javier')
+top_players = leaderboard.top(15)
+"""
+
+import random
+
+
+class _Node:
+    '''Treap node, key is (-points, name) and size counts the nodes of its subtree.'''
+
+    __slots__ = ("key", "priority", "left", "right", "size")
+
+    def __init__(self, key, priority):
+        self.key = key
+        self.priority = priority
+        self.left = None
+        self.right = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    return node
+
+
+def _split(node, key):
+    '''Splits the tree into the nodes with keys smaller than key and the rest.'''
+    if node is None:
+        return None, None
+    if node.key < key:
+        smaller, rest = _split(node.right, key)
+        node.right = smaller
+        return _update(node), rest
+    smaller, rest = _split(node.left, key)
+    node.left = rest
+    return smaller, _update(node)
+
+
+def _merge(left, right):
+    '''Joins two trees where every key of left is smaller than every key of right.'''
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _copy(node):
+    if node is None:
+        return None
+    copy = _Node(node.key, node.priority)
+    copy.left = _copy(node.left)
+    copy.right = _copy(node.right)
+    copy.size = node.size
+    return copy
+
+
+def _remove(node, key):
+    if node is None:
+        return None
+    if key == node.key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _remove(node.left, key)
+    else:
+        node.right = _remove(node.right, key)
+    return _update(node)
+
+
+def _collect(node, start, stop, keys):
+    '''Appends the keys of the nodes at in-order positions [start, stop) to keys.'''
+    if node is None or start >= stop:
+        return
+    left_size = _size(node.left)
+    if start < left_size:
+        _collect(node.left, start, min(stop, left_size), keys)
+    if start <= left_size < stop:
+        keys.append(node.key)
+    if stop > left_size + 1:
+        _collect(node.right, max(0, start - left_size - 1), stop - left_size - 1, keys)
+
+
+class Leaderboard:
+
+    def __init__(self, seed=None):
+        """
+        Args:
+            seed: Seed for the node priorities, only useful to make tests repeatable.
+        """
+        self.points = {}
+        self.root = None
+        self.random = random.Random(seed)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, name):
+        return name in self.points
+
+    @classmethod
+    def from_list(cls, ranks_list):
+        '''Builds a leaderboard from the stored list of {"name", "points"} dictionaries.'''
+        leaderboard = cls()
+        for user in ranks_list:
+            leaderboard.update(user["name"], user["points"])
+        return leaderboard
+
+    def copy(self):
+        '''Returns a leaderboard with the same players that can be changed without changing this one.'''
+        leaderboard = Leaderboard()
+        leaderboard.points = dict(self.points)
+        leaderboard.root = _copy(self.root)
+        leaderboard.random = random.Random(self.random.random())
+        return leaderboard
+
+    def update(self, name, points):
+        '''Adds a player or changes their points.
+        Args:
+            name: Username of the player.
+            points: New amount of points of the player.
+        Returns:
+            Tuple with the old rank (None for a new player) and the new rank.
+        '''
+        old_rank = None
+        if name in self.points:
+            old_rank = self.rank(name)
+            self.root = _remove(self.root, (-self.points[name], name))
+
+        key = (-points, name)
+        smaller, rest = _split(self.root, key)
+        new_rank = _size(smaller) + 1
+        self.root = _merge(_merge(smaller, _Node(key, self.random.random())), rest)
+        self.points[name] = points
+        return old_rank, new_rank
+
+    def remove(self, name):
+        '''Removes a player from the leaderboard.'''
+        points = self.points.pop(name)
+        self.root = _remove(self.root, (-points, name))
+
+    def rank(self, name):
+        '''Returns the 1-based rank of a player, or None if they are not on the leaderboard.'''
+        if name not in self.points:
+            return None
+        key = (-self.points[name], name)
+        rank = 1
+        node = self.root
+        while node is not None:
+            if node.key < key:
+                rank += _size(node.left) + 1
+                node = node.right
+            elif node.key > key:
+                node = node.left
+            else:
+                return rank + _size(node.left)
+        return None
+
+    def range(self, start_rank, end_rank):
+        '''Returns the players from start_rank to end_rank, both included.
+        Returns:
+            List of {"name", "points", "rank"} dictionaries ordered by rank.
+        '''
+        start = max(start_rank, 1) - 1
+        keys = []
+        _collect(self.root, start, min(end_rank, len(self)), keys)
+        return [{"name": name, "points": -points, "rank": start + index + 1}
+                for index, (points, name) in enumerate(keys)]
+
+    def top(self, k=None):
+        '''Returns the k best players (every player when k is None) ordered by rank.'''
+        return self.range(1, len(self) if k is None else k)
+
+    def to_list(self):
+        '''Returns every player ordered by rank, in the format stored in ranks_list.json.'''
+        return self.top()
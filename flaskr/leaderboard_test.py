@@ -0,0 +1,199 @@
+from flaskr.leaderboard import Leaderboard
+import random
+
+
+# Swap based sorting that Backend.sort_leaderboard used before the leaderboard engine,
+# kept to check the engine against it.
+
+def legacy_sort_leaderboard(leaderboard, user, is_new_user):
+    '''Sorts the leaderboard by points and ranks.
+    If the user lost points it would move down the user to the right position in the leaderboard if necessary.
+    If the user gained points it would move up the user to the right position in the leaderboard if necessary.
+    Args:
+        leaderboard: Leaderboard list with all user game stats.
+        user: Current user being moved up or down on rank.
+    Returns:
+        Tuple with the updated leaderboard and current user with updated rank.
+    '''
+    user_index = user["rank"] - 1
+    old_user = leaderboard[user_index]
+    user_points = user["points"]
+
+    def sort_up(user_index, user_points):
+        # User to compare
+        other_user_index = user_index - 1
+        other_user = leaderboard[other_user_index]
+        other_user_points = other_user.get("points")
+
+        # User did not rank up
+        if user_points <= other_user_points or user_index == 0:
+            leaderboard[user_index] = user
+            return leaderboard, user
+
+        # User ranked up        
+        while other_user_index >= 0 and user_points > other_user_points:
+
+            # Update ranks and leaderboard with new ranks
+            user["rank"] = user['rank'] - 1
+            other_user["rank"] = other_user["rank"] + 1 
+
+
+            leaderboard[other_user_index] = other_user
+            leaderboard[user_index] = user
+
+            # Update leaderboard list
+            leaderboard[other_user_index], leaderboard[user_index] = leaderboard[user_index], leaderboard[other_user_index]
+
+            # Updates index
+            user_index -= 1
+            other_user_index -= 1
+
+            if other_user_index >= 0:
+                # Get new other user
+                other_user = leaderboard[other_user_index]
+                other_user_points = other_user["points"]
+
+        return leaderboard, user
+
+    def sort_down(user_index, user_points):
+
+        # Checks if the current user is on the last index of the list, if not it assigns another user to be compared
+        other_user_index = user_index + 1 if user_index < len(leaderboard) - 1 else None
+        other_user = leaderboard[other_user_index] if other_user_index else None
+        other_user_points = other_user.get("points") if other_user_index else None
+
+        # Current user is in the last spot or did not rank down
+        if other_user_index is None or user_points >= other_user_points:
+            leaderboard[user_index] = user
+            return leaderboard, user
+
+        while (other_user_index <= len(leaderboard) - 1) and user_points <= other_user_points:
+
+            # Update ranks and leaderboard with new ranks
+            user["rank"] = user['rank'] + 1
+            other_user["rank"] = other_user["rank"] - 1 
+
+
+            leaderboard[other_user_index] = other_user
+            leaderboard[user_index] = user
+
+            # Update leaderboard list
+            leaderboard[other_user_index], leaderboard[user_index] = leaderboard[user_index], leaderboard[other_user_index]
+
+            # Updates index
+            user_index += 1
+            other_user_index += 1
+
+            if other_user_index <= len(leaderboard) - 1:
+                # Get new other user
+                other_user = leaderboard[other_user_index]
+                other_user_points = other_user["points"]
+
+        return leaderboard, user
+
+    if is_new_user:
+        return sort_up(user_index, user_points)
+
+    if old_user["points"] < user_points:
+        return sort_up(user_index, user_points)
+
+    return sort_down(user_index, user_points)
+
+
+def legacy_update_leaderboard(leaderboard, updated_user):
+    if not updated_user["rank"]:
+        updated_user["rank"] = len(leaderboard) + 1
+        leaderboard.append(updated_user)
+        return legacy_sort_leaderboard(leaderboard, updated_user, True)
+    elif (len(leaderboard) == 1 and updated_user["name"] == leaderboard[0].get("name")):
+        leaderboard[0] = updated_user
+        return leaderboard, updated_user
+    return legacy_sort_leaderboard(leaderboard, updated_user, False)
+
+
+def test_update_and_rank():
+    leaderboard = Leaderboard()
+    assert leaderboard.update("javier", 100) == (None, 1)
+    assert leaderboard.update("edgar", 300) == (None, 1)
+    assert leaderboard.update("mark", 200) == (None, 2)
+    assert leaderboard.rank("javier") == 3
+    assert leaderboard.update("javier", 400) == (3, 1)
+    assert [user["name"] for user in leaderboard.top()] == ["javier", "edgar", "mark"]
+    assert leaderboard.rank("nobody") is None
+
+
+def test_equal_points_ordered_by_name():
+    leaderboard = Leaderboard()
+    leaderboard.update("mark", 100)
+    leaderboard.update("edgar", 100)
+    leaderboard.update("javier", 100)
+    assert leaderboard.top() == [{"name": "edgar", "points": 100, "rank": 1},
+                                 {"name": "javier", "points": 100, "rank": 2},
+                                 {"name": "mark", "points": 100, "rank": 3}]
+
+
+def test_range_and_top():
+    leaderboard = Leaderboard(seed=1)
+    for i in range(50):
+        leaderboard.update(f"user{i:02d}", i * 10)
+    assert [user["points"] for user in leaderboard.top(3)] == [490, 480, 470]
+    assert leaderboard.range(10, 12) == [{"name": "user40", "points": 400, "rank": 10},
+                                         {"name": "user39", "points": 390, "rank": 11},
+                                         {"name": "user38", "points": 380, "rank": 12}]
+    assert len(leaderboard.top(100)) == 50
+    assert leaderboard.range(60, 70) == []
+
+
+def test_remove():
+    leaderboard = Leaderboard.from_list([{"name": "a", "points": 3}, {"name": "b", "points": 2}, {"name": "c", "points": 1}])
+    leaderboard.remove("b")
+    assert leaderboard.rank("c") == 2
+    assert len(leaderboard) == 2
+
+
+def test_copy_is_independent():
+    leaderboard = Leaderboard.from_list([{"name": "a", "points": 3}, {"name": "b", "points": 2}])
+    copy = leaderboard.copy()
+    copy.update("c", 5)
+    copy.update("b", 1)
+    assert leaderboard.to_list() == [{"name": "a", "points": 3, "rank": 1}, {"name": "b", "points": 2, "rank": 2}]
+    assert [user["name"] for user in copy.to_list()] == ["c", "a", "b"]
+
+
+def test_matches_legacy_sorting():
+    rng = random.Random(386)
+    engine = Leaderboard(seed=386)
+    legacy = []
+    ranks = {}
+
+    for step in range(2000):
+        name = f"user{rng.randrange(40)}"
+        # unique points so that both orders are fully determined
+        points = rng.randrange(100000) * 2000 + step
+
+        user = {"name": name, "points": points, "rank": ranks.get(name)}
+        legacy, user = legacy_update_leaderboard(legacy, user)
+        ranks = {other["name"]: other["rank"] for other in legacy}
+        old_rank, new_rank = engine.update(name, points)
+
+        assert new_rank == user["rank"]
+        assert [(other["name"], other["points"]) for other in legacy] == [(other["name"], other["points"]) for other in engine.top()]
+        assert all(other["rank"] == index + 1 for index, other in enumerate(legacy))
+
+
+def test_points_order_matches_legacy_sorting_with_ties():
+    rng = random.Random(15)
+    engine = Leaderboard(seed=15)
+    legacy = []
+    ranks = {}
+
+    for step in range(2000):
+        name = f"user{rng.randrange(25)}"
+        points = rng.randrange(0, 1000, 50)
+
+        user = {"name": name, "points": points, "rank": ranks.get(name)}
+        legacy, user = legacy_update_leaderboard(legacy, user)
+        ranks = {other["name"]: other["rank"] for other in legacy}
+        engine.update(name, points)
+
+        assert [other["points"] for other in legacy] == [other["points"] for other in engine.top()]
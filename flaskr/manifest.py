@@ -0,0 +1,191 @@
+"""This module contains the page manifest, a compact copy of the metadata of every wiki page.
+
+Every page blob (pages/<name>) is also summarized by one JSON line in one of a few
+manifest shards, so a cold process can build its page index by reading the shards
+instead of downloading every page blob:
+
+  manifest/shard-00.jsonl ... manifest/shard-15.jsonl
+  {"page": "pages/abra", "name": "Abra", "type": "Psychic", "region": "Kanto", ...}
+
+Uploads append their line with a read-modify-write guarded by the shard's generation,
+so concurrent uploads to the same shard retry instead of overwriting each other.
+Compaction rewrites every shard from the page blobs, dropping duplicate lines and
+adding pages whose append was lost. Only lines appended while the page blobs are read
+are kept on top of them. The manifest only lists every page once it was compacted, so
+until compaction writes manifest/complete it is treated as missing, and an append that
+can't be written removes manifest/complete again until the next compaction.
+
+Typical Usage:
+manifest = PageManifest(backend.get_content_bucket)
+manifest.append('pages/abra', pokemon_data)
+manifest.compact(backend.scan_pages)
+entries = manifest.read()
+"""
+
+import json as jsonlib
+import logging
+import zlib
+
+MANIFEST_PREFIX = "manifest/"
+SHARD_COUNT = 16
+# Written by compaction, the shards only hold every page once it exists
+COMPLETE_MARKER = MANIFEST_PREFIX + "complete"
+# Page attributes copied into the manifest, the ones the page index needs
+MANIFEST_FIELDS = ("name", "type", "region", "nature", "level", "image-name")
+# How many times a write is retried when another process changed the shard first
+WRITE_RETRIES = 5
+
+logger = logging.getLogger(__name__)
+
+
+def shard_name(page_name, shard_count=SHARD_COUNT):
+    '''Returns the name of the shard that holds the manifest line of a page.'''
+    shard = zlib.crc32(page_name.encode("utf-8")) % shard_count
+    return f"{MANIFEST_PREFIX}shard-{shard:02d}.jsonl"
+
+
+def manifest_entry(page_name, pokemon_data):
+    '''Returns the manifest line of a page as a dictionary.'''
+    entry = {"page": page_name}
+    for field in MANIFEST_FIELDS:
+        if field in pokemon_data:
+            entry[field] = pokemon_data[field]
+    return entry
+
+
+def run_sequentially(*calls):
+    return [call[0](*call[1:]) for call in calls]
+
+
+class PageManifest:
+
+    def __init__(self, get_bucket, json=jsonlib, shard_count=SHARD_COUNT, gather=run_sequentially):
+        """
+        Args:
+            get_bucket: Function that returns the bucket holding the manifest.
+            json: Dependency injection for mocking the json module.
+            shard_count: Number of shards the pages are spread over.
+            gather: Function that runs independent calls together, like Backend.gather.
+        """
+        self.get_bucket = get_bucket
+        self.json = json
+        self.shard_count = shard_count
+        self.gather = gather
+
+    def append(self, page_name, pokemon_data):
+        """ Adds the line of a newly uploaded page to its shard.
+        Args:
+            page_name: Name of the page blob, e.g. 'pages/abra'.
+            pokemon_data: Dictionary with the page data stored in the blob.
+        Returns:
+            True if the line was written, False if the shard kept changing, compaction adds it later.
+        """
+        from google.api_core.exceptions import PreconditionFailed, NotFound
+
+        name = shard_name(page_name, self.shard_count)
+        line = self.json.dumps(manifest_entry(page_name, pokemon_data)) + "\n"
+        for _ in range(WRITE_RETRIES):
+            data, generation = self.read_shard(name)
+            try:
+                self.write_shard(name, data + line.encode("utf-8"), generation)
+                return True
+            except PreconditionFailed:
+                continue
+        logger.warning("could not append %s to %s", page_name, name)
+        try:
+            # the manifest is missing a page, readers scan the page blobs until it is compacted
+            self.get_bucket().blob(COMPLETE_MARKER).delete()
+        except NotFound:
+            pass
+        return False
+
+    def read(self):
+        """ Reads every shard.
+        Returns:
+            List of (page name, metadata) tuples ordered by page name like the bucket lists them,
+            None if the manifest was never compacted.
+        """
+        bucket = self.get_bucket()
+        names = [blob.name for blob in bucket.list_blobs(prefix=MANIFEST_PREFIX)]
+        if COMPLETE_MARKER not in names:
+            # shards written by appends alone only hold the pages uploaded since
+            return None
+        names.remove(COMPLETE_MARKER)
+
+        entries = {}
+        for data, _ in self.gather(*[(self.read_shard, name) for name in names]):
+            entries.update(self.parse_shard(data))
+        return sorted(entries.items())
+
+    def compact(self, scan):
+        """ Rewrites every shard with exactly one line per page.
+        Args:
+            scan: Function that reads the page blobs and returns a list of (page name, page data) tuples.
+        Returns:
+            Number of pages in the manifest.
+        """
+        shards = {f"{MANIFEST_PREFIX}shard-{index:02d}.jsonl": {} for index in range(self.shard_count)}
+        # the lines already in the shards are replaced by the scan, e.g. of pages deleted since
+        scanned = dict(zip(shards, self.gather(*[(self.read_shard, name) for name in shards])))
+        for page_name, pokemon_data in scan():
+            shards[shard_name(page_name, self.shard_count)][page_name] = manifest_entry(page_name, pokemon_data)
+
+        counts = self.gather(*[(self.compact_shard, name, entries, scanned[name][0])
+                               for name, entries in shards.items()])
+        # only now every page is in the shards
+        self.get_bucket().blob(COMPLETE_MARKER).upload_from_string(data=b"", content_type="text/plain")
+        return sum(counts)
+
+    def compact_shard(self, name, entries, scanned):
+        '''Rewrites a shard with the scanned entries, keeping lines appended since the shard was read as scanned.'''
+        from google.api_core.exceptions import PreconditionFailed
+
+        old_lines = set(scanned.splitlines())
+        for _ in range(WRITE_RETRIES):
+            data, generation = self.read_shard(name)
+            merged = dict(entries)
+            appended = b"\n".join(line for line in data.splitlines() if line not in old_lines)
+            # pages uploaded during the scan are newer than what it read
+            for page_name, pokemon_data in self.parse_shard(appended).items():
+                merged[page_name] = dict(pokemon_data, page=page_name)
+            lines = "".join(self.json.dumps(merged[page_name]) + "\n" for page_name in sorted(merged))
+            try:
+                self.write_shard(name, lines.encode("utf-8"), generation)
+                return len(merged)
+            except PreconditionFailed:
+                continue
+        raise RuntimeError(f"{name} kept changing while it was compacted")
+
+    def read_shard(self, name):
+        """ Downloads a shard.
+        Returns:
+            Tuple with the bytes of the shard and its generation, (b"", 0) if it doesn't exist.
+        """
+        from google.api_core.exceptions import PreconditionFailed, NotFound
+
+        while True:
+            blob = self.get_bucket().get_blob(name)
+            if blob is None:
+                return b"", 0
+            try:
+                # the contents must be the ones of the generation that is written against
+                return blob.download_as_bytes(if_generation_match=blob.generation), blob.generation
+            except (PreconditionFailed, NotFound):
+                # the shard changed between the two calls
+                continue
+
+    def write_shard(self, name, data, generation):
+        '''Uploads a shard if it is still at the given generation (0 when it must not exist).'''
+        blob = self.get_bucket().blob(name)
+        blob.upload_from_string(data=data, content_type="application/x-ndjson", if_generation_match=generation)
+
+    def parse_shard(self, data):
+        '''Returns {page name: metadata} for every line of a shard, later lines win.'''
+        entries = {}
+        for line in data.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            entry = self.json.loads(line)
+            page_name = entry.pop("page")
+            entries[page_name] = entry
+        return entries
@@ -0,0 +1,135 @@
+from flaskr.manifest import PageManifest, shard_name, manifest_entry
+from flaskr.storage_drivers import LocalClient
+from flaskr.backend import Backend
+from google.api_core.exceptions import PreconditionFailed
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import io
+import json
+import pytest
+
+
+@pytest.fixture
+def client(tmp_path):
+    return LocalClient(str(tmp_path))
+
+
+@pytest.fixture
+def manifest(client):
+    return PageManifest(lambda: client.get_bucket("content"))
+
+
+def abra():
+    return {"name": "Abra", "type": "Psychic", "region": "Kanto", "nature": "Timid", "level": "10",
+            "desc": "Sleeps 18 hours a day.", "image-name": "abra.png", "image-type": "image/png"}
+
+
+def test_shard_name_is_stable():
+    assert shard_name("pages/abra") == shard_name("pages/abra")
+    assert shard_name("pages/abra").startswith("manifest/shard-")
+    assert shard_name("pages/abra", shard_count=1) == "manifest/shard-00.jsonl"
+
+
+def test_manifest_entry_keeps_index_fields():
+    entry = manifest_entry("pages/abra", abra())
+    assert entry == {"page": "pages/abra", "name": "Abra", "type": "Psychic", "region": "Kanto",
+                     "nature": "Timid", "level": "10", "image-name": "abra.png"}
+
+
+def test_read_without_manifest(manifest):
+    assert manifest.read() is None
+
+
+def test_append_and_read(manifest):
+    manifest.compact(list)
+    assert manifest.append("pages/pikachu", {"name": "Pikachu", "type": "Electric"})
+    assert manifest.append("pages/abra", abra())
+    pages = manifest.read()
+    assert [page_name for page_name, _ in pages] == ["pages/abra", "pages/pikachu"]
+    assert pages[1][1] == {"name": "Pikachu", "type": "Electric"}
+
+
+def test_concurrent_appends_are_not_lost(client):
+    manifest = PageManifest(lambda: client.get_bucket("content"), shard_count=1)
+    manifest.compact(list)
+    names = [f"pages/pokemon{i}" for i in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(executor.map(lambda name: manifest.append(name, {"name": name[6:]}), names))
+    assert [page_name for page_name, _ in manifest.read()] == names
+
+
+def test_compact_removes_duplicates_and_adds_missing_pages(client, manifest):
+    manifest.append("pages/abra", {"name": "Abra"})
+    manifest.append("pages/abra", {"name": "Abra"})
+    # deleted after it was appended, the scan doesn't find it
+    manifest.append("pages/ditto", {"name": "Ditto"})
+
+    def scan():
+        # mew is uploaded while the pages are scanned, so it is kept
+        manifest.append("pages/mew", {"name": "Mew"})
+        return [("pages/abra", abra()), ("pages/pikachu", {"name": "Pikachu"})]
+
+    assert manifest.compact(scan) == 3
+
+    assert [page_name for page_name, _ in manifest.read()] == ["pages/abra", "pages/mew", "pages/pikachu"]
+    shard = client.get_bucket("content").get_blob(shard_name("pages/abra")).download_as_bytes()
+    assert shard.count(b"pages/abra") == 1
+
+
+def test_failed_append_makes_readers_scan_the_pages(client, manifest):
+    manifest.compact(list)
+    assert manifest.read() == []
+    with patch.object(manifest, "write_shard", side_effect=PreconditionFailed("changed")):
+        assert manifest.append("pages/abra", abra()) is False
+    assert manifest.read() is None
+    # a second failure finds the manifest already incomplete
+    with patch.object(manifest, "write_shard", side_effect=PreconditionFailed("changed")):
+        assert manifest.append("pages/abra", abra()) is False
+
+    manifest.compact(lambda: [("pages/abra", abra())])
+    assert [page_name for page_name, _ in manifest.read()] == ["pages/abra"]
+
+
+def test_backend_builds_index_from_manifest(client):
+    backend = Backend(client, use_manifest=True)
+    backend.compact_manifest()
+    image = io.BytesIO(b"\x89PNG")
+    image.filename = "abra.png"
+    image.content_type = "image/png"
+    assert backend.upload(image, abra())
+
+    # a new process reads the shards instead of the page blobs
+    backend = Backend(client, use_manifest=True)
+    backend.scan_pages = None
+    assert backend.get_pages_using_filter_and_search(None, "Psychic", None, None, None) == ["pages/abra"]
+
+
+def test_backend_falls_back_to_page_blobs(client):
+    backend = Backend(client, use_manifest=True)
+    backend.get_content_bucket().blob("pages/abra").upload_from_string(json.dumps(abra()))
+    assert backend.get_page_names() == (["pages/abra"], None)
+
+    assert backend.compact_manifest() == 1
+    pages = Backend(client, use_manifest=True).manifest.read()
+    assert [page_name for page_name, _ in pages] == ["pages/abra"]
+    assert pages[0][1]["type"] == "Psychic"
+
+
+def test_upload_before_first_compaction_keeps_older_pages(client):
+    backend = Backend(client, use_manifest=True)
+    bucket = backend.get_content_bucket()
+    for name in ["abra", "bulbasaur", "charmander"]:
+        bucket.blob(f"pages/{name}").upload_from_string(json.dumps({"name": name.capitalize()}))
+    image = io.BytesIO(b"\x89PNG")
+    image.filename = "dratini.png"
+    image.content_type = "image/png"
+    assert backend.upload(image, {"name": "Dratini", "type": "Dragon"})
+
+    expected = ["pages/abra", "pages/bulbasaur", "pages/charmander", "pages/dratini"]
+    assert backend.manifest.read() is None
+    assert backend.get_all_page_names() == expected
+    assert Backend(client, use_manifest=True).get_page_index().page(None, 10) == (expected, None)
+
+    # the first compaction keeps the appended line and completes the manifest
+    assert backend.compact_manifest() == 4
+    assert [page_name for page_name, _ in backend.manifest.read()] == expected
@@ -0,0 +1,303 @@
+"""This module records every storage call the backend makes and exposes them to Prometheus.
+
+InstrumentedClient wraps a storage client (see storage_drivers.py) and reports the kind
+of every operation, the prefix of the blob, the bytes moved and how long it took to a
+StorageMetrics object. Operations are grouped by the Flask endpoint of the request that
+made them. StorageMetrics renders counters and latency histograms per route and per
+operation in the Prometheus text format for the /metrics endpoint, and can add the
+storage calls of each request to a debug response header.
+
+Typical Usage:
+metrics = StorageMetrics()
+backend = Backend(InstrumentedClient(make_client(), metrics))
+metrics.init_app(app)
+"""
+
+from collections import Counter, defaultdict
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+# Upper bounds (seconds) of the latency histogram buckets
+HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Response header with the storage calls of the request, e.g. "get_blob=2;read=2"
+DEBUG_HEADER = "X-Storage-Calls"
+
+
+def blob_prefix(name):
+    '''Returns the folder part of a blob name (at most two levels), so labels don't include user names.'''
+    folders = name.split("/")[:-1][:2]
+    if not folders:
+        return "/"
+    return "/".join(folders) + "/"
+
+
+def current_route():
+    '''Returns the endpoint of the Flask request being handled, "none" outside of requests.'''
+    if has_request_context():
+        return request.endpoint or "unknown"
+    return "none"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labels):
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * len(HISTOGRAM_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels(labels + [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{format_labels(labels + [('le', '+Inf')])} {self.count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.count}")
+        return lines
+
+
+class StorageMetrics:
+
+    def __init__(self, clock=time.perf_counter):
+        """
+        Args:
+            clock: Dependency injection for mocking the time.
+        """
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (route, op, prefix) -> count / bytes
+        self.operations = Counter()
+        self.bytes = Counter()
+        # (route, op) -> Histogram
+        self.operation_durations = defaultdict(Histogram)
+        # route -> Histogram
+        self.request_durations = defaultdict(Histogram)
+
+    def record(self, op, blob_name, nbytes, duration):
+        '''Records a storage operation made by the current request.
+        Args:
+            op: Kind of operation, e.g. get_bucket, get_blob, list_blobs, read or write.
+            blob_name: Name (or prefix) of the blob, None for bucket operations.
+            nbytes: Number of bytes read or written.
+            duration: Seconds the operation took.
+        '''
+        route = current_route()
+        prefix = blob_prefix(blob_name) if blob_name is not None else "/"
+        with self.lock:
+            self.operations[(route, op, prefix)] += 1
+            self.bytes[(route, op, prefix)] += nbytes
+            self.operation_durations[(route, op)].observe(duration)
+            if has_request_context():
+                g.setdefault("storage_calls", Counter())[op] += 1
+
+    def init_app(self, app):
+        '''Times every request and, in debug mode or with STORAGE_DEBUG_HEADER set, adds its storage calls to the response.'''
+
+        @app.before_request
+        def start_timer():
+            g.request_started = self.clock()
+            g.storage_calls = Counter()
+
+        @app.after_request
+        def stop_timer(response):
+            started = g.get("request_started")
+            if started is not None:
+                with self.lock:
+                    self.request_durations[request.endpoint or "unknown"].observe(self.clock() - started)
+            if app.debug or app.config.get("STORAGE_DEBUG_HEADER"):
+                calls = g.get("storage_calls", Counter())
+                response.headers[DEBUG_HEADER] = ";".join(f"{op}={count}" for op, count in sorted(calls.items()))
+            return response
+
+    def render(self):
+        '''Returns every metric in the Prometheus text exposition format.'''
+        lines = []
+        with self.lock:
+            lines.append("# HELP wiki_storage_operations_total Storage operations by route, operation and blob prefix.")
+            lines.append("# TYPE wiki_storage_operations_total counter")
+            for (route, op, prefix), count in sorted(self.operations.items()):
+                labels = [("route", route), ("op", op), ("prefix", prefix)]
+                lines.append(f"wiki_storage_operations_total{format_labels(labels)} {count}")
+
+            lines.append("# HELP wiki_storage_bytes_total Bytes read or written by route, operation and blob prefix.")
+            lines.append("# TYPE wiki_storage_bytes_total counter")
+            for (route, op, prefix), nbytes in sorted(self.bytes.items()):
+                labels = [("route", route), ("op", op), ("prefix", prefix)]
+                lines.append(f"wiki_storage_bytes_total{format_labels(labels)} {nbytes}")
+
+            lines.append("# HELP wiki_storage_operation_duration_seconds Storage operation latency by route and operation.")
+            lines.append("# TYPE wiki_storage_operation_duration_seconds histogram")
+            for (route, op), histogram in sorted(self.operation_durations.items()):
+                lines.extend(histogram.render("wiki_storage_operation_duration_seconds", [("route", route), ("op", op)]))
+
+            lines.append("# HELP wiki_request_duration_seconds Request latency by route.")
+            lines.append("# TYPE wiki_request_duration_seconds histogram")
+            for route, histogram in sorted(self.request_durations.items()):
+                lines.extend(histogram.render("wiki_request_duration_seconds", [("route", route)]))
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedClient:
+    '''Storage client wrapper that records every operation to a StorageMetrics object.'''
+
+    def __init__(self, client, metrics):
+        self.client = client
+        self.metrics = metrics
+
+    def get_bucket(self, name):
+        started = self.metrics.clock()
+        bucket = self.client.get_bucket(name)
+        self.metrics.record("get_bucket", None, 0, self.metrics.clock() - started)
+        return InstrumentedBucket(bucket, self.metrics)
+
+    def bucket(self, name):
+        return InstrumentedBucket(self.client.bucket(name), self.metrics)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class InstrumentedBucket:
+
+    def __init__(self, bucket, metrics):
+        self.bucket = bucket
+        self.metrics = metrics
+
+    def blob(self, name, *args, **kwargs):
+        return InstrumentedBlob(self.bucket.blob(name, *args, **kwargs), self.metrics)
+
+    def get_blob(self, name, *args, **kwargs):
+        started = self.metrics.clock()
+        blob = self.bucket.get_blob(name, *args, **kwargs)
+        self.metrics.record("get_blob", name, 0, self.metrics.clock() - started)
+        return InstrumentedBlob(blob, self.metrics) if blob is not None else None
+
+    def list_blobs(self, *args, **kwargs):
+        prefix = kwargs.get("prefix", args[0] if args else "")
+        blobs = iter(self.bucket.list_blobs(*args, **kwargs))
+        elapsed = 0.0
+        try:
+            while True:
+                # only the time spent fetching blobs counts, not the caller's work between them
+                started = self.metrics.clock()
+                try:
+                    blob = next(blobs)
+                except StopIteration:
+                    elapsed += self.metrics.clock() - started
+                    return
+                elapsed += self.metrics.clock() - started
+                yield InstrumentedBlob(blob, self.metrics)
+        finally:
+            self.metrics.record("list_blobs", prefix, 0, elapsed)
+
+    def __getattr__(self, name):
+        return getattr(self.bucket, name)
+
+
+class InstrumentedBlob:
+
+    def __init__(self, blob, metrics):
+        self.blob = blob
+        self.metrics = metrics
+
+    def timed(self, op, func, *args, **kwargs):
+        '''Calls func and records it as op, counting the bytes of its result for reads.'''
+        started = self.metrics.clock()
+        result = func(*args, **kwargs)
+        nbytes = len(result) if op == "read" and isinstance(result, (bytes, str)) else 0
+        self.metrics.record(op, self.blob.name, nbytes, self.metrics.clock() - started)
+        return result
+
+    def download_as_bytes(self, *args, **kwargs):
+        return self.timed("read", self.blob.download_as_bytes, *args, **kwargs)
+
+    def download_as_string(self, *args, **kwargs):
+        return self.timed("read", self.blob.download_as_string, *args, **kwargs)
+
+    def download_as_text(self, *args, **kwargs):
+        return self.timed("read", self.blob.download_as_text, *args, **kwargs)
+
+    def upload_from_string(self, data, *args, **kwargs):
+        started = self.metrics.clock()
+        try:
+            return self.blob.upload_from_string(data, *args, **kwargs)
+        finally:
+            self.metrics.record("write", self.blob.name, len(data), self.metrics.clock() - started)
+
+    def upload_from_file(self, *args, **kwargs):
+        return self.timed("write", self.blob.upload_from_file, *args, **kwargs)
+
+    def reload(self, *args, **kwargs):
+        return self.timed("metadata", self.blob.reload, *args, **kwargs)
+
+    def exists(self, *args, **kwargs):
+        return self.timed("metadata", self.blob.exists, *args, **kwargs)
+
+    def open(self, mode="r", *args, **kwargs):
+        started = self.metrics.clock()
+        file = self.blob.open(mode, *args, **kwargs)
+        return InstrumentedFile(file, self, mode, self.metrics.clock() - started)
+
+    def __getattr__(self, name):
+        return getattr(self.blob, name)
+
+
+class InstrumentedFile:
+    '''File returned by InstrumentedBlob.open, reads and writes are recorded when the file is closed.'''
+
+    def __init__(self, file, blob, mode, elapsed):
+        self.file = file
+        self.blob = blob
+        self.op = "write" if "w" in mode else "read"
+        self.elapsed = elapsed
+        self.nbytes = 0
+        self.closed = False
+
+    def read(self, *args):
+        started = self.blob.metrics.clock()
+        data = self.file.read(*args)
+        self.elapsed += self.blob.metrics.clock() - started
+        self.nbytes += len(data)
+        return data
+
+    def write(self, data):
+        self.nbytes += len(data)
+        return self.file.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        started = self.blob.metrics.clock()
+        self.file.close()
+        self.elapsed += self.blob.metrics.clock() - started
+        self.blob.metrics.record(self.op, self.blob.blob.name, self.nbytes, self.elapsed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
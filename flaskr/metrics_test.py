@@ -0,0 +1,121 @@
+from flaskr.metrics import StorageMetrics, InstrumentedClient, blob_prefix, DEBUG_HEADER
+from flaskr.storage_drivers import LocalClient
+from flask import Flask
+import pytest
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        # every call to the clock takes 8ms
+        self.now += 0.008
+        return self.now
+
+
+@pytest.fixture
+def metrics():
+    return StorageMetrics(clock=FakeClock())
+
+
+@pytest.fixture
+def client(tmp_path, metrics):
+    return InstrumentedClient(LocalClient(str(tmp_path)), metrics)
+
+
+def test_blob_prefix():
+    assert blob_prefix("pages/abra") == "pages/"
+    assert blob_prefix("user_game_ranking/seen/javier") == "user_game_ranking/seen/"
+    assert blob_prefix("master_pokedex/images/001.png") == "master_pokedex/images/"
+    assert blob_prefix("javier") == "/"
+
+
+def test_records_reads_and_writes(client, metrics):
+    bucket = client.get_bucket("content")
+    bucket.blob("pages/abra").upload_from_string('{"name": "Abra"}')
+    blob = bucket.get_blob("pages/abra")
+    with blob.open("r") as f:
+        assert f.read() == '{"name": "Abra"}'
+
+    assert metrics.operations[("none", "get_bucket", "/")] == 1
+    assert metrics.operations[("none", "write", "pages/")] == 1
+    assert metrics.bytes[("none", "write", "pages/")] == 16
+    assert metrics.operations[("none", "get_blob", "pages/")] == 1
+    assert metrics.operations[("none", "read", "pages/")] == 1
+    assert metrics.bytes[("none", "read", "pages/")] == 16
+
+
+def test_records_open_for_writing(client, metrics):
+    bucket = client.get_bucket("users")
+    with bucket.blob("javier").open("w") as f:
+        f.write("hashed")
+
+    assert bucket.get_blob("javier").download_as_string() == b"hashed"
+    assert metrics.operations[("none", "write", "/")] == 1
+    assert metrics.bytes[("none", "write", "/")] == 6
+    assert metrics.bytes[("none", "read", "/")] == 6
+
+
+def test_records_list_blobs_once_iterated(client, metrics):
+    bucket = client.get_bucket("content")
+    bucket.blob("pages/abra").upload_from_string("{}")
+    bucket.blob("pages/pikachu").upload_from_string("{}")
+
+    blobs = bucket.list_blobs(prefix="pages/")
+    assert metrics.operations[("none", "list_blobs", "pages/")] == 0
+    assert [blob.name for blob in blobs] == ["pages/abra", "pages/pikachu"]
+    assert metrics.operations[("none", "list_blobs", "pages/")] == 1
+
+
+def test_missing_blob_is_none(client, metrics):
+    assert client.get_bucket("content").get_blob("pages/missingno") is None
+    assert metrics.operations[("none", "get_blob", "pages/")] == 1
+
+
+def test_groups_by_endpoint_and_sets_debug_header(client, metrics):
+    app = Flask(__name__)
+    app.config["STORAGE_DEBUG_HEADER"] = True
+    metrics.init_app(app)
+    bucket = client.get_bucket("content")
+    bucket.blob("pages/abra").upload_from_string("{}")
+
+    @app.route("/wiki")
+    def wiki():
+        bucket.get_blob("pages/abra").download_as_string()
+        bucket.get_blob("pages/abra").download_as_string()
+        return "ok"
+
+    response = app.test_client().get("/wiki")
+
+    assert response.headers[DEBUG_HEADER] == "get_blob=2;read=2"
+    assert metrics.operations[("wiki", "get_blob", "pages/")] == 2
+    assert metrics.operation_durations[("wiki", "read")].count == 2
+    assert metrics.request_durations["wiki"].count == 1
+
+
+def test_no_debug_header_by_default(metrics):
+    app = Flask(__name__)
+    metrics.init_app(app)
+
+    @app.route("/")
+    def home():
+        return "ok"
+
+    assert DEBUG_HEADER not in app.test_client().get("/").headers
+
+
+def test_render_prometheus_text(client, metrics):
+    client.get_bucket("content").get_blob("pages/abra")
+
+    text = metrics.render()
+
+    assert '# TYPE wiki_storage_operations_total counter' in text
+    assert 'wiki_storage_operations_total{route="none",op="get_blob",prefix="pages/"} 1' in text
+    assert '# TYPE wiki_storage_operation_duration_seconds histogram' in text
+    # the fake clock makes every operation take 8ms
+    assert 'wiki_storage_operation_duration_seconds_bucket{route="none",op="get_blob",le="0.005"} 0' in text
+    assert 'wiki_storage_operation_duration_seconds_bucket{route="none",op="get_blob",le="0.01"} 1' in text
+    assert 'wiki_storage_operation_duration_seconds_bucket{route="none",op="get_blob",le="+Inf"} 1' in text
+    assert 'wiki_storage_operation_duration_seconds_count{route="none",op="get_blob"} 1' in text
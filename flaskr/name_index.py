@@ -0,0 +1,91 @@
+"""This module contains the n-gram index over pokemon names used for searching wiki pages.
+
+Every lowercased name is split into all of its 1, 2 and 3 character grams. A substring
+search looks up the posting sets of the query's trigrams, intersects them starting with
+the smallest one and only then checks the few remaining candidates, so the cost depends
+on the number of matches instead of the number of pages. Names are also kept sorted to
+answer prefix (autocomplete) queries with a binary search.
+
+Typical Usage:
+index = NameIndex()
+index.add('pages/charmander', 'charmander')
+pages = index.search('arm')
+suggestions = index.prefix('char', limit=5)
+"""
+
+import bisect
+
+# Longest gram stored in the index, queries longer than this are split into grams of this size
+GRAM_SIZE = 3
+
+
+def grams(text, size):
+    """ Returns the set of all substrings of text with the given size."""
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class NameIndex:
+
+    def __init__(self):
+        """Creates an empty index, names are added with add()."""
+        self.names = {}
+        # {"cha": {"pages/charmander", "pages/chansey"}, ...}
+        self.postings = {}
+        # sorted list of (name, key) pairs for prefix queries
+        self.sorted_names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, key, name):
+        """ Indexes a name, adding to the index never requires rebuilding it.
+        Args:
+            key: Identifier returned by queries, e.g. the page blob name.
+            name: Lowercased name to index.
+        """
+        if key in self.names:
+            return
+        self.names[key] = name
+        for size in range(1, GRAM_SIZE + 1):
+            for gram in grams(name, size):
+                self.postings.setdefault(gram, set()).add(key)
+        bisect.insort(self.sorted_names, (name, key))
+
+    def search(self, text):
+        """ Finds every key whose name contains text.
+        Args:
+            text: Substring to look for, matched as is against the lowercased names.
+        Returns:
+            Set of keys whose name contains text.
+        """
+        if not text:
+            return set(self.names)
+        if len(text) <= GRAM_SIZE:
+            return set(self.postings.get(text, ()))
+
+        sets = []
+        for gram in grams(text, GRAM_SIZE):
+            if gram not in self.postings:
+                return set()
+            sets.append(self.postings[gram])
+
+        sets.sort(key=len)
+        candidates = sets[0].intersection(*sets[1:])
+        # having all the trigrams doesn't mean they are next to each other
+        return {key for key in candidates if text in self.names[key]}
+
+    def prefix(self, text, limit=None):
+        """ Finds the keys whose name starts with text, in alphabetical order.
+        Args:
+            text: Beginning of the name, e.g. what the user typed so far.
+            limit: Maximum number of keys to return, None for all of them.
+        Returns:
+            List of keys whose name starts with text.
+        """
+        keys = []
+        start = bisect.bisect_left(self.sorted_names, (text,))
+        for name, key in self.sorted_names[start:]:
+            if not name.startswith(text) or (limit is not None and len(keys) >= limit):
+                break
+            keys.append(key)
+        return keys
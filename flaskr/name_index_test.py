@@ -0,0 +1,48 @@
+from flaskr.name_index import NameIndex
+import pytest
+
+
+@pytest.fixture
+def index():
+    index = NameIndex()
+    for name in ["charmander", "charizard", "chikorita", "mudkip", "blaziken"]:
+        index.add(f"pages/{name}", name)
+    return index
+
+
+def test_search_short_text(index):
+    assert index.search("ch") == {"pages/charmander", "pages/charizard", "pages/chikorita"}
+    assert index.search("z") == {"pages/charizard", "pages/blaziken"}
+
+
+def test_search_long_text(index):
+    assert index.search("arma") == {"pages/charmander"}
+    assert index.search("charmander") == {"pages/charmander"}
+
+
+def test_search_trigrams_not_adjacent():
+    index = NameIndex()
+    index.add("pages/abcxbcd", "abcxbcd")
+    assert index.search("abcd") == set()
+
+
+def test_search_no_match(index):
+    assert index.search("pika") == set()
+    assert index.search("Char") == set()
+
+
+def test_search_empty_text(index):
+    assert len(index.search("")) == 5
+
+
+def test_prefix(index):
+    assert index.prefix("char") == ["pages/charizard", "pages/charmander"]
+    assert index.prefix("c", limit=2) == ["pages/charizard", "pages/charmander"]
+    assert index.prefix("x") == []
+
+
+def test_add_after_search(index):
+    assert index.search("chi") == {"pages/chikorita"}
+    index.add("pages/chimchar", "chimchar")
+    assert index.search("chi") == {"pages/chikorita", "pages/chimchar"}
+    assert index.search("char") == {"pages/charmander", "pages/charizard", "pages/chimchar"}
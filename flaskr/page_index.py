@@ -0,0 +1,195 @@
+"""This module contains the in-memory index of wiki page metadata used by the backend.
+
+The index keeps one posting set per type, region and nature value, plus a list of
+pages ordered by level, so filter queries can be answered by intersecting sets
+instead of downloading every page blob from the cloud.
+
+Typical Usage:
+index = PageIndex()
+index.add('pages/charmander', {"name": "Charmander", "type": "Fire", ...})
+pages = index.query(None, 'Fire', None, None, 'LowestToHighest')
+"""
+
+import bisect
+from .name_index import NameIndex
+
+# Page attributes that get their own posting sets
+FILTER_FIELDS = ("type", "region", "nature")
+# Name of every filter field in the categories dictionary
+CATEGORY_NAMES = {"type": "types", "region": "regions", "nature": "natures"}
+
+
+class PageIndex:
+
+    def __init__(self):
+        """Creates an empty index, pages are added with add()."""
+        # page names in the same order the bucket listed them
+        self.page_names = []
+        self.positions = {}
+        # n-gram index over the lowercased pokemon name of every page
+        self.names = NameIndex()
+        # page name -> pokemon name as the uploader wrote it, shown in suggestions
+        self.titles = {}
+        # {"type": {"Fire": {"pages/charmander", ...}}, "region": {...}, ...}
+        self.postings = {field: {} for field in FILTER_FIELDS}
+        # sorted list of [level, page_name] pairs
+        self.levels = []
+
+    def __len__(self):
+        return len(self.page_names)
+
+    def __contains__(self, page_name):
+        return page_name in self.positions
+
+    def add(self, page_name, pokemon_data):
+        """ Adds a page listed by the bucket at the end of the index.
+        Args:
+            page_name: Name of the page blob, e.g. 'pages/charmander'.
+            pokemon_data: Dictionary with the page data stored in the blob.
+        """
+        if page_name in self.positions:
+            return
+        self.positions[page_name] = len(self.page_names)
+        self.page_names.append(page_name)
+        self.add_attributes(page_name, pokemon_data)
+
+    def insert(self, page_name, pokemon_data):
+        """ Adds a newly uploaded page where the bucket would list it.
+        Args:
+            page_name: Name of the page blob, e.g. 'pages/charmander'.
+            pokemon_data: Dictionary with the page data stored in the blob.
+        """
+        if page_name in self.positions:
+            return
+
+        # the bucket lists blobs in lexicographic order
+        position = bisect.bisect(self.page_names, page_name)
+        self.page_names.insert(position, page_name)
+        for index in range(position, len(self.page_names)):
+            self.positions[self.page_names[index]] = index
+        self.add_attributes(page_name, pokemon_data)
+
+    def add_attributes(self, page_name, pokemon_data):
+        """Adds the page to the name map, posting sets and level ordered view."""
+        self.names.add(page_name, pokemon_data["name"].lower())
+        self.titles[page_name] = pokemon_data["name"]
+        for field in FILTER_FIELDS:
+            self.postings[field].setdefault(pokemon_data.get(field), set()).add(page_name)
+
+        try:
+            level = int(pokemon_data["level"])
+        except (KeyError, TypeError, ValueError):
+            # pages without a numeric level can't be sorted by level
+            return
+        bisect.insort(self.levels, [level, page_name])
+
+    def query(self, name, type, region, nature, sorting):
+        """ Retrieves all pages that match the filter options without reading any blobs.
+        Args:
+            name: Part of the name of the pokemon we are looking for.
+            type: The type of the pokemon we are looking for.
+            region: The region of the pokemon we are looking for.
+            nature: The nature of the pokemon we are looking for.
+            sorting: The sorting metric that the user selected.
+        Returns:
+            page_names: The names of all pages that match the filter criteria.
+        """
+        candidates = self.filter(type=type, region=region, nature=nature)
+
+        if name is not None:
+            matches = self.names.search(name.lower())
+            candidates = matches if candidates is None else candidates & matches
+
+        if sorting == "LowestToHighest":
+            return self.sort_by_level(candidates, reverse=False)
+        if sorting == "HighestToLowest":
+            return self.sort_by_level(candidates, reverse=True)
+        if sorting:
+            # unknown sorting metric keeps the listing order of the pages that have a level
+            return self.sort_by_level(candidates, reverse=False, keep_order=True)
+
+        if candidates is None:
+            return list(self.page_names)
+        return sorted(candidates, key=self.positions.__getitem__)
+
+    def search(self, name):
+        """ Retrieves the pages whose lowercased pokemon name contains name.
+        Args:
+            name: Part of the name of the pokemon we are looking for.
+        Returns:
+            page_names: The names of the matching pages in listing order.
+        """
+        return sorted(self.names.search(name), key=self.positions.__getitem__)
+
+    def page(self, after, limit):
+        """ Retrieves one page of the listing, continuing after a cursor.
+        Args:
+            after: Last page name of the previous page, None for the first page.
+            limit: Maximum number of pages to return.
+        Returns:
+            Tuple with the page names in listing order and the cursor of the next page,
+            None when there are no more pages.
+        """
+        if after is None:
+            start = 0
+        elif after in self.positions:
+            start = self.positions[after] + 1
+        else:
+            # the listing is in lexicographic order, so a cursor that isn't indexed can be bisected
+            start = bisect.bisect_right(self.page_names, after)
+        page_names = self.page_names[start:start + limit]
+        next_cursor = page_names[-1] if start + limit < len(self.page_names) else None
+        return page_names, next_cursor
+
+    def autocomplete(self, prefix, limit):
+        """ Retrieves the pages whose pokemon name starts with prefix, ignoring case.
+        Args:
+            prefix: What the user typed so far in the search box.
+            limit: Maximum number of pages to return.
+        Returns:
+            List of (page name, pokemon name) tuples in alphabetical order.
+        """
+        return [(page_name, self.titles[page_name]) for page_name in self.names.prefix(prefix.lower(), limit)]
+
+    def categories(self):
+        """ Lists the values the pages use for every filter field.
+        Returns:
+            Dictionary with sorted "types", "regions" and "natures" lists, like categories.json.
+        """
+        return {CATEGORY_NAMES[field]: sorted(value for value, pages in self.postings[field].items() if value and pages)
+                for field in FILTER_FIELDS}
+
+    def filter(self, **filters):
+        """ Intersects the posting sets of the given attribute values.
+        Args:
+            filters: Attribute name and value pairs, None values are ignored.
+        Returns:
+            Set of matching page names, or None when no filter was given.
+        """
+        sets = []
+        for field, value in filters.items():
+            if value is None:
+                continue
+            sets.append(self.postings[field].get(value, set()))
+
+        if not sets:
+            return None
+
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def sort_by_level(self, candidates, reverse, keep_order=False):
+        """ Returns the candidate pages ordered by level using the level ordered view.
+        Args:
+            candidates: Set of page names, or None for every page.
+            reverse: Whether the highest level should come first.
+            keep_order: Keep the listing order instead of the level order.
+        Returns:
+            List of page names.
+        """
+        if keep_order:
+            pages = [page for level, page in self.levels if candidates is None or page in candidates]
+            return sorted(pages, key=self.positions.__getitem__)
+
+        levels = reversed(self.levels) if reverse else self.levels
+        return [page for level, page in levels if candidates is None or page in candidates]
@@ -0,0 +1,69 @@
+from flaskr.page_index import PageIndex
+import pytest
+
+
+@pytest.fixture
+def index():
+    index = PageIndex()
+    index.add("pages/charmander", {"name": "Charmander", "type": "Fire", "region": "Kanto", "nature": "Brave", "level": "15"})
+    index.add("pages/chikorita", {"name": "Chikorita", "type": "Grass", "region": "Johto", "nature": "Quirky", "level": "8"})
+    index.add("pages/mudkip", {"name": "Mudkip", "type": "Water", "region": "Hoenn", "nature": "Naive", "level": "12"})
+    index.add("pages/blaziken", {"name": "Blaziken", "type": "Fire", "region": "Hoenn", "nature": "Bashful", "level": "55"})
+    return index
+
+
+def test_query_without_filters_keeps_listing_order(index):
+    assert index.query(None, None, None, None, None) == ["pages/charmander", "pages/chikorita", "pages/mudkip", "pages/blaziken"]
+
+
+def test_query_intersects_filters(index):
+    assert index.query(None, "Fire", "Hoenn", None, None) == ["pages/blaziken"]
+    assert index.query(None, "Fire", "Johto", None, None) == []
+
+
+def test_query_unknown_value(index):
+    assert index.query(None, "Ghost", None, None, None) == []
+
+
+def test_query_name_and_sorting(index):
+    assert index.query("I", None, None, None, "HighestToLowest") == ["pages/blaziken", "pages/mudkip", "pages/chikorita"]
+
+
+def test_query_equal_levels_sorted_by_name(index):
+    index.add("pages/abra", {"name": "Abra", "type": "Psychic", "region": "Kanto", "nature": "Calm", "level": "15"})
+    assert index.query(None, None, "Kanto", None, "LowestToHighest") == ["pages/abra", "pages/charmander"]
+    assert index.query(None, None, "Kanto", None, "HighestToLowest") == ["pages/charmander", "pages/abra"]
+
+
+def test_insert_keeps_bucket_order():
+    index = PageIndex()
+    index.add("pages/abra", {"name": "Abra", "type": "Psychic", "region": "Kanto", "nature": "Calm", "level": "10"})
+    index.add("pages/mew", {"name": "Mew", "type": "Psychic", "region": "Kanto", "nature": "Calm", "level": "30"})
+    index.insert("pages/kadabra", {"name": "Kadabra", "type": "Psychic", "region": "Kanto", "nature": "Calm", "level": "20"})
+    assert index.query(None, "Psychic", None, None, None) == ["pages/abra", "pages/kadabra", "pages/mew"]
+
+
+def test_page_follows_cursor(index):
+    assert index.page(None, 3) == (["pages/charmander", "pages/chikorita", "pages/mudkip"], "pages/mudkip")
+    assert index.page("pages/mudkip", 3) == (["pages/blaziken"], None)
+    assert index.page(None, 4) == (["pages/charmander", "pages/chikorita", "pages/mudkip", "pages/blaziken"], None)
+
+
+def test_page_cursor_not_in_index():
+    index = PageIndex()
+    for name in ["pages/abra", "pages/charmander", "pages/pikachu"]:
+        index.add(name, {"name": name[6:]})
+    assert index.page("pages/bulbasaur", 10) == (["pages/charmander", "pages/pikachu"], None)
+
+
+def test_categories(index):
+    assert index.categories() == {"types": ["Fire", "Grass", "Water"],
+                                  "regions": ["Hoenn", "Johto", "Kanto"],
+                                  "natures": ["Bashful", "Brave", "Naive", "Quirky"]}
+
+
+def test_autocomplete_returns_pokemon_names():
+    index = PageIndex()
+    index.add("pages/mr. mime", {"name": "Mr. Mime"})
+    index.add("pages/mew", {"name": "Mew"})
+    assert index.autocomplete("m", 5) == [("pages/mew", "Mew"), ("pages/mr. mime", "Mr. Mime")]
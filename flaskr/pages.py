@@ -1,13 +1,16 @@
-from flask import render_template, request, json, flash, abort, redirect, url_for
-from .backend import Backend
+from flask import render_template, request, json, flash, abort, redirect, url_for, jsonify, Response, session
+from .backend import Backend, pokemon_image_path, POKEBALL_PATH, PAGE_SIZE
+from .storage_drivers import make_client
+from .metrics import StorageMetrics, InstrumentedClient
+from .cache import ByteLRUCache
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, PasswordField, validators
 from .user import User
 import flask_login
 from flask_login import LoginManager
 import base64
+import hashlib
 import io
-from secrets import randbelow
 '''This module takes care of rendering pages and page functions.
 
    Contains all functions in charge of rendering all pages. Calls backend 
@@ -17,9 +20,42 @@ from secrets import randbelow
 '''
 MAX_ID = 386
 
+# Image blob prefixes that can be served by /images and how long browsers may cache them (seconds).
+# Uploaded images can be replaced by another upload with the same file name, so they are revalidated sooner.
+IMAGE_MAX_AGES = {
+    "authors/": 31536000,
+    "master_pokedex/images/": 31536000,
+    "images/": 86400,
+}
+# Prefix of the images uploaded by users, they are sandboxed in case the browser renders them as a document
+UPLOADED_IMAGES = "images/"
+# Raster image types served inline, anything else (e.g. SVG or HTML, which can run scripts) is a download
+INLINE_IMAGE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp"}
+
+# Budget of the rendered wiki page cache
+WIKI_CACHE_BYTES = 16 * 1024 * 1024
+
 login_manager = LoginManager(
 )  # Lets the app and Flask-Login work together for user loading, login, etc.
-backend = Backend()
+# Every storage call of the backend is recorded and served by /metrics
+metrics = StorageMetrics()
+# Created by create_app, see create_backend
+backend = None
+
+
+def create_backend(config):
+    '''Creates the backend described by the app config, its storage client is only created on first use.
+
+       Args:
+        config: App config, STORAGE_DRIVER is "gcs" or "local" and STORAGE_ROOT is the folder of the local driver.
+
+       Returns:
+        Backend whose storage calls are recorded by metrics.
+    '''
+    driver = config.get("STORAGE_DRIVER", "gcs")
+    root = config.get("STORAGE_ROOT")
+    return Backend(client_factory=lambda: InstrumentedClient(make_client(driver, root), metrics))
+
 
 @login_manager.user_loader
 def load_user(username):
@@ -52,25 +88,96 @@ def make_endpoints(app):
                                  render_kw={"placeholder": "Password"})
         submit = SubmitField('Signup')
 
+    metrics.init_app(app)
+
+    @app.before_request
+    def check_versions():
+        # caches changed by other instances are dropped, right away if this user wrote newer data
+        backend.versions.check(session.get("versions"))
+
+    def remember_version(domain):
+        '''Keeps the version of the user's last write in their session so every instance serves it.'''
+        session["versions"] = dict(session.get("versions", {}), **{domain: backend.versions.current(domain)})
+
+    @app.cli.command("compact-manifest")
+    def compact_manifest():
+        '''Rewrites the page manifest shards from the page blobs, run it periodically (e.g. from cron).'''
+        count = backend.compact_manifest()
+        print(f"manifest holds {count} pages")
+
+    @app.cli.command("build-sprite-archive")
+    def build_sprite_archive():
+        '''Packs the pokemon sprites into one archive blob, run it after adding or changing sprites.'''
+        count = backend.build_sprite_archive()
+        print(f"sprite archive holds {count} sprites")
+
     # Flask uses the "app.route" decorator to call methods when users
     # go to a specific route on the project's website.
     @app.route("/")
     def home():
         # TODO(Checkpoint Requirement 2 of 3): Change this to use render_template
         # to render main.html on the home page.
-        image = backend.get_image('authors/logo.jpg')
+        image = url_for('image', blob_name='authors/logo.jpg')
         return render_template('main.html', image=image)
 
     # TODO(Project 1): Implement additional routes according to the project requirements.
     @app.route("/about")
     def about():
         images = [
-            backend.get_image('authors/javier.png'),
-            backend.get_image('authors/edgar.png'),
-            backend.get_image('authors/mark.png')
+            url_for('image', blob_name='authors/javier.png'),
+            url_for('image', blob_name='authors/edgar.png'),
+            url_for('image', blob_name='authors/mark.png')
         ]
         return render_template('about.html', images=images)
 
+    @app.route("/images/<path:blob_name>")
+    def image(blob_name):
+        '''Serves the raw bytes of an image blob.
+
+           Responses carry a strong ETag taken from the blob generation so browsers can
+           revalidate with If-None-Match and get a 304, and support Range requests.
+           Only raster images are shown inline, other types are sent as attachments.
+
+           Args:
+            blob_name: Name of the image blob, e.g. authors/logo.jpg
+
+           Returns:
+                Response with the image bytes.
+        '''
+        max_age = next((age for prefix, age in IMAGE_MAX_AGES.items() if blob_name.startswith(prefix)), None)
+        if max_age is None:
+            abort(404)
+
+        image = backend.get_image_file(blob_name)
+        if image is None:
+            abort(404)
+
+        # sprites from the sprite archive are memoryviews of the mapped file, they are sent without a copy
+        body = [image.data] if isinstance(image.data, memoryview) else image.data
+        if image.content_type in INLINE_IMAGE_TYPES:
+            response = Response(body, mimetype=image.content_type)
+        else:
+            response = Response(body, mimetype="application/octet-stream")
+            response.headers["Content-Disposition"] = "attachment"
+        # the type is never guessed from the bytes, and uploads can't run scripts on this origin
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        if blob_name.startswith(UPLOADED_IMAGES):
+            response.headers["Content-Security-Policy"] = "sandbox"
+        response.set_etag(str(image.generation))
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(image.data))
+
+    @app.route("/_ah/warmup")
+    def warmup():
+        '''App Engine sends this request to new instances before they take traffic.'''
+        return jsonify(backend.preload())
+
+    @app.route("/metrics")
+    def storage_metrics():
+        '''Storage call counts and latency histograms in the Prometheus text format.'''
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
     @app.route("/pages", methods=['GET', 'POST'])
     def pages():
         categories = backend.get_categories()
@@ -83,20 +190,54 @@ def make_endpoints(app):
                 sorting = request.form.get("sorting")
                 pages = backend.get_pages_using_filter_and_search(name, type, region, nature, sorting)
                 return render_template('pages.html', pages=pages, categories=categories)   
-            else:
-                pages = backend.get_all_page_names()
-                return render_template('pages.html', pages=pages, categories=categories)            
-        else:
-            pages = backend.get_all_page_names()
-            return render_template('pages.html', pages=pages, categories=categories)
+        # the listing is shown one page at a time, "after" is the last page name of the previous one
+        page_size = app.config.get("PAGES_PER_PAGE", PAGE_SIZE)
+        pages, next_page = backend.get_page_names(request.args.get("after"), page_size)
+        return render_template('pages.html', pages=pages, categories=categories, next_page=next_page)
+
+    @app.route("/search/autocomplete")
+    def autocomplete():
+        '''Returns the pages whose name starts with the "q" query parameter, called on every keystroke in the search box.'''
+        prefix = request.args.get("q", "").strip()
+        if not prefix:
+            return jsonify([])
+        pages = backend.autocomplete_page_names(prefix)
+        return jsonify([{"page": page, "name": name} for page, name in pages])
+
+    # rendered wiki pages, keyed on the page generation so they never go stale
+    wiki_cache = ByteLRUCache(app.config.get("WIKI_CACHE_BYTES", WIKI_CACHE_BYTES))
 
     @app.route("/pages/<pokemon>")
     def wiki(pokemon="abra"):
-        poke_string = backend.get_wiki_page(pokemon)
-        # pokemon blob is returned as string, turn into json
-        pokemon_data = json.loads(poke_string)
-        image = backend.get_image(f'images/{pokemon_data["image-name"]}')
-        return render_template("wiki.html", image=image, pokemon=pokemon_data)
+        '''Renders a user generated page.
+
+           The ETag comes from the page blob generation, so browsers revalidate with
+           If-None-Match and get a 304, and the rendered HTML is cached per generation.
+           The navigation bar shows the user, so every user gets their own ETag and copy.
+        '''
+        generation = backend.get_wiki_page_generation(pokemon)
+        if generation is None:
+            abort(404)
+
+        username = flask_login.current_user.get_id() or ""
+        user_key = hashlib.blake2b(username.encode(), digest_size=8).hexdigest()
+        key = f"{pokemon}:{generation}:{user_key}"
+
+        html = wiki_cache.get(key)
+        if html is None:
+            poke_string = backend.get_wiki_page(pokemon)
+            # pokemon blob is returned as string, turn into json
+            pokemon_data = json.loads(poke_string)
+            image = url_for('image', blob_name=f'images/{pokemon_data["image-name"]}')
+            html = render_template("wiki.html", image=image, pokemon=pokemon_data)
+            wiki_cache.put(key, html, size=len(html))
+
+        response = Response(html, mimetype="text/html")
+        response.set_etag(f"{generation}-{user_key}")
+        response.vary.add("Cookie")
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
 
     @app.route('/login', methods=['GET', 'POST'])
     def login():
@@ -194,33 +335,32 @@ def make_endpoints(app):
         file_to_upload = request.files['file']
 
         # call backend upload
-        backend.upload(file_to_upload, pokemon_data)
+        if backend.upload(file_to_upload, pokemon_data):
+            remember_version("pages")
 
         # render pages list
         return redirect(url_for('pages'))
 
     @app.route("/game")
     @flask_login.login_required
-    def play_game(pokemon_id=1):
-        # make sure pokemon_id has not been guessed before
-        seen = backend.get_seen_pokemon(flask_login.current_user.username)
-        pokemon_id = randbelow(MAX_ID)
-        while str(pokemon_id) in seen:
-            pokemon_id = randbelow(MAX_ID)
-
-        # check that image is not a None type
-        pokemon_img = None
-        while pokemon_img == None:
-            pokemon_img = backend.get_pokemon_image(pokemon_id)
-
-        # Get the pokemon and user data
-        pokemon_data = backend.get_pokemon_data(pokemon_id)
-        user = backend.get_game_user(flask_login.current_user.username)
-        pokeball_img = backend.get_pokeball()
+    def play_game():
+        username = flask_login.current_user.username
+        # reloading the page shows the same pokemon until the user guesses it
+        game_round = backend.get_round(username, session.get("round_id"))
+        if game_round is None or game_round.finished:
+            round_id, game_round = backend.start_round(username)
+            session["round_id"] = round_id
+            session["pokemon_id"] = game_round.pokemon_id
+
+        pokemon_img = url_for('image', blob_name=pokemon_image_path(game_round.pokemon_id))
+
+        # Get the pokemon data
+        pokemon_data = backend.get_pokemon_data(game_round.pokemon_id)
+        pokeball_img = url_for('image', blob_name=POKEBALL_PATH)
         answer = pokemon_data['name']['english']
 
         # return template
-        return render_template("game.html",image=pokemon_img,data=pokemon_data,user=user,pokeball=pokeball_img,answer=answer,seen=seen)
+        return render_template("game.html",image=pokemon_img,user=game_round.user,pokeball=pokeball_img,answer=answer)
 
 
     @app.route("/game",methods=["POST"])
@@ -228,58 +368,33 @@ def make_endpoints(app):
     def update_user_and_refresh():
         username = flask_login.current_user.username
 
-        # Get pokemon data
-        data = request.form["data"]
-        data = data.replace("\'","\"")
-        data_json = json.loads(data)
-
-        # Get user guess
-        user_guess = request.form["user_guess"]
-        user_guess = user_guess.upper()
-
-        # set correct answer and compare to user guess
-        correct_answer = data_json["name"]["english"]
-        correct_answer = correct_answer.upper()
-
-        # modify and clean up points
-        points = int(request.form["points"])
-        if user_guess == correct_answer:
-            points = points + 100
-        elif points - 50 < 0:
-            points = 0
-        else:
-            points = int(points) - 50
-        
-        # update the seen-pokemon list
-        seen = backend.get_seen_pokemon(username)
-        seen_id = data_json['id']
-        seen_id = str(seen_id)
-        seen[seen_id] = True
-        backend.update_seen_pokemon(username,seen)
-
-        # update the user with new points and new rank
-        backend.update_points(username, points) 
+        # the round is kept on the server, the user only sends their guess
+        pokemon_id = session.get("pokemon_id")
+        round_id = session.get("round_id")
+        if pokemon_id is None:
+            return redirect(url_for("play_game"))
+
+        user_guess = request.form.get("user_guess", "")
+        user = backend.finish_round(username, round_id, pokemon_id, user_guess)
+        # the round stays in the session if saving the guess failed, so it can be sent again
+        session.pop("pokemon_id", None)
+        session.pop("round_id", None)
+        if user is not None:
+            remember_version("leaderboard")
         return redirect(url_for("play_game"))
 
     @app.route("/leaderboard", methods=["GET"])
     @flask_login.login_required
     def leaderboard():
         '''Displays leaderboard with top 15 users and highlights the current user viewing the leaderboard.'''
-        # Get leaderboard list
-        leaderboard = backend.get_leaderboard()
-
-        length = len(leaderboard) # Length of the list
-        
-        # Current user game json data
-        curr_user = backend.get_game_user(flask_login.current_user.username)
-        
-        # If the length is greater than 15 then cut the list to have the top 15 users
-        if length > 15:
-            leaderboard = leaderboard[:15]
+        # Get the top 15 users
+        # and the current user game json data
+        leaderboard, curr_user = backend.gather((backend.get_leaderboard, 15),
+                                                (backend.get_game_user, flask_login.current_user.username))
 
         # Boolean to check if user is in top 15
         user_in_top15 = False if (not curr_user["rank"] or curr_user["rank"] > 15) else True
 
-        trophy = backend.get_image(f'authors/trophy.png') # Image decoration
+        trophy = url_for('image', blob_name='authors/trophy.png') # Image decoration
 
         return render_template("leaderboard.html", leaderboard=leaderboard, trophy=trophy, curr_user=curr_user, user_in_top15=user_in_top15)
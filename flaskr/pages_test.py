@@ -1,4 +1,5 @@
 from flaskr import create_app
+from flaskr.backend import ImageFile
 from flask import render_template, json, request
 from unittest.mock import MagicMock, patch
 import pytest
@@ -9,9 +10,12 @@ import base64
 
 
 @pytest.fixture
-def app():
+def app(tmp_path):
+    # storage calls that aren't mocked go to an empty folder instead of the cloud
     app = create_app({
         'TESTING': True,
+        'STORAGE_DRIVER': 'local',
+        'STORAGE_ROOT': str(tmp_path),
     })
     return app
 
@@ -52,37 +56,84 @@ def blob():
 def mock_rand():
     return MagicMock()
 
-@patch("flaskr.backend.Backend.get_image",
-       return_value=b"This should have been a real image!")
-def test_home_page(mock_get_wiki_page, client):
+def test_home_page(client):
 
     response = client.get("/")
     assert response.status_code == 200
     assert b"Welcome to the Pokemon Wiki" in response.data
-    assert b"This should have been a real image!" in response.data
+    assert b'src="/images/authors/logo.jpg"' in response.data
 
 
 # Tests about page, should return author's names
-@patch("flaskr.backend.Backend.get_image",
-       return_value=b"This is an image too!")
-def test_about_page(mock_get_image, client):
+def test_about_page(client):
     resp = client.get("/about")
     assert resp.status_code == 200
     assert b"Edgar Ochoa Sotelo" in resp.data
     assert b"Mark Toro" in resp.data
     assert b"Javier Garcia" in resp.data
-    assert b"This is an image too!" in resp.data
+    assert b'src="/images/authors/mark.png"' in resp.data
+
+
+@patch("flaskr.backend.Backend.get_image_file",
+       return_value=ImageFile(b"0123456789", "image/png", 42))
+def test_image(mock_get_image_file, client):
+    resp = client.get("/images/authors/logo.jpg")
+    assert resp.status_code == 200
+    assert resp.data == b"0123456789"
+    assert resp.mimetype == "image/png"
+    assert resp.headers["ETag"] == '"42"'
+    assert resp.cache_control.max_age == 31536000
+    mock_get_image_file.assert_called_once_with("authors/logo.jpg")
+
+
+@patch("flaskr.backend.Backend.get_image_file",
+       return_value=ImageFile(b"0123456789", "image/png", 42))
+def test_image_not_modified(mock_get_image_file, client):
+    resp = client.get("/images/authors/logo.jpg", headers={"If-None-Match": '"42"'})
+    assert resp.status_code == 304
+    assert resp.data == b""
+
+
+@patch("flaskr.backend.Backend.get_image_file",
+       return_value=ImageFile(b"0123456789", "image/png", 42))
+def test_image_range(mock_get_image_file, client):
+    resp = client.get("/images/images/abra.png", headers={"Range": "bytes=2-5"})
+    assert resp.status_code == 206
+    assert resp.data == b"2345"
+    assert resp.headers["Content-Range"] == "bytes 2-5/10"
+
+
+@patch("flaskr.backend.Backend.get_image_file", return_value=None)
+def test_image_not_found(mock_get_image_file, client):
+    assert client.get("/images/images/missing.png").status_code == 404
+
+
+@patch("flaskr.backend.Backend.get_image_file")
+def test_image_outside_image_folders(mock_get_image_file, client):
+    assert client.get("/images/user_game_ranking/ranks_list.json").status_code == 404
+    mock_get_image_file.assert_not_called()
 
 
 # should return list of pages
 @patch("flaskr.backend.Backend.get_categories",return_value=b"categories")
 @patch("flaskr.backend.Backend.get_pages_using_sorting", return_value=b"sorted pages")
 @patch("flaskr.backend.Backend.get_pages_using_filter_and_search", return_value=b"sorted pages with filter and search")
-@patch("flaskr.backend.Backend.get_all_page_names", return_value=["page1","page2","page3"])
+@patch("flaskr.backend.Backend.get_page_names", return_value=(["page1","page2","page3"], None))
 def test_pages(mock_get_all_pages, mock_get_pages_using_filter_and_search, mock_get_pages_using_sorting, mock_get_categories,client):
     response = client.get("/pages")
     assert response.status_code == 200
     assert b"page1" in response.data
+    assert b"Next" not in response.data
+
+
+@patch("flaskr.backend.Backend.get_categories", return_value={})
+@patch("flaskr.backend.Backend.get_page_names", return_value=(["pages/charmander", "pages/pikachu"], "pages/pikachu"))
+def test_pages_next_page(mock_get_page_names, mock_get_categories, app, client):
+    app.config["PAGES_PER_PAGE"] = 2
+    response = client.get("/pages?after=pages/abra")
+    assert response.status_code == 200
+    assert b"/pages?after=pages/pikachu" in response.data
+    mock_get_page_names.assert_called_once_with("pages/abra", 2)
 
 # should return back to upload page
 def test_upload_get(client):
@@ -103,12 +154,36 @@ def test_upload_get(client):
            'image-name': '',
            'image-type': ''
        })
-def test_get_wiki_page(mockjson,mock_get_wiki_page,mock_get_image,client):
+@patch("flaskr.backend.Backend.get_wiki_page_generation", return_value=5)
+def test_get_wiki_page(mock_get_generation,mockjson,mock_get_wiki_page,mock_get_image,client):
     response = client.get("/pages/abra")
     assert b"abra" in response.data
     mockjson.assert_called_once_with(b"{'name':'diff'}")
 
 
+@patch("flaskr.backend.Backend.get_wiki_page", return_value='{"name": "abra", "image-name": "abra.png"}')
+@patch("flaskr.backend.Backend.get_wiki_page_generation", return_value=5)
+def test_wiki_page_is_cached_and_revalidated(mock_get_generation, mock_get_wiki_page, client):
+    response = client.get("/pages/abra")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert etag.startswith('"5-')
+    assert "Cookie" in response.headers["Vary"]
+
+    # the rendered page is served from the cache
+    assert client.get("/pages/abra").data == response.data
+    mock_get_wiki_page.assert_called_once()
+
+    response = client.get("/pages/abra", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+@patch("flaskr.backend.Backend.get_wiki_page_generation", return_value=None)
+def test_wiki_page_not_found(mock_get_generation, client):
+    assert client.get("/pages/missingno").status_code == 404
+
+
 # Tests sign up page
 def test_sign_up(client):
     data = {'username': 'username', 'password': 'password'}
@@ -183,3 +258,101 @@ def test_game_post(app, client):
         assert request.args.get("rank") == "5"
         assert request.args.get("user") == "user1"
 
+
+
+@patch("flaskr.backend.Backend.autocomplete_page_names",
+       return_value=[("pages/charmander", "Charmander"), ("pages/charizard", "Charizard")])
+def test_autocomplete(mock_autocomplete, client):
+    response = client.get("/search/autocomplete?q=Char")
+    assert response.json == [{"page": "pages/charmander", "name": "Charmander"}, {"page": "pages/charizard", "name": "Charizard"}]
+    mock_autocomplete.assert_called_once_with("Char")
+
+
+def test_metrics(client):
+    resp = client.get("/metrics")
+    text = resp.get_data(as_text=True)
+
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    assert "# TYPE wiki_storage_operations_total counter" in text
+    assert "# TYPE wiki_request_duration_seconds histogram" in text
+
+
+@patch("flaskr.backend.Backend.preload", return_value={"pokedex": 0.5})
+def test_warmup(mock_preload, client):
+    resp = client.get("/_ah/warmup")
+    assert resp.status_code == 200
+    assert resp.get_json() == {"pokedex": 0.5}
+
+
+@patch("flaskr.backend.Backend.get_user", return_value=None)
+@patch("flaskr.backend.Backend.finish_round")
+@patch("flaskr.backend.Backend.get_pokemon_data", return_value={"id": 25, "name": {"english": "Pikachu"}})
+@patch("flaskr.backend.Backend.start_round")
+def test_game_round_is_kept_in_session(mock_start_round, mock_get_data, mock_finish_round, mock_get_user, client):
+    game_round = MagicMock(pokemon_id=25, finished=False, user={"name": "ash", "points": 100, "rank": 1})
+    mock_start_round.return_value = ("round1", game_round)
+    mock_get_user.return_value = MagicMock(username="ash", get_id=lambda: "ash", is_authenticated=True, is_active=True)
+    with client.session_transaction() as session:
+        session["_user_id"] = "ash"
+        session["_fresh"] = True
+
+    response = client.get("/game")
+    assert response.status_code == 200
+    assert b'data-answer="Pikachu"' in response.data
+    assert b'name="points"' not in response.data
+    with client.session_transaction() as session:
+        assert session["round_id"] == "round1"
+        assert session["pokemon_id"] == 25
+
+    # only the guess is sent, the points in the form are ignored
+    response = client.post("/game", data={"user_guess": "Pikachu", "points": "99999"})
+    assert response.status_code == 302
+    mock_finish_round.assert_called_once_with("ash", "round1", 25, "Pikachu")
+    with client.session_transaction() as session:
+        assert "round_id" not in session
+
+
+@patch("flaskr.backend.Backend.get_image_file")
+def test_image_from_sprite_archive(mock_get_image_file, client):
+    archive = b"header" + b"\x89PNG pikachu" + b"more sprites"
+    mock_get_image_file.return_value = ImageFile(memoryview(archive)[6:18], "image/png", 3)
+    response = client.get("/images/master_pokedex/images/025.png")
+    assert response.status_code == 200
+    assert response.data == b"\x89PNG pikachu"
+    assert response.headers["Content-Length"] == "12"
+
+    response = client.get("/images/master_pokedex/images/025.png", headers={"Range": "bytes=0-3"})
+    assert response.status_code == 206
+    assert response.data == b"\x89PNG"
+
+
+@pytest.mark.parametrize("filename, content_type", [("evil.html", "text/html"), ("evil.svg", "image/svg+xml")])
+@patch("flaskr.backend.Backend.get_user")
+def test_uploaded_scripts_are_not_served_inline(mock_get_user, filename, content_type, client):
+    import io
+    mock_get_user.return_value = MagicMock(username="ash", get_id=lambda: "ash", is_authenticated=True, is_active=True)
+    with client.session_transaction() as session:
+        session["_user_id"] = "ash"
+        session["_fresh"] = True
+
+    form = {"name": "Evil", "type": "", "region": "", "nature": "", "level": "", "desc": "",
+            "file": (io.BytesIO(b"<svg><script>alert(1)</script></svg>"), filename, content_type)}
+    assert client.post("/upload", data=form, content_type="multipart/form-data").status_code == 302
+
+    response = client.get(f"/images/images/{filename}")
+    assert response.status_code == 200
+    assert response.mimetype == "application/octet-stream"
+    assert response.headers["Content-Disposition"] == "attachment"
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+    assert response.headers["Content-Security-Policy"] == "sandbox"
+
+
+@patch("flaskr.backend.Backend.get_image_file",
+       return_value=ImageFile(b"0123456789", "image/png", 42))
+def test_uploaded_png_is_served_inline_and_sandboxed(mock_get_image_file, client):
+    response = client.get("/images/images/abra.png")
+    assert response.mimetype == "image/png"
+    assert "Content-Disposition" not in response.headers
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+    assert response.headers["Content-Security-Policy"] == "sandbox"
@@ -0,0 +1,78 @@
+"""This module contains the in-memory pokedex used by the game.
+
+The pokedex blob is downloaded and validated once, then kept as a list of slotted
+records indexed by pokemon id, so looking up a pokemon doesn't touch the cloud.
+The blob's generation is checked at most once every refresh interval and the
+pokedex is only downloaded again when it changed.
+
+Typical Usage:
+store = PokedexStore(lambda: bucket.get_blob('master_pokedex/pokedex.json'))
+pokemon = store.get(25)
+pokemon.name["english"]
+"""
+
+import json as jsonlib
+import time
+
+from .blob_store import BlobStore, REFRESH_INTERVAL
+
+
+class PokemonRecord:
+    '''A single pokedex entry.'''
+
+    __slots__ = ("id", "name", "type", "base")
+
+    def __init__(self, id, name, type=None, base=None):
+        self.id = id
+        self.name = name
+        self.type = type
+        self.base = base
+
+    def as_dict(self):
+        '''Returns the entry in the same shape as it is stored in pokedex.json.'''
+        data = {"id": self.id, "name": self.name}
+        if self.type is not None:
+            data["type"] = self.type
+        if self.base is not None:
+            data["base"] = self.base
+        return data
+
+
+def parse_pokedex(pokedex_json):
+    '''Validates the parsed pokedex.json and turns it into records.
+    Args:
+        pokedex_json: List of pokedex entries, entry i must have id i + 1.
+    Returns:
+        List of PokemonRecord objects, the record of pokemon id is at index id - 1.
+    Raises:
+        ValueError: The pokedex is not a list of entries with consecutive ids and english names.
+    '''
+    if not isinstance(pokedex_json, list):
+        raise ValueError("pokedex must be a list of pokemon entries")
+
+    records = []
+    for index, entry in enumerate(pokedex_json):
+        if not isinstance(entry, dict) or entry.get("id") != index + 1:
+            raise ValueError(f"pokedex entry {index} must have id {index + 1}")
+        name = entry.get("name")
+        if not isinstance(name, dict) or not isinstance(name.get("english"), str):
+            raise ValueError(f"pokedex entry {index + 1} has no english name")
+        records.append(PokemonRecord(entry["id"], name, entry.get("type"), entry.get("base")))
+    return records
+
+
+class PokedexStore(BlobStore):
+
+    def __init__(self, get_blob, json=jsonlib, refresh_interval=REFRESH_INTERVAL, clock=time.monotonic):
+        """
+        Args:
+            get_blob: Function that returns the pokedex blob with its generation.
+            json: Dependency injection for mocking the json module.
+            refresh_interval: Minimum number of seconds between generation checks.
+            clock: Dependency injection for mocking the time.
+        """
+        super().__init__(get_blob, lambda data: parse_pokedex(json.loads(data)), refresh_interval, clock)
+
+    def get(self, id):
+        '''Returns the record of the pokemon with the given id.'''
+        return self.load()[id - 1]
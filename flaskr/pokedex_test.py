@@ -0,0 +1,88 @@
+from flaskr.pokedex import PokedexStore, parse_pokedex
+import json
+import pytest
+from unittest.mock import MagicMock
+
+POKEDEX = [{"id": 1, "name": {"english": "Bulbasaur"}, "type": ["Grass", "Poison"]},
+           {"id": 2, "name": {"english": "Ivysaur"}, "type": ["Grass", "Poison"]},
+           {"id": 3, "name": {"english": "Venusaur"}, "type": ["Grass", "Poison"]}]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def blob():
+    blob = MagicMock()
+    blob.generation = 1
+    blob.download_as_string.return_value = json.dumps(POKEDEX)
+    return blob
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_get(blob, clock):
+    store = PokedexStore(lambda: blob, refresh_interval=60, clock=clock)
+    assert store.get(3).name["english"] == "Venusaur"
+    assert store.get(1).as_dict() == POKEDEX[0]
+
+
+def test_get_loads_once(blob, clock):
+    get_blob = MagicMock(return_value=blob)
+    store = PokedexStore(get_blob, refresh_interval=60, clock=clock)
+    for id in range(1, 4):
+        store.get(id)
+    get_blob.assert_called_once()
+    blob.download_as_string.assert_called_once()
+
+
+def test_reload_only_when_generation_changes(blob, clock):
+    get_blob = MagicMock(return_value=blob)
+    store = PokedexStore(get_blob, refresh_interval=60, clock=clock)
+    store.get(1)
+
+    clock.now = 61
+    store.get(1)
+    assert get_blob.call_count == 2
+    blob.download_as_string.assert_called_once()
+
+    clock.now = 122
+    blob.generation = 2
+    blob.download_as_string.return_value = json.dumps(POKEDEX[:2])
+    store.get(1)
+    assert blob.download_as_string.call_count == 2
+    assert len(store.load()) == 2
+
+
+def test_expire_checks_generation_before_interval(blob, clock):
+    get_blob = MagicMock(return_value=blob)
+    store = PokedexStore(get_blob, refresh_interval=60, clock=clock)
+    store.get(1)
+
+    blob.generation = 2
+    blob.download_as_string.return_value = json.dumps(POKEDEX[:2])
+    store.expire()
+    assert len(store.load()) == 2
+
+
+def test_parse_pokedex_rejects_bad_ids():
+    with pytest.raises(ValueError):
+        parse_pokedex([POKEDEX[1]])
+
+
+def test_parse_pokedex_rejects_missing_name():
+    with pytest.raises(ValueError):
+        parse_pokedex([{"id": 1, "name": {"japanese": "フシギダネ"}}])
+
+
+def test_parse_pokedex_rejects_non_list():
+    with pytest.raises(ValueError):
+        parse_pokedex({"1": POKEDEX[0]})
@@ -0,0 +1,118 @@
+"""This module prepares the next round of the game while the player guesses the current one.
+
+When a round starts, the pokemon the player will get next is already known (it is the
+next one in their shuffled deck), so its pokedex entry and image are read into memory
+in the background. Once the player guesses, the next round is built from the seen
+pokemon and points that were just saved and kept until the game page asks for it, so
+the redirect after a guess is served without waiting for storage.
+
+Each player has at most one prepared round and one warm-up in flight, and there is a
+cap on warm-ups across players so prefetching never takes over the thread pool.
+Prepared rounds are bounded in memory and dropped when the player goes idle. A prepared
+round is kept with the state it was built from, and is only handed out if that state is
+still current for its player, since they may have played on another instance and the
+prepared seen pokemon and points would overwrite what they did there.
+
+Typical Usage:
+prefetcher = RoundPrefetcher(backend.submit_background, backend.warm_pokemon, backend.is_prepared_round_current)
+prefetcher.schedule('ash', game_round)
+prefetcher.put('ash', next_round, state)
+game_round = prefetcher.take('ash')
+"""
+
+import logging
+import threading
+import time
+
+from .cache import ByteLRUCache
+from .game_round import ROUND_BYTES
+from .seen import SeenPokemon
+
+# Memory budget of the prepared rounds and how long a player can be idle before theirs is dropped
+PREFETCH_CACHE_BYTES = 1024 * 1024
+PREFETCH_IDLE_TTL = 600
+# Maximum number of warm-ups running at the same time across every player
+MAX_PENDING = 4
+
+logger = logging.getLogger(__name__)
+
+
+class RoundPrefetcher:
+
+    def __init__(self, submit, warm, is_current=None, max_bytes=PREFETCH_CACHE_BYTES,
+                 idle_ttl=PREFETCH_IDLE_TTL, max_pending=MAX_PENDING, clock=time.monotonic):
+        """
+        Args:
+            submit: Function that runs a function with its arguments in the background.
+            warm: Function that reads everything needed to show a pokemon id into memory.
+            is_current: Function called with the username, a prepared round and the state it was
+                built from, returns whether the round can still be played. None keeps every round.
+            max_bytes: Memory budget of the prepared rounds.
+            idle_ttl: Seconds a prepared round is kept if the player doesn't ask for it.
+            max_pending: Maximum number of warm-ups running at the same time.
+            clock: Dependency injection for mocking the time.
+        """
+        self.submit = submit
+        self.warm = warm
+        self.is_current = is_current
+        self.max_pending = max_pending
+        self.rounds = ByteLRUCache(max_bytes, {"": idle_ttl}, clock)
+        # players with a warm-up in flight
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def schedule(self, username, game_round):
+        """ Warms the pokemon the player gets after game_round, unless a warm-up is already running.
+        Args:
+            username: Username of the player.
+            game_round: GameRound the player is guessing.
+        Returns:
+            Id of the pokemon being warmed, None if nothing was scheduled.
+        """
+        seen = SeenPokemon(game_round.seen.bitmap, game_round.seen.seed, game_round.seen.cursor)
+        seen.add(game_round.pokemon_id)
+        if seen.is_complete():
+            # the deck is shuffled again when the seen pokemon are saved, the next pokemon isn't known yet
+            return None
+        pokemon_id = seen.next_id()
+
+        with self.lock:
+            if username in self.pending or len(self.pending) >= self.max_pending:
+                return None
+            self.pending.add(username)
+        try:
+            self.submit(self.run, username, pokemon_id)
+        except Exception:
+            with self.lock:
+                self.pending.discard(username)
+            raise
+        return pokemon_id
+
+    def run(self, username, pokemon_id):
+        try:
+            self.warm(pokemon_id)
+        except Exception as error:
+            # the game page reads the pokemon itself if warming it failed
+            logger.warning("prefetching pokemon %s failed: %s", pokemon_id, error)
+        finally:
+            with self.lock:
+                self.pending.discard(username)
+
+    def put(self, username, game_round, state=None):
+        '''Keeps the next round of the player, and the state it was built from, until the game page takes it.'''
+        self.rounds.put(username, (game_round, state), size=ROUND_BYTES)
+
+    def take(self, username):
+        '''Returns the prepared round of the player and forgets it, None if there is none or it is stale.'''
+        prepared = self.rounds.get(username)
+        if prepared is None:
+            return None
+        self.rounds.invalidate(username)
+        game_round, state = prepared
+        if self.is_current is not None and not self.is_current(username, game_round, state):
+            return None
+        return game_round
+
+    def clear(self):
+        '''Drops every prepared round, e.g. when players may have played on another instance.'''
+        self.rounds.clear()
@@ -0,0 +1,109 @@
+from flaskr.prefetch import RoundPrefetcher
+from flaskr.game_round import GameRound
+from flaskr.seen import SeenPokemon, MAX_ID
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def run_now(func, *args):
+    func(*args)
+
+
+def test_schedule_warms_the_next_pokemon():
+    warmed = []
+    prefetcher = RoundPrefetcher(run_now, warmed.append)
+    seen = SeenPokemon(seed=5)
+    game_round = GameRound(seen.next_id(), seen, {"points": 0})
+
+    pokemon_id = prefetcher.schedule("ash", game_round)
+    assert warmed == [pokemon_id]
+    assert pokemon_id != game_round.pokemon_id
+    # the round being guessed is left untouched
+    assert game_round.pokemon_id not in seen
+
+    seen.add(game_round.pokemon_id)
+    assert seen.next_id() == pokemon_id
+
+
+def test_one_warm_up_per_player_and_a_global_cap():
+    submitted = []
+    prefetcher = RoundPrefetcher(lambda func, *args: submitted.append(args), lambda id: None, max_pending=2)
+    game_round = GameRound(1, SeenPokemon(seed=5), {"points": 0})
+
+    assert prefetcher.schedule("ash", game_round) is not None
+    assert prefetcher.schedule("ash", game_round) is None
+    assert prefetcher.schedule("misty", game_round) is not None
+    assert prefetcher.schedule("brock", game_round) is None
+    assert len(submitted) == 2
+
+    prefetcher.run(*submitted[0])
+    assert prefetcher.schedule("brock", game_round) is not None
+
+
+def test_failed_warm_up_is_not_raised():
+    def warm(pokemon_id):
+        raise RuntimeError("storage is down")
+
+    prefetcher = RoundPrefetcher(run_now, warm)
+    game_round = GameRound(1, SeenPokemon(seed=5), {"points": 0})
+    prefetcher.schedule("ash", game_round)
+    assert prefetcher.pending == set()
+
+
+def test_nothing_is_warmed_before_a_new_deck():
+    warmed = []
+    prefetcher = RoundPrefetcher(run_now, warmed.append)
+    seen = SeenPokemon(bitmap=(1 << MAX_ID) - 1 - 1, seed=5)
+    assert prefetcher.schedule("ash", GameRound(1, seen, {"points": 0})) is None
+    assert warmed == []
+
+
+def test_prepared_round_is_taken_once_and_dropped_when_idle():
+    clock = FakeClock()
+    prefetcher = RoundPrefetcher(run_now, lambda id: None, idle_ttl=600, clock=clock)
+    game_round = GameRound(1, SeenPokemon(seed=5), {"points": 0})
+
+    prefetcher.put("ash", game_round)
+    assert prefetcher.take("ash") is game_round
+    assert prefetcher.take("ash") is None
+
+    prefetcher.put("ash", game_round)
+    clock.now = 600
+    assert prefetcher.take("ash") is None
+
+
+def test_stale_prepared_round_is_not_taken():
+    checked = []
+
+    def is_current(username, game_round, state):
+        checked.append((username, state))
+        return state == "current"
+
+    prefetcher = RoundPrefetcher(run_now, lambda id: None, is_current)
+    prefetcher.put("ash", GameRound(1, SeenPokemon(seed=5), {"points": 0}), "stale")
+    prefetcher.put("misty", GameRound(2, SeenPokemon(seed=5), {"points": 0}), "current")
+    assert prefetcher.take("ash") is None
+    assert prefetcher.take("misty").pokemon_id == 2
+    assert checked == [("ash", "stale"), ("misty", "current")]
+
+
+def test_prepared_rounds_are_bounded():
+    prefetcher = RoundPrefetcher(run_now, lambda id: None, max_bytes=1024)
+    for username in ["ash", "misty", "brock"]:
+        prefetcher.put(username, GameRound(1, SeenPokemon(seed=5), {"points": 0}))
+    assert prefetcher.take("ash") is None
+    assert prefetcher.take("brock") is not None
+
+
+def test_clear_drops_every_prepared_round():
+    prefetcher = RoundPrefetcher(run_now, lambda id: None)
+    prefetcher.put("ash", GameRound(1, SeenPokemon(seed=5), {"points": 0}))
+    prefetcher.clear()
+    assert prefetcher.take("ash") is None
@@ -0,0 +1,107 @@
+"""This module keeps track of the pokemon a player has already seen in the game.
+
+The seen pokemon are stored as a 386-bit bitmap. The order in which pokemon are shown
+comes from a shuffled deck of every pokemon id, stored as the seed of the shuffle plus
+a cursor, so picking the next unseen pokemon takes constant time no matter how many
+the player has already seen.
+
+Stored format:
+{"bitmap": "<base64 of the 49 byte bitmap>", "seed": 1234, "cursor": 17}
+
+Typical Usage:
+seen = SeenPokemon.from_json(json.loads(blob_data))
+pokemon_id = seen.next_id()
+seen.add(pokemon_id)
+blob_data = json.dumps(seen.to_json())
+"""
+
+import base64
+import functools
+import random
+import secrets
+
+MAX_ID = 386
+BITMAP_BYTES = (MAX_ID + 7) // 8
+
+
+@functools.lru_cache(maxsize=1024)
+def shuffled_deck(seed):
+    '''Returns every pokemon id in the order given by the seed.'''
+    deck = list(range(1, MAX_ID + 1))
+    random.Random(seed).shuffle(deck)
+    return tuple(deck)
+
+
+def new_seed():
+    return secrets.randbits(32)
+
+
+class SeenPokemon:
+
+    def __init__(self, bitmap=0, seed=None, cursor=0):
+        """
+        Args:
+            bitmap: Integer where bit id - 1 is set when pokemon id was seen.
+            seed: Seed of the shuffled deck, a new one is picked when None.
+            cursor: Position in the deck of the next pokemon to show.
+        """
+        self.bitmap = bitmap
+        self.seed = new_seed() if seed is None else seed
+        self.cursor = cursor
+
+    def __contains__(self, id):
+        return 1 <= id <= MAX_ID and bool(self.bitmap >> (id - 1) & 1)
+
+    def __len__(self):
+        return bin(self.bitmap).count("1")
+
+    def __eq__(self, other):
+        return isinstance(other, SeenPokemon) and self.to_json() == other.to_json()
+
+    def add(self, id):
+        '''Marks pokemon id as seen and moves the cursor past every seen pokemon.'''
+        if 1 <= id <= MAX_ID:
+            self.bitmap |= 1 << (id - 1)
+        self.skip_seen()
+
+    def is_complete(self):
+        '''Returns whether every pokemon has been seen.'''
+        return self.bitmap == (1 << MAX_ID) - 1
+
+    def reset(self):
+        '''Forgets every seen pokemon and starts a new shuffled deck.'''
+        self.bitmap = 0
+        self.seed = new_seed()
+        self.cursor = 0
+
+    def next_id(self):
+        '''Returns the next pokemon the player hasn't seen, starting over once they saw them all.'''
+        self.skip_seen()
+        if self.cursor >= MAX_ID:
+            self.reset()
+        return shuffled_deck(self.seed)[self.cursor]
+
+    def skip_seen(self):
+        '''Moves the cursor past the seen pokemon, each position is only skipped once.'''
+        deck = shuffled_deck(self.seed)
+        while self.cursor < MAX_ID and deck[self.cursor] in self:
+            self.cursor += 1
+
+    def to_json(self):
+        '''Returns the dictionary that is stored in the seen blob.'''
+        bitmap = self.bitmap.to_bytes(BITMAP_BYTES, "little")
+        return {"bitmap": base64.b64encode(bitmap).decode("ascii"), "seed": self.seed, "cursor": self.cursor}
+
+    @classmethod
+    def from_json(cls, json_obj):
+        '''Reads the stored seen blob, also accepting the old {"<id>": true} format.'''
+        if "bitmap" in json_obj:
+            bitmap = int.from_bytes(base64.b64decode(json_obj["bitmap"]), "little")
+            return cls(bitmap, json_obj["seed"], json_obj["cursor"])
+
+        # old format, a dictionary with the seen ids as keys
+        seen = cls()
+        for id in json_obj:
+            if str(id).isdigit():
+                seen.add(int(id))
+        return seen
@@ -0,0 +1,49 @@
+from flaskr.seen import SeenPokemon, MAX_ID
+import json
+
+
+def test_add_and_contains():
+    seen = SeenPokemon(seed=7)
+    seen.add(1)
+    seen.add(386)
+    assert 1 in seen and 386 in seen
+    assert 2 not in seen and 0 not in seen
+    assert len(seen) == 2
+
+
+def test_next_id_never_repeats_until_complete():
+    seen = SeenPokemon(seed=42)
+    shown = []
+    for _ in range(MAX_ID):
+        pokemon_id = seen.next_id()
+        shown.append(pokemon_id)
+        seen.add(pokemon_id)
+    assert sorted(shown) == list(range(1, MAX_ID + 1))
+    assert seen.is_complete()
+
+
+def test_next_id_starts_over_when_complete():
+    seen = SeenPokemon(bitmap=(1 << MAX_ID) - 1, seed=3, cursor=MAX_ID)
+    assert 1 <= seen.next_id() <= MAX_ID
+    assert len(seen) == 0
+
+
+def test_next_id_is_stable_until_seen():
+    seen = SeenPokemon(seed=5)
+    assert seen.next_id() == seen.next_id()
+
+
+def test_json_round_trip():
+    seen = SeenPokemon(seed=9)
+    for pokemon_id in (4, 7, 150):
+        seen.add(pokemon_id)
+    stored = json.loads(json.dumps(seen.to_json()))
+    assert SeenPokemon.from_json(stored) == seen
+    assert len(stored["bitmap"]) < 70
+
+
+def test_from_old_format():
+    seen = SeenPokemon.from_json({"4": True, "7": True, "0": True})
+    assert len(seen) == 2
+    assert 4 in seen and 7 in seen
+    assert seen.next_id() not in (4, 7)
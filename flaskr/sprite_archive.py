@@ -0,0 +1,94 @@
+"""This module packs the pokemon sprites into a single archive that is served from a memory map.
+
+The game shows one of the 386 sprites under master_pokedex/images/ every round. Instead of
+reading them one blob at a time, they are packed into one archive blob that each instance
+downloads once to a local file and maps into memory. A sprite is a memoryview slice of the
+map, so serving it copies nothing, and every worker process on the machine shares the same
+pages of the file.
+
+Archive format (little endian):
+    header: b"PKSP", version (uint32), number of sprites (uint32)
+    table:  for pokemon id 1..count, the offset of its PNG from the start of the file and its
+            length (uint32 each), a length of 0 means the sprite is missing
+    data:   the PNG bytes, one after the other
+
+Typical Usage:
+data = pack_sprites({25: pikachu_png})
+archive = SpriteArchive.open('/tmp/sprites.pack', generation=blob.generation)
+png = archive.get(25)
+"""
+
+import mmap
+import struct
+
+MAGIC = b"PKSP"
+VERSION = 1
+HEADER = struct.Struct("<4sII")
+ENTRY = struct.Struct("<II")
+
+
+def pack_sprites(sprites, count):
+    '''Builds the archive bytes.
+    Args:
+        sprites: Dictionary mapping pokemon ids to the bytes of their PNG.
+        count: Number of entries in the table, the highest pokemon id.
+    Returns:
+        Bytes of the archive.
+    '''
+    offset = HEADER.size + ENTRY.size * count
+    table = []
+    data = []
+    for id in range(1, count + 1):
+        sprite = sprites.get(id, b"")
+        table.append(ENTRY.pack(offset, len(sprite)))
+        data.append(sprite)
+        offset += len(sprite)
+    return b"".join([HEADER.pack(MAGIC, VERSION, count)] + table + data)
+
+
+class SpriteArchive:
+
+    def __init__(self, buffer, generation=None):
+        """
+        Args:
+            buffer: Bytes of the archive, e.g. a memory map of the archive file.
+            generation: Generation of the archive blob, used as the version of every sprite.
+        Raises:
+            ValueError: The buffer is not a valid archive.
+        """
+        self.buffer = memoryview(buffer)
+        self.generation = generation
+        if len(self.buffer) < HEADER.size:
+            raise ValueError("sprite archive is too short")
+        magic, version, count = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a sprite archive or an unknown version")
+        if len(self.buffer) < HEADER.size + ENTRY.size * count:
+            raise ValueError("sprite archive table is truncated")
+
+        self.count = count
+        # flat tuple of (offset, length) pairs, entry of pokemon id at index 2 * (id - 1)
+        self.table = struct.unpack_from(f"<{2 * count}I", self.buffer, HEADER.size)
+        for index in range(count):
+            if self.table[2 * index] + self.table[2 * index + 1] > len(self.buffer):
+                raise ValueError(f"sprite {index + 1} is outside of the archive")
+
+    @classmethod
+    def open(cls, path, generation=None):
+        '''Maps the archive file into memory, read only, and reads its table.'''
+        with open(path, "rb") as f:
+            # the map stays valid after the file is closed
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, generation)
+
+    def __len__(self):
+        return self.count
+
+    def get(self, id):
+        '''Returns the PNG of pokemon id as a memoryview of the archive, None if it isn't packed.'''
+        if not 1 <= id <= self.count:
+            return None
+        offset, length = self.table[2 * (id - 1)], self.table[2 * id - 1]
+        if length == 0:
+            return None
+        return self.buffer[offset:offset + length]
@@ -0,0 +1,33 @@
+from flaskr.sprite_archive import SpriteArchive, pack_sprites
+import pytest
+
+
+def test_pack_and_get():
+    archive = SpriteArchive(pack_sprites({1: b"bulbasaur", 3: b"venusaur"}, 4), generation=7)
+    assert len(archive) == 4
+    assert bytes(archive.get(1)) == b"bulbasaur"
+    assert bytes(archive.get(3)) == b"venusaur"
+    assert archive.get(2) is None
+    assert archive.get(0) is None and archive.get(5) is None
+    assert archive.generation == 7
+
+
+def test_sprites_are_views_of_the_archive():
+    data = pack_sprites({1: b"bulbasaur"}, 1)
+    sprite = SpriteArchive(data).get(1)
+    assert isinstance(sprite, memoryview)
+    assert sprite.obj is data
+
+
+def test_open_maps_the_file(tmp_path):
+    path = tmp_path / "sprites.pack"
+    path.write_bytes(pack_sprites({25: b"\x89PNG pikachu"}, 386))
+    archive = SpriteArchive.open(str(path), generation=1)
+    assert bytes(archive.get(25)) == b"\x89PNG pikachu"
+
+
+@pytest.mark.parametrize("data", [b"", b"not an archive", pack_sprites({1: b"bulbasaur"}, 1)[:-3],
+                                  pack_sprites({}, 10)[:20]])
+def test_invalid_archives_are_rejected(data):
+    with pytest.raises(ValueError):
+        SpriteArchive(data)
@@ -14,4 +14,28 @@ $(document).ready(function(){
     $('.natures-check').click(function() {
         $('.natures-check').not(this).prop('checked', false);
     });
-});
\ No newline at end of file
+});
+
+$(document).ready(function(){
+    var timer = null;
+    var latest = null;
+    $('#search').on('input', function() {
+        var query = $(this).val();
+        var suggestions = $('#search-suggestions');
+        /* wait until the user stops typing before asking for suggestions */
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            latest = query;
+            $.getJSON('/search/autocomplete', {q: query}, function(pages) {
+                /* a slower response to an older query must not replace newer suggestions */
+                if (query !== latest) {
+                    return;
+                }
+                suggestions.empty();
+                $.each(pages, function(index, page) {
+                    suggestions.append($('<option>').attr('value', page.name));
+                });
+            });
+        }, 200);
+    });
+});
@@ -0,0 +1,279 @@
+"""This module contains the storage drivers the backend can run on.
+
+The backend talks to a client with the same interface as google.cloud.storage.Client
+(get_bucket, bucket.get_blob, bucket.blob, bucket.list_blobs, blob.open, ...). The
+"gcs" driver is the real Google Cloud Storage client. The "local" driver keeps every
+bucket in a folder on disk, so the whole app can run and be profiled without network:
+
+  <root>/<bucket>/<blob name>            blob contents, read through mmap
+  <root>/<bucket>/.meta/<blob name>.json generation and content type of the blob
+
+Generations and if_generation_match preconditions behave like in the cloud, failed
+preconditions raise google.api_core.exceptions.PreconditionFailed.
+
+Typical Usage:
+client = make_client('local', '/tmp/pokemon-wiki')
+bucket = client.get_bucket('wiki-content-techx')
+bucket.blob('pages/abra').upload_from_string('{"name": "Abra"}')
+"""
+
+import io
+import json
+import mimetypes
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+# Folder inside every local bucket that holds the blob metadata
+META_FOLDER = ".meta"
+
+
+def make_client(driver="gcs", root=None):
+    """ Creates the storage client of the given driver.
+    Args:
+        driver: "gcs" for Google Cloud Storage or "local" for a folder on disk.
+        root: Folder that holds the buckets of the local driver.
+    Returns:
+        client: Storage client used by the backend.
+    """
+    if driver == "gcs":
+        from google.cloud import storage
+        return storage.Client()
+    if driver == "local":
+        if not root:
+            raise ValueError("the local storage driver needs a root folder")
+        return LocalClient(root)
+    raise ValueError(f"unknown storage driver: {driver}")
+
+
+def precondition_failed(message):
+    '''Returns the exception the cloud client raises for a failed generation precondition.'''
+    from google.api_core.exceptions import PreconditionFailed
+    return PreconditionFailed(message)
+
+
+def not_found(message):
+    '''Returns the exception the cloud client raises for a missing blob.'''
+    from google.api_core.exceptions import NotFound
+    return NotFound(message)
+
+
+class LocalClient:
+
+    def __init__(self, root):
+        """
+        Args:
+            root: Folder that holds one sub folder per bucket.
+        """
+        self.root = root
+
+    def get_bucket(self, name):
+        '''Returns the bucket, creating its folder if it doesn't exist yet.'''
+        bucket = self.bucket(name)
+        os.makedirs(bucket.path, exist_ok=True)
+        return bucket
+
+    def bucket(self, name):
+        '''Returns the bucket without touching the disk.'''
+        return LocalBucket(self, name)
+
+
+class LocalBucket:
+
+    # a single lock for every bucket so preconditions are checked and applied atomically
+    lock = threading.Lock()
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.path = os.path.join(client.root, name)
+
+    def blob(self, name):
+        '''Returns a blob handle, the blob doesn't have to exist.'''
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+        '''Returns the blob with its metadata loaded, or None if it doesn't exist.'''
+        blob = LocalBlob(self, name)
+        if not blob.exists():
+            return None
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix="", start_offset=None, max_results=None):
+        '''Returns the blobs whose name starts with prefix, ordered by name like the cloud.
+        Args:
+            prefix: Beginning of the blob names.
+            start_offset: Only blobs whose name is at least start_offset are listed.
+            max_results: Maximum number of blobs listed, None for all of them.
+        '''
+        names = []
+        for folder, subfolders, files in os.walk(self.path):
+            if folder == self.path and META_FOLDER in subfolders:
+                subfolders.remove(META_FOLDER)
+            for file_name in files:
+                if file_name.startswith(".tmp"):
+                    continue
+                path = os.path.join(folder, file_name)
+                name = os.path.relpath(path, self.path).replace(os.sep, "/")
+                if name.startswith(prefix) and (start_offset is None or name >= start_offset):
+                    names.append(name)
+        blobs = [self.get_blob(name) for name in sorted(names)[:max_results]]
+        # blobs deleted while listing are left out
+        return iter([blob for blob in blobs if blob is not None])
+
+
+class LocalBlob:
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.path, *name.split("/"))
+        self.meta_path = os.path.join(bucket.path, META_FOLDER, *name.split("/")) + ".json"
+        self.generation = None
+        self.content_type = None
+        self.size = None
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def reload(self):
+        '''Loads the generation, content type and size of the blob.'''
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        self.generation = meta["generation"]
+        self.content_type = meta["content_type"]
+        self.size = os.path.getsize(self.path)
+
+    def current_generation(self):
+        '''Returns the stored generation of the blob, 0 if it doesn't exist like in the cloud.'''
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)["generation"]
+        except FileNotFoundError:
+            return 0
+
+    def download_as_bytes(self, if_generation_match=None):
+        if if_generation_match is not None and self.current_generation() != if_generation_match:
+            raise precondition_failed(f"{self.name} does not have generation {if_generation_match}")
+        with self.open("rb") as f:
+            return f.read()
+
+    def download_as_string(self, if_generation_match=None):
+        # like the cloud client this returns bytes despite its name
+        return self.download_as_bytes(if_generation_match)
+
+    def download_as_text(self, encoding="utf-8"):
+        return self.download_as_bytes().decode(encoding)
+
+    def open(self, mode="r", encoding="utf-8"):
+        '''Opens the blob like the cloud client, reads go through mmap and writes are uploaded on close.'''
+        if mode in ("w", "wb"):
+            return _LocalWriter(self, binary=mode == "wb", encoding=encoding)
+        if mode not in ("r", "rb", "rt"):
+            raise ValueError(f"unsupported mode: {mode}")
+
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # empty files can't be mapped
+                reader = io.BytesIO(b"")
+            else:
+                reader = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mode == "rb":
+            return reader
+        return io.TextIOWrapper(io.BufferedReader(_MmapReader(reader)), encoding=encoding)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        '''Writes the blob, bumping its generation.
+        Raises:
+            PreconditionFailed: if_generation_match doesn't match the stored generation (0 for a new blob).
+        '''
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if content_type is None:
+            content_type = mimetypes.guess_type(self.name)[0] or "application/octet-stream"
+
+        with LocalBucket.lock:
+            current = self.current_generation()
+            if if_generation_match is not None and current != if_generation_match:
+                raise precondition_failed(f"{self.name} does not have generation {if_generation_match}")
+
+            # cloud generations are microsecond timestamps that always grow
+            generation = max(time.time_ns() // 1000, current + 1)
+            self.write_atomically(self.path, data)
+            meta = json.dumps({"generation": generation, "content_type": content_type})
+            self.write_atomically(self.meta_path, meta.encode("utf-8"))
+
+        self.generation = generation
+        self.content_type = content_type
+        self.size = len(data)
+
+    def upload_from_file(self, file, content_type=None, if_generation_match=None):
+        self.upload_from_string(file.read(), content_type or getattr(file, "content_type", None), if_generation_match)
+
+    def delete(self):
+        with LocalBucket.lock:
+            if not os.path.exists(self.meta_path):
+                raise not_found(f"{self.name} does not exist")
+            os.remove(self.path)
+            os.remove(self.meta_path)
+
+    @staticmethod
+    def write_atomically(path, data):
+        '''Replaces path with data so readers never see a partial file.'''
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=folder, prefix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+class _MmapReader(io.RawIOBase):
+    '''Lets io.TextIOWrapper decode text straight from a memory map.'''
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.mapped.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.mapped.close()
+        super().close()
+
+
+class _LocalWriter:
+    '''File object returned by LocalBlob.open('w'), the blob is uploaded when it is closed.'''
+
+    def __init__(self, blob, binary, encoding):
+        self.blob = blob
+        self.buffer = io.BytesIO() if binary else io.StringIO()
+        self.encoding = encoding
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def close(self):
+        data = self.buffer.getvalue()
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        self.blob.upload_from_string(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
@@ -0,0 +1,129 @@
+from flaskr.storage_drivers import LocalClient, make_client
+from flaskr.backend import Backend
+from google.api_core.exceptions import PreconditionFailed, NotFound
+import io
+import json
+import pytest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+@pytest.fixture
+def client(tmp_path):
+    return LocalClient(str(tmp_path))
+
+
+@pytest.fixture
+def bucket(client):
+    return client.get_bucket("wiki-content-techx")
+
+
+def test_upload_and_read(bucket):
+    bucket.blob("pages/abra").upload_from_string('{"name": "Abra"}', content_type="application/json")
+    blob = bucket.get_blob("pages/abra")
+    assert blob.content_type == "application/json"
+    assert blob.download_as_string() == b'{"name": "Abra"}'
+    with blob.open("r") as f:
+        assert json.loads(f.read()) == {"name": "Abra"}
+    with blob.open("rb") as f:
+        assert f.read() == b'{"name": "Abra"}'
+
+
+def test_get_missing_blob(bucket):
+    assert bucket.get_blob("pages/missingno") is None
+
+
+def test_delete(bucket):
+    bucket.blob("pages/abra").upload_from_string('{"name": "Abra"}')
+    bucket.blob("pages/abra").delete()
+    assert bucket.get_blob("pages/abra") is None
+    with pytest.raises(NotFound):
+        bucket.blob("pages/abra").delete()
+
+
+def test_open_for_writing(bucket):
+    with bucket.blob("javier").open("w") as f:
+        f.write("hashed password")
+    assert bucket.get_blob("javier").download_as_text() == "hashed password"
+
+
+def test_empty_blob(bucket):
+    bucket.blob("empty").upload_from_string(b"")
+    with bucket.get_blob("empty").open("rb") as f:
+        assert f.read() == b""
+
+
+def test_upload_from_file(bucket):
+    bucket.blob("images/abra.png").upload_from_file(io.BytesIO(b"\x89PNG"))
+    blob = bucket.get_blob("images/abra.png")
+    assert blob.content_type == "image/png"
+    assert blob.size == 4
+
+
+def test_generations(bucket):
+    blob = bucket.blob("user_game_ranking/ranks_list.json")
+    blob.upload_from_string("1", if_generation_match=0)
+    first = bucket.get_blob("user_game_ranking/ranks_list.json").generation
+
+    with pytest.raises(PreconditionFailed):
+        blob.upload_from_string("2", if_generation_match=0)
+
+    blob.upload_from_string("2", if_generation_match=first)
+    second = bucket.get_blob("user_game_ranking/ranks_list.json").generation
+    assert second > first
+
+    with pytest.raises(PreconditionFailed):
+        blob.upload_from_string("3", if_generation_match=first)
+    assert blob.download_as_string() == b"2"
+
+
+def test_list_blobs_by_prefix(bucket):
+    for name in ["pages/mudkip", "pages/abra", "images/abra.png", "pages/charmander"]:
+        bucket.blob(name).upload_from_string("{}")
+    assert [blob.name for blob in bucket.list_blobs(prefix="pages/")] == ["pages/abra", "pages/charmander", "pages/mudkip"]
+    listed = bucket.list_blobs(prefix="pages/", start_offset="pages/b", max_results=1)
+    assert [blob.name for blob in listed] == ["pages/charmander"]
+
+
+def test_make_client(tmp_path):
+    assert isinstance(make_client("local", str(tmp_path)), LocalClient)
+    with pytest.raises(ValueError):
+        make_client("local")
+    with pytest.raises(ValueError):
+        make_client("s3")
+
+
+def test_backend_on_local_storage(client):
+    backend = Backend(client)
+    image = io.BytesIO(b"\x89PNG")
+    image.filename = "treecko.png"
+    image.content_type = "image/png"
+    pokemon_data = {"name": "Treecko", "type": "Grass", "region": "Hoenn", "nature": "Calm", "level": "5"}
+
+    assert backend.upload(image, pokemon_data)
+    assert backend.get_all_page_names() == ["pages/treecko"]
+    assert backend.get_pages_using_search("tree") == ["pages/treecko"]
+    assert json.loads(backend.get_wiki_page("treecko"))["image-name"] == "treecko.png"
+    assert backend.get_image_file("images/treecko.png").data == b"\x89PNG"
+
+    assert backend.sign_up("javier", "pokemon123")
+    assert backend.sign_in("javier", "pokemon123")
+    assert not backend.sign_in("javier", "wrong")
+    assert not backend.sign_up("javier", "another")
+    assert backend.sign_in("javier", "pokemon123")
+
+
+def test_racing_sign_ups_create_one_account(tmp_path):
+    backend = Backend(LocalClient(str(tmp_path)))
+    barrier = threading.Barrier(8)
+
+    def sign_up(password):
+        barrier.wait()
+        return backend.sign_up("javier", password)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(sign_up, [f"password{i}" for i in range(8)]))
+
+    assert results.count(True) == 1
+    winner = results.index(True)
+    assert backend.sign_in("javier", f"password{winner}")
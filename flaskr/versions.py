@@ -0,0 +1,138 @@
+"""This module lets every app instance know when the data behind its in-memory caches changed.
+
+Each cached data domain (pages, leaderboard, pokedex, categories) has a small version
+blob, versions/<domain>, whose generation is the version of the domain. Writers bump
+it after changing the data, with a generation precondition so no bump is lost.
+Readers list the version blobs in one call at most once per check interval and call
+the callbacks of the domains whose version changed, so caches can live indefinitely.
+
+A writer can hand the version it created to the user (e.g. in the session), and any
+instance that serves the user's next request refreshes at once if it is behind, so
+users read their own writes. Versions only say that data changed, they don't protect
+the data: writes that can race must use their own generation preconditions.
+
+Typical Usage:
+versions = VersionStore(backend.get_content_bucket)
+versions.watch('leaderboard', drop_leaderboard_cache)
+versions.check()
+version = versions.bump('leaderboard')
+"""
+
+import threading
+import time
+
+VERSIONS_PREFIX = "versions/"
+# How often (in seconds) the version blobs are listed
+CHECK_INTERVAL = 5
+# How many times a bump is retried when another instance bumped the domain first
+BUMP_RETRIES = 5
+
+
+class VersionStore:
+
+    def __init__(self, get_bucket, check_interval=CHECK_INTERVAL, clock=time.monotonic):
+        """
+        Args:
+            get_bucket: Function that returns the bucket holding the version blobs.
+            check_interval: Minimum number of seconds between two listings of the version blobs.
+            clock: Dependency injection for mocking the time.
+        """
+        self.get_bucket = get_bucket
+        self.check_interval = check_interval
+        self.clock = clock
+        # domain -> generation of its version blob, 0 if it doesn't exist
+        self.versions = {}
+        self.checked_at = None
+        self.callbacks = {}
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def watch(self, domain, callback):
+        '''Calls callback() whenever another instance changes the data of domain.'''
+        self.callbacks.setdefault(domain, []).append(callback)
+
+    def current(self, domain):
+        '''Returns the last known version of domain.'''
+        return self.versions.get(domain, 0)
+
+    def check(self, required=None):
+        """ Lists the version blobs if the check interval passed, or right away if a required
+            version is newer than the known one.
+        Args:
+            required: Dictionary mapping domains to versions the caller must see, e.g. its own writes.
+        """
+        if not self.needs_refresh(required):
+            return
+        # one caller lists the versions, the others wait for it and then find them fresh
+        with self.refresh_lock:
+            if self.needs_refresh(required):
+                self.refresh()
+
+    def needs_refresh(self, required=None):
+        now = self.clock()
+        due = self.checked_at is None or now - self.checked_at >= self.check_interval
+        behind = any(version > self.current(domain) for domain, version in (required or {}).items())
+        return due or behind
+
+    def refresh(self, now=None):
+        '''Lists the version blobs and calls the callbacks of every domain that changed.'''
+        bucket = self.get_bucket()
+        listed = {}
+        for blob in bucket.list_blobs(prefix=VERSIONS_PREFIX):
+            listed[blob.name[len(VERSIONS_PREFIX):]] = blob.generation
+
+        with self.lock:
+            first_check = self.checked_at is None
+            changed = [domain for domain in set(listed) | set(self.versions)
+                       if listed.get(domain, 0) != self.versions.get(domain, 0)]
+            self.versions = listed
+            self.checked_at = self.clock() if now is None else now
+
+        # caches loaded before the first check already read the latest data
+        if not first_check:
+            for domain in changed:
+                self.notify(domain)
+
+    def bump(self, domain):
+        """ Marks the data of domain as changed for every instance, call it after writing the data.
+        Args:
+            domain: Name of the data domain, e.g. 'leaderboard'.
+        Returns:
+            Tuple with the version before the bump and the new version.
+        """
+        from google.api_core.exceptions import PreconditionFailed
+
+        blob = self.get_bucket().blob(VERSIONS_PREFIX + domain)
+        expected = self.current(domain)
+        for _ in range(BUMP_RETRIES):
+            try:
+                # the contents don't matter, the generation is the version
+                blob.upload_from_string(data=str(time.time()), content_type="text/plain",
+                                        if_generation_match=expected)
+                break
+            except PreconditionFailed:
+                current = self.get_bucket().get_blob(VERSIONS_PREFIX + domain)
+                expected = current.generation if current is not None else 0
+        else:
+            raise RuntimeError(f"could not bump the version of {domain}")
+
+        with self.lock:
+            known = self.versions.get(domain, 0)
+            if known == expected:
+                # nobody else changed the domain since we last saw it, so our caches are current
+                self.versions[domain] = blob.generation
+                missed = False
+            else:
+                missed = True
+        if missed:
+            # another instance changed the domain first and the caches of this one don't have its change.
+            # they are dropped, and reloading them reads both changes as long as the data itself was
+            # written with a generation precondition (e.g. the leaderboard) or can't be overwritten (pages)
+            self.notify(domain)
+            with self.lock:
+                self.versions[domain] = blob.generation
+        return expected, blob.generation
+
+    def notify(self, domain):
+        for callback in self.callbacks.get(domain, []):
+            callback()
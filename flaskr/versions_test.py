@@ -0,0 +1,121 @@
+from flaskr.versions import VersionStore
+from flaskr.storage_drivers import LocalClient
+from flaskr.backend import Backend
+import json
+import pytest
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def client(tmp_path):
+    return LocalClient(str(tmp_path))
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_store(client, clock):
+    return VersionStore(lambda: client.get_bucket("content"), check_interval=5, clock=clock)
+
+
+def test_bump_is_seen_by_other_stores_after_interval(client, clock):
+    writer = make_store(client, clock)
+    reader = make_store(client, clock)
+    changes = []
+    reader.watch("pages", lambda: changes.append("pages"))
+    reader.check()
+
+    old, new = writer.bump("pages")
+    assert old == 0
+    assert new > 0
+
+    reader.check()
+    assert changes == []
+    clock.now = 5
+    reader.check()
+    assert changes == ["pages"]
+    assert reader.current("pages") == new
+
+
+def test_required_version_refreshes_right_away(client, clock):
+    writer = make_store(client, clock)
+    reader = make_store(client, clock)
+    changes = []
+    reader.watch("leaderboard", lambda: changes.append("leaderboard"))
+    reader.check()
+
+    _, new = writer.bump("leaderboard")
+    reader.check({"leaderboard": new})
+    assert changes == ["leaderboard"]
+
+
+def test_bump_does_not_notify_the_writer(client, clock):
+    writer = make_store(client, clock)
+    changes = []
+    writer.watch("pages", lambda: changes.append("pages"))
+    writer.check()
+
+    _, new = writer.bump("pages")
+    clock.now = 5
+    writer.check()
+    assert changes == []
+    assert writer.current("pages") == new
+
+
+def test_bump_after_missed_change_notifies(client, clock):
+    first = make_store(client, clock)
+    second = make_store(client, clock)
+    changes = []
+    first.watch("pages", lambda: changes.append("pages"))
+    first.check()
+    second.bump("pages")
+
+    old, new = first.bump("pages")
+    assert old > 0
+    assert changes == ["pages"]
+    assert first.current("pages") == new
+
+
+def test_page_uploaded_on_another_instance_is_listed(client):
+    first = Backend(client)
+    second = Backend(client)
+    first.versions.check()
+    second.versions.check()
+    assert first.get_page_names() == ([], None)
+
+    second.get_content_bucket().blob("pages/abra").upload_from_string(json.dumps({"name": "Abra"}))
+    second.versions.bump("pages")
+
+    first.versions.check({"pages": second.versions.current("pages")})
+    assert first.get_page_names() == (["pages/abra"], None)
+
+
+def test_concurrent_checks_list_the_versions_once(client, clock):
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    bucket = client.get_bucket("content")
+    listings = []
+    list_blobs = bucket.list_blobs
+
+    def slow_list_blobs(*args, **kwargs):
+        listings.append(threading.get_ident())
+        time.sleep(0.05)
+        return list_blobs(*args, **kwargs)
+
+    bucket.list_blobs = slow_list_blobs
+    store = VersionStore(lambda: bucket, check_interval=5, clock=clock)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: store.check(), range(8)))
+    assert len(listings) == 1